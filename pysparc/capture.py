@@ -0,0 +1,276 @@
+"""Capture the raw data stream from the hardware.
+
+Every chunk of data read from a device can be appended to a capture log,
+together with the time of the read and the device description.  This
+makes it possible to reproduce problems offline, exactly as the data
+arrived from the hardware.
+
+A capture log consists of a series of numbered files, which are rotated
+when they reach a maximum size, and are optionally compressed.  An index
+file records the position of the data at regular time intervals, so that
+a long capture can be seeked by time.
+
+File layout: each capture file starts with :data:`MAGIC`, followed by
+records.  Each record consists of a header (timestamp as double, length
+of the device description as byte, length of the data as unsigned int,
+all big-endian), the device description and the data.  The index file
+contains entries of a timestamp (double), file number (unsigned short)
+and offset in the uncompressed file (unsigned long long).
+
+Contents
+--------
+
+:class:`CaptureError`
+    Raised on errors reading a capture log.
+
+:class:`CaptureWriter`
+    Write chunks of raw data to a capture log.
+
+:class:`CaptureReader`
+    Read chunks of raw data from a capture log.
+
+"""
+
+import glob
+import gzip
+import logging
+import re
+import struct
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+MAGIC = 'PYSPARC-CAPTURE\x01'
+RECORD_HEADER = struct.Struct('>dBI')
+INDEX_ENTRY = struct.Struct('>dHQ')
+
+# Rotate capture files when they reach this size (uncompressed)
+MAX_FILE_SIZE = 256 * 1024 * 1024
+# Write an index entry every INDEX_INTERVAL seconds
+INDEX_INTERVAL = 1.
+
+
+class CaptureError(Exception):
+
+    """Raised on errors reading a capture log."""
+
+    pass
+
+
+def _capture_filename(prefix, number, compress):
+    path = '%s.%05d.raw' % (prefix, number)
+    if compress:
+        path += '.gz'
+    return path
+
+
+def _index_filename(prefix):
+    return prefix + '.idx'
+
+
+def _open_capture_file(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode)
+    else:
+        return open(path, mode)
+
+
+class CaptureWriter(object):
+
+    """Write chunks of raw data to a capture log.
+
+    A single writer can be shared by several devices, so the order in
+    which the data of all devices was read is preserved.  Writing is
+    thread-safe.
+
+    """
+
+    def __init__(self, prefix, max_file_size=MAX_FILE_SIZE, compress=False,
+                 index_interval=INDEX_INTERVAL):
+        """Instantiate the class.
+
+        :param prefix: path prefix of the capture files.  Files are named
+            prefix.00000.raw, prefix.00001.raw, etc.  The index is named
+            prefix.idx.  Existing captures with the same prefix are
+            continued, not overwritten.
+        :param max_file_size: rotate files when they reach this size.
+        :param compress: if True, compress the capture files with gzip.
+        :param index_interval: time between index entries, in seconds.
+
+        """
+        self.prefix = prefix
+        self.max_file_size = max_file_size
+        self.compress = compress
+        self.index_interval = index_interval
+
+        self._lock = threading.Lock()
+        self._file = None
+        files = _find_capture_files(prefix)
+        self._file_number = files[-1][0] if files else -1
+        self._file_size = 0
+        self._last_index_time = None
+        self._index = open(_index_filename(prefix), 'ab')
+
+        self.n_records = 0
+        self.n_bytes = 0
+
+        self._rotate()
+
+    def write(self, description, data, timestamp=None):
+        """Append a chunk of data to the capture log.
+
+        Empty chunks are not recorded.
+
+        :param description: description of the device.
+        :param data: string containing the data read from the device.
+        :param timestamp: time of the read.  Defaults to the current time.
+
+        """
+        if not data:
+            return
+        if timestamp is None:
+            timestamp = time.time()
+
+        header = RECORD_HEADER.pack(timestamp, len(description), len(data))
+        with self._lock:
+            if self._file_size >= self.max_file_size:
+                self._rotate()
+            if (self._last_index_time is None or
+                    timestamp - self._last_index_time >= self.index_interval):
+                self._write_index_entry(timestamp)
+
+            self._file.write(header)
+            self._file.write(description)
+            self._file.write(data)
+            self._file_size += len(header) + len(description) + len(data)
+            self.n_records += 1
+            self.n_bytes += len(data)
+
+    def _write_index_entry(self, timestamp):
+        """Record the current position in the index."""
+
+        self._file.flush()
+        self._index.write(INDEX_ENTRY.pack(timestamp, self._file_number,
+                                           self._file_size))
+        self._index.flush()
+        self._last_index_time = timestamp
+
+    def _rotate(self):
+        """Close the current file and start a new one."""
+
+        if self._file is not None:
+            self._file.close()
+        self._file_number += 1
+        path = _capture_filename(self.prefix, self._file_number,
+                                 self.compress)
+        logger.info("Capturing raw data to %s", path)
+        self._file = _open_capture_file(path, 'wb')
+        self._file.write(MAGIC)
+        self._file_size = len(MAGIC)
+        # force an index entry at the start of each file
+        self._last_index_time = None
+
+    def close(self):
+        """Close the capture log."""
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._index.close()
+
+
+class CaptureReader(object):
+
+    """Read chunks of raw data from a capture log.
+
+    Iterate over the reader to get (timestamp, description, data) tuples
+    in the order in which they were written.
+
+    """
+
+    def __init__(self, prefix):
+        """Instantiate the class.
+
+        :param prefix: path prefix of the capture files, as used by the
+            :class:`CaptureWriter`.
+
+        """
+        self.prefix = prefix
+        self._files = _find_capture_files(prefix)
+        if not self._files:
+            raise CaptureError("No capture files found for %s" % prefix)
+        self._start_file = self._files[0][0]
+        self._start_offset = None
+        self._start_time = None
+
+    def read_index(self):
+        """Return the index as a list of (timestamp, file, offset)."""
+
+        try:
+            with open(_index_filename(self.prefix), 'rb') as f:
+                data = f.read()
+        except IOError:
+            return []
+        size = INDEX_ENTRY.size
+        return [INDEX_ENTRY.unpack_from(data, idx)
+                for idx in range(0, len(data) - size + 1, size)]
+
+    def seek(self, timestamp):
+        """Start reading at the first record at or after timestamp."""
+
+        self._start_file, self._start_offset = self._files[0][0], None
+        for entry_time, number, offset in self.read_index():
+            if entry_time > timestamp:
+                break
+            self._start_file, self._start_offset = number, offset
+        self._start_time = timestamp
+
+    def __iter__(self):
+        for number, path in self._files:
+            if number < self._start_file:
+                continue
+            offset = None
+            if number == self._start_file:
+                offset = self._start_offset
+            for record in self._read_file(path, offset):
+                if self._start_time is None or record[0] >= self._start_time:
+                    yield record
+
+    def _read_file(self, path, offset=None):
+        """Read all records from a single capture file."""
+
+        with _open_capture_file(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise CaptureError("Not a capture file: %s" % path)
+            if offset is not None:
+                f.seek(offset)
+            while True:
+                header = f.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    if header:
+                        logger.warning("Truncated record in %s", path)
+                    return
+                timestamp, desc_length, data_length = \
+                    RECORD_HEADER.unpack(header)
+                description = f.read(desc_length)
+                data = f.read(data_length)
+                if len(data) < data_length:
+                    logger.warning("Truncated record in %s", path)
+                    return
+                yield timestamp, description, data
+
+
+def _find_capture_files(prefix):
+    """Return a sorted list of (number, path) of all capture files."""
+
+    pattern = re.compile(re.escape(prefix) + r'\.(\d{5})\.raw(\.gz)?$')
+    files = []
+    for path in glob.glob(prefix + '.*.raw*'):
+        match = pattern.match(path)
+        if match:
+            files.append((int(match.group(1)), path))
+    return sorted(files)
@@ -0,0 +1,405 @@
+"""Read the hardware in a separate capture process.
+
+Processing events in Python competes for the interpreter lock with the
+code which drains the USB buffers of the hardware.  In this acquisition
+mode, a small capture process owns the HiSPARC devices and writes the raw
+data into shared-memory ring buffers, one per device.  The main process
+copies the data from shared memory into the read buffer of the device
+once, as it would copy data read from the USB device, and parses the
+messages from there.  When the main process can not keep up and a ring
+buffer is full, new data is dropped and counted as an overrun.
+
+The capture process is forked, so it must be started while no other USB
+devices are open in the main process.
+
+Contents
+--------
+
+:class:`SharedRingBuffer`
+    Single-producer, single-consumer byte ring buffer in shared memory.
+
+:class:`CaptureProcess`
+    Process which reads the hardware into shared ring buffers.
+
+:class:`SharedMemoryChip`
+    Stand-in for a FtdiChip, reading from a capture process.
+
+:func:`start_capture_process`
+    Move hardware devices to a capture process.
+
+"""
+
+import logging
+import mmap
+import multiprocessing
+import Queue
+import signal
+import struct
+import time
+
+from ftdi_chip import FtdiChip, ReadError
+from hardware import READ_SIZE, READER_IDLE_SLEEP
+
+
+logger = logging.getLogger(__name__)
+
+
+# Default size of the ring buffer of each device, in bytes
+RING_BUFFER_SIZE = 4 * 1024 * 1024
+# Header of a ring buffer: write position, read position, number of
+# overruns, number of dropped bytes and high-water mark, all in bytes
+RING_HEADER = struct.Struct('<5Q')
+WRITE_POS, READ_POS, N_OVERRUNS, N_BYTES_DROPPED, HIGH_WATER_MARK = \
+    range(5)
+# Timeout for the capture process to acknowledge a flush, in seconds
+FLUSH_TIMEOUT = 5.
+# Timeout for the capture process to shut down, in seconds
+SHUTDOWN_TIMEOUT = 5.
+
+
+class SharedRingBuffer(object):
+
+    """Single-producer, single-consumer byte ring buffer in shared memory.
+
+    The buffer lives in an anonymous memory map, which is shared with
+    child processes.  The producer writes at the write position, the
+    consumer reads at the read position.  Both positions only increase;
+    the position in the ring is the position modulo the size.  The
+    header with the positions and counters is only accessed while holding
+    a lock, which also guarantees that the data written before updating
+    the write position is visible to the consumer.
+
+    If there is no room for a chunk of data, the entire chunk is dropped
+    and counted as an overrun.  Partially writing a chunk would only
+    postpone the overrun.
+
+    """
+
+    def __init__(self, size=RING_BUFFER_SIZE):
+        """Instantiate the class.
+
+        :param size: size of the ring buffer in bytes.
+
+        """
+        self.size = size
+        self._mmap = mmap.mmap(-1, RING_HEADER.size + size)
+        self._lock = multiprocessing.Lock()
+
+    def __len__(self):
+        """Number of bytes available to the consumer."""
+
+        with self._lock:
+            header = RING_HEADER.unpack_from(self._mmap)
+        return header[WRITE_POS] - header[READ_POS]
+
+    def write(self, data):
+        """Write data to the buffer (producer).
+
+        :param data: string containing the data.
+        :returns: True if the data was written, False if the data was
+            dropped because the buffer is full.
+
+        """
+        length = len(data)
+        with self._lock:
+            header = list(RING_HEADER.unpack_from(self._mmap))
+        write_pos = header[WRITE_POS]
+        if write_pos - header[READ_POS] + length > self.size:
+            with self._lock:
+                header = list(RING_HEADER.unpack_from(self._mmap))
+                header[N_OVERRUNS] += 1
+                header[N_BYTES_DROPPED] += length
+                RING_HEADER.pack_into(self._mmap, 0, *header)
+            return False
+
+        start = RING_HEADER.size + write_pos % self.size
+        first = min(length, RING_HEADER.size + self.size - start)
+        self._mmap[start:start + first] = data[:first]
+        if first < length:
+            self._mmap[RING_HEADER.size:RING_HEADER.size + length - first] = \
+                data[first:]
+
+        with self._lock:
+            header = list(RING_HEADER.unpack_from(self._mmap))
+            header[WRITE_POS] = write_pos + length
+            header[HIGH_WATER_MARK] = max(
+                header[HIGH_WATER_MARK], header[WRITE_POS] - header[READ_POS])
+            RING_HEADER.pack_into(self._mmap, 0, *header)
+        return True
+
+    def peek(self, max_size=None):
+        """Return a view on the data at the read position (consumer).
+
+        The data is not copied.  Only contiguous data is returned, so when
+        the data wraps around the end of the ring, the remainder is
+        returned by the next call.  The view remains valid until the data
+        is consumed using :meth:`consume`.
+
+        :param max_size: maximum number of bytes in the view.
+        :returns: a read-only buffer object.
+
+        """
+        with self._lock:
+            header = RING_HEADER.unpack_from(self._mmap)
+        read_pos = header[READ_POS]
+        offset = read_pos % self.size
+        length = min(header[WRITE_POS] - read_pos, self.size - offset)
+        if max_size is not None:
+            length = min(length, max_size)
+        return buffer(self._mmap, RING_HEADER.size + offset, length)
+
+    def consume(self, n):
+        """Advance the read position by n bytes (consumer).
+
+        :param n: number of bytes to consume.
+
+        """
+        with self._lock:
+            header = list(RING_HEADER.unpack_from(self._mmap))
+            header[READ_POS] = min(header[READ_POS] + n, header[WRITE_POS])
+            RING_HEADER.pack_into(self._mmap, 0, *header)
+
+    def discard(self):
+        """Discard all data in the buffer."""
+
+        with self._lock:
+            header = list(RING_HEADER.unpack_from(self._mmap))
+            header[READ_POS] = header[WRITE_POS]
+            RING_HEADER.pack_into(self._mmap, 0, *header)
+
+    def get_stats(self):
+        """Return the counters of the buffer.
+
+        :returns: dictionary with the total number of bytes written, the
+            number of bytes in the buffer, the high-water mark in bytes,
+            the size, the number of overruns and the number of bytes
+            dropped because of overruns.
+
+        """
+        with self._lock:
+            header = RING_HEADER.unpack_from(self._mmap)
+        return {'n_bytes': header[WRITE_POS],
+                'length': header[WRITE_POS] - header[READ_POS],
+                'high_water_mark': header[HIGH_WATER_MARK],
+                'size': self.size,
+                'n_overruns': header[N_OVERRUNS],
+                'n_bytes_dropped': header[N_BYTES_DROPPED]}
+
+
+class CaptureProcess(multiprocessing.Process):
+
+    """Process which reads the hardware into shared ring buffers.
+
+    The process opens the devices itself, since a USB device can only be
+    claimed by one process.  Commands for the devices, like writing
+    messages or flushing, are sent through a queue.
+
+    """
+
+    def __init__(self, devices, ring_size=RING_BUFFER_SIZE):
+        """Instantiate the class.
+
+        :param devices: list of (description, interface_select) tuples of
+            the FTDI devices to read.
+        :param ring_size: size of the ring buffer of each device.
+
+        """
+        super(CaptureProcess, self).__init__()
+        self.daemon = True
+
+        self.devices = devices
+        self.rings = dict((description, SharedRingBuffer(ring_size))
+                          for description, _ in devices)
+        self.commands = multiprocessing.Queue()
+        self._flushed = multiprocessing.Event()
+        self._must_shutdown = multiprocessing.Event()
+
+    def run(self):
+        """Read the devices until a shutdown is signalled."""
+
+        # the main process handles interrupts and stops this process
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+        chips = {}
+        try:
+            for description, interface_select in self.devices:
+                chips[description] = FtdiChip(
+                    description, interface_select=interface_select)
+            while not self._must_shutdown.is_set():
+                self.process_commands(chips)
+                if not self.read_devices(chips):
+                    time.sleep(READER_IDLE_SLEEP)
+        except Exception as exc:
+            logger.error("Capture process stopped: %s", exc)
+        finally:
+            for chip in chips.values():
+                chip.close()
+
+    def read_devices(self, chips):
+        """Read all devices into their ring buffers.
+
+        :returns: the number of bytes read.
+
+        """
+        n_bytes = 0
+        for description, chip in chips.iteritems():
+            data = chip.read(READ_SIZE)
+            if data:
+                if not self.rings[description].write(data):
+                    logger.warning("Overrun: dropped %d bytes from %s",
+                                   len(data), description)
+                n_bytes += len(data)
+        return n_bytes
+
+    def process_commands(self, chips):
+        """Execute all commands waiting in the queue."""
+
+        while True:
+            try:
+                description, command, arg = self.commands.get_nowait()
+            except Queue.Empty:
+                return
+            chip = chips[description]
+            if command == 'write':
+                chip.write(arg)
+            elif command == 'flush':
+                chip.flush()
+                self.rings[description].discard()
+                self._flushed.set()
+            elif command == 'latency_timer':
+                chip.set_latency_timer(arg)
+
+    def send_command(self, description, command, arg=None):
+        """Send a command for a device to the capture process.
+
+        :param description: description of the device.
+        :param command: 'write', 'flush' or 'latency_timer'.
+        :param arg: data to write, or the latency timer in ms.
+
+        """
+        self.commands.put((description, command, arg))
+
+    def flush(self, description, timeout=FLUSH_TIMEOUT):
+        """Flush a device and its ring buffer.
+
+        Blocks until the capture process has flushed the device, so all
+        data read afterwards is newly measured.
+
+        """
+        self._flushed.clear()
+        self.send_command(description, 'flush')
+        if not self._flushed.wait(timeout):
+            logger.warning("Capture process did not flush %s", description)
+
+    def get_stats(self):
+        """Return the ring buffer counters of all devices.
+
+        :returns: dictionary of :meth:`SharedRingBuffer.get_stats`
+            dictionaries, by device description.
+
+        """
+        return dict((description, ring.get_stats())
+                    for description, ring in self.rings.iteritems())
+
+    def stop(self):
+        """Signal a shutdown and wait for the process to finish."""
+
+        self._must_shutdown.set()
+        self.join(SHUTDOWN_TIMEOUT)
+        if self.is_alive():
+            logger.error("Capture process did not stop, terminating.")
+            self.terminate()
+
+
+class SharedMemoryChip(object):
+
+    """Stand-in for a FtdiChip, reading from a capture process.
+
+    Reads return a view on the ring buffer in shared memory, instead of a
+    string.  The view is valid until the next read or flush, after which
+    the data is consumed, so the hardware class copies the data into its
+    read buffer before reading again.
+
+    """
+
+    closed = False
+    latency_timer = None
+
+    def __init__(self, process, description):
+        """Instantiate the class.
+
+        :param process: :class:`CaptureProcess` instance.
+        :param description: description of the device.
+
+        """
+        self.process = process
+        self.description = description
+        self.ring = process.rings[description]
+        self._lent = 0
+
+    def read(self, read_size=None):
+        """Return a view on the data read by the capture process.
+
+        Raises :class:`pysparc.ftdi_chip.ReadError` when the capture
+        process stopped and all data is consumed.
+
+        :param read_size: maximum number of bytes.
+
+        """
+        self._release()
+        data = self.ring.peek(read_size)
+        if not data and not self.process.is_alive():
+            raise ReadError("capture process stopped.")
+        self._lent = len(data)
+        return data
+
+    def _release(self):
+        """Consume the data of the previous read."""
+
+        if self._lent:
+            self.ring.consume(self._lent)
+            self._lent = 0
+
+    def write(self, data):
+        self.process.send_command(self.description, 'write', data)
+
+    def flush(self):
+        self._release()
+        self.process.flush(self.description)
+
+    def set_latency_timer(self, latency):
+        self.process.send_command(self.description, 'latency_timer', latency)
+        self.latency_timer = latency
+
+    def close(self):
+        self.closed = True
+
+
+def start_capture_process(devices, ring_size=RING_BUFFER_SIZE):
+    """Move hardware devices to a capture process.
+
+    The FTDI devices are closed, reopened in a new capture process, and
+    replaced by :class:`SharedMemoryChip` instances.  The hardware
+    instances can be used as before, but must not use reader threads.
+    Start the capture process before starting other threads and before
+    opening other USB devices, like the GPS, since the process is forked
+    and would inherit their open handles.
+
+    :param devices: list of :class:`pysparc.hardware.BaseHardware`
+        instances.
+    :param ring_size: size of the ring buffer of each device.
+    :returns: the running :class:`CaptureProcess`.
+
+    """
+    specs = []
+    for device in devices:
+        specs.append((device.description, device._device.interface_select))
+        device._device.close()
+
+    process = CaptureProcess(specs, ring_size)
+    process.start()
+    for device in devices:
+        device._device = SharedMemoryChip(process, device.description)
+    logger.info("Started capture process for %s",
+                ', '.join(description for description, _ in specs))
+    return process
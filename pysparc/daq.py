@@ -0,0 +1,565 @@
+"""HiSPARC data acquisition in Python (PySPARC)
+
+The data acquisition reads the HiSPARC hardware and the GPS, cooks the
+event messages into events, mixes the events of primary and secondary
+devices and stores them.  The bin/pysparc_daq script runs it.  The
+hardware is opened by overridable methods, so the same pipeline can be
+driven by replayed hardware, see :mod:`pysparc.replay`.
+
+Contents
+--------
+
+:class:`DataAcquisition`
+    HiSPARC data acquisition using a single (primary) device.
+
+:class:`PrimarySecondaryDataAcquisition`
+    HiSPARC data acquisition using a primary/secondary setup.
+
+"""
+
+import logging
+import os
+import time
+import ConfigParser
+
+import pkg_resources
+import schedule
+
+from hardware import (HiSPARCII, HiSPARCIII, TrimbleGPS, AdaptiveReadPolicy,
+                      DataAvailable)
+from ftdi_chip import DeviceNotFoundError
+from align_adcs import AlignADCs, AlignADCsPrimarySecondary
+from events import Stew, ConfigEvent, Mixer, EventAnalysisPool
+import messages
+import storage
+import monitor
+from capture import CaptureWriter
+from gps_telemetry import GPSReader
+from capture_process import start_capture_process
+
+
+logger = logging.getLogger(__name__)
+
+
+SYSTEM_CONFIGFILE = pkg_resources.resource_filename('pysparc', 'config.ini')
+CONFIGFILE = os.path.expanduser('~/.pysparc')
+DATAFILE = os.path.expanduser('~/hisparc.h5')
+CAPTUREFILE = os.path.expanduser('~/hisparc_capture')
+ALL_CONFIG_FILES = [SYSTEM_CONFIGFILE, CONFIGFILE]
+
+# Maximum time the main loop waits for data when idle, in seconds
+MAX_IDLE_WAIT = 1.
+# Sleep time of the main loop after an empty read, if the devices are read
+# without reader threads.  Well below the latency timer of the devices.
+IDLE_SLEEP = .005
+
+
+def run_once(func, *args, **kwargs):
+    """Run a job only once."""
+
+    func(*args, **kwargs)
+    return schedule.CancelJob
+
+
+class DataAcquisition(object):
+
+    """HiSPARC data acquisition using a single (primary) device"""
+
+    def __init__(self):
+        self.config = ConfigParser.ConfigParser()
+        self.read_config()
+
+        self.open_hisparc_hardware()
+        self.initialize_hardware()
+        self.start_capture()
+        self.set_read_policies()
+        # start the capture process before any other threads, and while no
+        # other USB devices are open, since it is forked
+        self.move_devices_to_capture_process()
+        self.open_gps()
+        self.initialize_gps()
+        self.write_config()
+        self.start_analysis_pool()
+        # set by the reader threads when data is available, if enabled
+        self.data_available = None
+        self.start_readers()
+        self.gps_reader = GPSReader(self.gps)
+        self.gps_reader.start()
+
+        self.primary_stew = Stew(self.analysis_pool)
+        self.start_storage()
+
+        station_name = self.config.get('DAQ', 'station_name')
+        self.monitor = monitor.Monitor(station_name)
+
+    def read_config(self):
+        logger.info("Reading config from file")
+        self.config.read(ALL_CONFIG_FILES)
+
+    def start_storage(self):
+        """Store events in the datastore, and in a file if enabled"""
+
+        station_number = self.config.getint('DAQ', 'station_number')
+        station_password = self.config.get('DAQ', 'station_password')
+
+        self.storage_manager = storage.StorageManager()
+        self.datastore = storage.NikhefDataStore(station_number,
+                                                 station_password)
+        self.storage_manager.add_datastore(self.datastore, 'queue_nikhef')
+
+        store_data_in_file = self.config.getboolean('DAQ',
+                                                    'store_data_in_file')
+        if store_data_in_file:
+            self.filestore = storage.TablesDataStore(DATAFILE)
+            self.storage_manager.add_datastore(self.filestore, 'queue_file')
+
+    def open_hisparc_hardware(self):
+        try:
+            self.primary = HiSPARCIII()
+        except DeviceNotFoundError:
+            self.primary = HiSPARCII()
+
+        # Give hardware 20 seconds to start up
+        self.t_last_msg = time.time() + 20
+
+    def open_gps(self):
+        self.gps = TrimbleGPS()
+        if self.capture is not None:
+            self.gps.start_capture(self.capture)
+
+    def start_capture(self):
+        """Capture the raw data stream, if enabled in the config"""
+
+        self.capture = None
+        if (self.config.has_option('DAQ', 'capture_raw_data') and
+                self.config.getboolean('DAQ', 'capture_raw_data')):
+            compress = (
+                self.config.has_option('DAQ', 'capture_compress') and
+                self.config.getboolean('DAQ', 'capture_compress'))
+            self.capture = CaptureWriter(CAPTUREFILE, compress=compress)
+            for device in self.hisparc_devices():
+                device.start_capture(self.capture)
+
+    def set_read_policies(self):
+        """Adapt read sizes to the data rate, if enabled in the config"""
+
+        if (self.config.has_option('DAQ', 'adaptive_io') and
+                self.config.getboolean('DAQ', 'adaptive_io')):
+            self.primary.set_read_policy(self.create_read_policy())
+
+    def create_read_policy(self):
+        kwargs = {}
+        for option in ['min_read_size', 'max_read_size',
+                       'min_latency_timer', 'max_latency_timer']:
+            if self.config.has_option('DAQ', option):
+                kwargs[option] = self.config.getint('DAQ', option)
+        return AdaptiveReadPolicy(**kwargs)
+
+    def hisparc_devices(self):
+        return [self.primary]
+
+    def move_devices_to_capture_process(self):
+        """Read the devices in a separate process, if enabled in the config"""
+
+        self.capture_process = None
+        self.n_overruns = 0
+        if (self.config.has_option('DAQ', 'use_capture_process') and
+                self.config.getboolean('DAQ', 'use_capture_process')):
+            kwargs = {}
+            if self.config.has_option('DAQ', 'ring_buffer_size'):
+                kwargs['ring_size'] = self.config.getint('DAQ',
+                                                         'ring_buffer_size')
+            self.capture_process = start_capture_process(
+                self.hisparc_devices(), **kwargs)
+
+    def start_analysis_pool(self):
+        """Analyze events in worker processes, if enabled in the config"""
+
+        self.analysis_pool = None
+        if (self.config.has_option('DAQ', 'use_analysis_pool') and
+                self.config.getboolean('DAQ', 'use_analysis_pool')):
+            processes = None
+            if self.config.has_option('DAQ', 'analysis_processes'):
+                # 0 means one worker per CPU core
+                processes = self.config.getint('DAQ',
+                                               'analysis_processes') or None
+            self.analysis_pool = EventAnalysisPool(processes)
+            logger.info("Started %d event analysis processes.",
+                        self.analysis_pool.processes)
+
+    def start_readers(self):
+        """Read the devices in background threads, if enabled in the config"""
+
+        if self.capture_process is not None:
+            # the capture process already reads the devices
+            return
+        if (self.config.has_option('DAQ', 'use_reader_threads') and
+                self.config.getboolean('DAQ', 'use_reader_threads')):
+            self.data_available = DataAvailable()
+            self.primary.start_reader(data_available=self.data_available)
+
+    def initialize_hardware(self):
+        logger.info("Initializing device configuration")
+        self.configure_devices()
+
+        if self.config.getboolean('DAQ', 'force_align_adcs'):
+            logger.info("Force aligning ADCs.")
+            self.align_adcs()
+            self.config.set('DAQ', 'force_align_adcs', False)
+
+    def initialize_gps(self):
+        if self.config.getboolean('DAQ', 'force_reset_gps'):
+            logger.info("Force reset GPS to factory defaults.")
+            self.gps.reset_defaults()
+            self.config.set('DAQ', 'force_reset_gps', False)
+
+    def configure_devices(self):
+        """Read configuration into device"""
+        self.primary.config.read_config(self.config)
+
+    def align_adcs(self):
+        """Align ADCs"""
+        align_adcs = AlignADCs(self.primary)
+        align_adcs.align()
+
+    def run(self):
+        """Take data, process and store events"""
+
+        # The first configuration message does not include GPS information.
+        # Flush it, and possibly other outdated messages, and request it later.
+        self.flush_devices()
+        self.schedule_jobs()
+
+        logger.info("Taking data.")
+
+        try:
+            while True:
+                n_msgs = self.read_and_process_messages()
+                schedule.run_pending()
+                if not n_msgs:
+                    self.wait_for_data()
+
+        except KeyboardInterrupt:
+            logger.info("Interrupted by user.")
+
+    def schedule_jobs(self):
+        """Schedule jobs for the data run"""
+
+        schedule.every(1).seconds.do(self.process_and_store_events)
+        schedule.every(30).seconds.do(self.request_config_from_device)
+        schedule.every(30).seconds.do(self.check_silent_devices)
+        schedule.every().minute.do(self.send_monitor_messages)
+        schedule.every().minute.do(self.log_status)
+        schedule.every().day.at('2:00').do(self.store_config_event)
+
+        # After 1 minute, store the configuration *once*
+        schedule.every().minute.do(run_once, self.store_config_event)
+
+    def wait_for_data(self):
+        """Wait for data, without delaying scheduled jobs.
+
+        With reader threads, block until any of them has read data.
+        Otherwise, sleep briefly before reading the devices again.
+
+        """
+        timeout = min(max(schedule.idle_seconds(), 0), MAX_IDLE_WAIT)
+        if self.data_available is not None:
+            self.data_available.wait(timeout)
+            self.data_available.clear()
+        else:
+            time.sleep(min(timeout, IDLE_SLEEP))
+
+    def read_and_process_messages(self):
+        """Read messages from the hardware and process them
+
+        :returns: the number of messages read.
+
+        """
+        msgs = self.primary.read_messages()
+        if msgs:
+            self.t_last_msg = time.time()
+            for msg in msgs:
+                self.process_message(msg, self.primary_stew)
+        return len(msgs)
+
+    def process_message(self, msg, stew):
+        """Process a hardware message and throw it in the stew."""
+        if isinstance(msg, messages.MeasuredDataMessage):
+            stew.add_event_message(msg)
+        elif isinstance(msg, messages.OneSecondMessage):
+            stew.add_one_second_message(msg)
+            logger.debug("One-second received: %d (%d %d %d %d)",
+                         msg.timestamp, msg.count_ch1_low, msg.count_ch1_high,
+                         msg.count_ch2_low, msg.count_ch2_high)
+        elif isinstance(msg, messages.ControlParameterList):
+            # No need to process this message. This is already done in the
+            # hardware class
+            pass
+
+    def process_and_store_events(self):
+        """Process events from the stew and store them in the datastore."""
+        self.primary_stew.stir()
+        events = self.primary_stew.serve_events()
+        self.store_events(events)
+        self.primary_stew.drain()
+
+    def send_monitor_messages(self):
+        """Send all monitor messages."""
+        self.monitor.send_uptime()
+        self.monitor.send_cpu_load()
+        self.monitor.send_trigger_rate(self.primary_stew.event_rate(),
+                                       self.primary_stew.get_event_rates())
+        self.monitor.send_gps_status(self.gps_reader.telemetry.get_status())
+
+    def log_status(self):
+        rates = self.primary_stew.get_event_rates()
+        logger.info("Event rate: %.1f Hz (1 s: %.1f, 10 s: %.1f, "
+                    "10 min: %.1f Hz)", rates[60], rates[1], rates[10],
+                    rates[600])
+        gps_status = self.gps_reader.telemetry.get_status()
+        logger.info("GPS clock bias: %.1f +- %.1f ns, temperature: %.1f C",
+                    gps_status['clock_bias_mean'],
+                    gps_status['clock_bias_std'],
+                    gps_status['temperature_mean'])
+        self.log_io_stats(self.primary)
+        self.log_drain_stats(self.primary, self.primary_stew)
+        self.log_capture_process_stats()
+
+    def log_capture_process_stats(self):
+        if self.capture_process is None:
+            return
+        n_overruns = 0
+        for description, stats in self.capture_process.get_stats().items():
+            logger.info("%s ring buffer: %d bytes, high-water mark %d/%d, "
+                        "%d overruns (%d bytes dropped)", description,
+                        stats['n_bytes'], stats['high_water_mark'],
+                        stats['size'], stats['n_overruns'],
+                        stats['n_bytes_dropped'])
+            n_overruns += stats['n_overruns']
+        if n_overruns > self.n_overruns:
+            logger.warning("Processing can not keep up: %d new ring buffer "
+                           "overruns.", n_overruns - self.n_overruns)
+        self.n_overruns = n_overruns
+
+    def log_drain_stats(self, device, stew):
+        stats = stew.get_drain_stats()
+        logger.info("%s stew drained: %d perished event messages, %d "
+                    "stale one-second messages", device.description,
+                    stats['perished_events'],
+                    stats['stale_one_second_messages'])
+
+    def log_io_stats(self, device):
+        stats = device.get_read_policy_stats()
+        if stats is not None:
+            logger.info("%s USB: %.1f transfers/s, %.0f bytes/transfer, "
+                        "read size %d, latency timer %d ms",
+                        device.description, stats['transfers_per_second'],
+                        stats['bytes_per_transfer'], stats['read_size'],
+                        stats['latency_timer'])
+        stats = device.get_reader_stats()
+        if stats is not None:
+            logger.info("%s reader: %d chunks, %d bytes, queue high-water "
+                        "mark %d/%d, full %d times", device.description,
+                        stats['n_chunks'], stats['n_bytes'],
+                        stats['high_water_mark'], stats['queue_size'],
+                        stats['n_full'])
+
+    def request_config_from_device(self):
+        """Request configuration from device.
+
+        This includes gps positions and PMT currents. When the hardware
+        responds, the config objects are automatically updated by the hardware
+        classes when the message is read, and are available a short time after
+        calling this method.
+
+        """
+        self.primary.send_message(messages.GetControlParameterList())
+
+    def check_silent_devices(self):
+        if time.time() - self.t_last_msg > 20:
+            logger.error("Hardware is silent, resetting.")
+            self.reset_devices()
+
+    def flush_devices(self):
+        """Flush devices"""
+        self.primary.flush_device()
+
+    def reset_devices(self):
+        """Reset hardware devices"""
+        self.primary.reset_hardware()
+
+    def store_events(self, events):
+        for event in events:
+            try:
+                self.storage_manager.store_event(event)
+            except Exception as e:
+                logger.error(str(e))
+        logger.debug("Stored %d events.", len(events))
+
+    def store_config_event(self):
+        config = ConfigEvent(self.primary.config)
+        self.storage_manager.store_event(config)
+        logger.info("Sent configuration message.")
+
+    def write_config(self):
+        self.primary.config.write_config(self.config)
+        with open(CONFIGFILE, 'w') as f:
+            self.config.write(f)
+
+    def close(self):
+        logger.info("Closing down")
+        self.gps_reader.stop()
+        self.gps.close()
+        for device in self.hisparc_devices():
+            device.close()
+        if self.capture_process is not None:
+            self.capture_process.stop()
+        if self.capture is not None:
+            # flush the last records, and the gzip trailer
+            self.capture.close()
+        if self.analysis_pool is not None:
+            self.analysis_pool.close()
+        self.close_storage()
+
+    def close_storage(self):
+        self.storage_manager.close()
+        self.datastore.close()
+
+
+class PrimarySecondaryDataAcquisition(DataAcquisition):
+
+    """HiSPARC data acquisition using a primary/secondary setup"""
+
+    def __init__(self):
+        super(PrimarySecondaryDataAcquisition, self).__init__()
+
+        self.secondary_stew = Stew(self.analysis_pool)
+        self.mixer = self.create_mixer()
+
+    def create_mixer(self):
+        """Create the mixer, with the eviction settings in the config"""
+
+        kwargs = {}
+        if self.config.has_option('DAQ', 'mixer_horizon'):
+            kwargs['horizon'] = self.config.getfloat('DAQ', 'mixer_horizon')
+        if self.config.has_option('DAQ', 'store_unmatched_events'):
+            kwargs['store_unmatched'] = self.config.getboolean(
+                'DAQ', 'store_unmatched_events')
+        return Mixer(**kwargs)
+
+    def open_hisparc_hardware(self):
+        try:
+            self.secondary = HiSPARCIII(secondary=True)
+        except DeviceNotFoundError:
+            self.secondary = HiSPARCII(secondary=True)
+        super(PrimarySecondaryDataAcquisition, self).open_hisparc_hardware()
+
+        # Give hardware 20 seconds to start up
+        self.t_last_secondary_msg = time.time() + 20
+
+    def configure_devices(self):
+        """Read configuration into device"""
+        super(PrimarySecondaryDataAcquisition, self).configure_devices()
+        self.secondary.config.read_config(self.config)
+
+    def hisparc_devices(self):
+        return [self.primary, self.secondary]
+
+    def set_read_policies(self):
+        """Adapt read sizes to the data rate, if enabled in the config"""
+        super(PrimarySecondaryDataAcquisition, self).set_read_policies()
+        if self.primary.get_read_policy_stats() is not None:
+            self.secondary.set_read_policy(self.create_read_policy())
+
+    def start_readers(self):
+        """Read the devices in background threads, if enabled in the config"""
+        super(PrimarySecondaryDataAcquisition, self).start_readers()
+        if self.data_available is not None:
+            self.secondary.start_reader(data_available=self.data_available)
+
+    def align_adcs(self):
+        """Align ADCs"""
+        align_adcs = AlignADCsPrimarySecondary(self.primary, self.secondary)
+        align_adcs.align()
+
+    def read_and_process_messages(self):
+        """Read messages from the hardware and process them"""
+
+        n_msgs = super(PrimarySecondaryDataAcquisition,
+                       self).read_and_process_messages()
+
+        msgs = self.secondary.read_messages()
+        if msgs:
+            self.t_last_secondary_msg = time.time()
+            for msg in msgs:
+                self.process_message(msg, self.secondary_stew)
+        return n_msgs + len(msgs)
+
+    def process_and_store_events(self):
+        """Process events from the stew and store them in the datastore."""
+        self.primary_stew.stir()
+        self.secondary_stew.stir()
+
+        primary_events = self.primary_stew.serve_events()
+        self.mixer.add_primary_events(primary_events)
+        secondary_events = self.secondary_stew.serve_events()
+        self.mixer.add_secondary_events(secondary_events)
+
+        self.mixer.mix()
+        self.mixer.drain()
+        events = self.mixer.serve_events()
+
+        self.store_events(events)
+
+        self.primary_stew.drain()
+        self.secondary_stew.drain()
+
+    def log_status(self):
+        super(PrimarySecondaryDataAcquisition, self).log_status()
+        self.log_io_stats(self.secondary)
+        self.log_drain_stats(self.secondary, self.secondary_stew)
+        stats = self.mixer.get_stats()
+        logger.info("Mixer: %d primary and %d secondary events pending "
+                    "(%d bytes), %d mixed, unmatched: %d primary stored, "
+                    "%d primary dropped, %d secondary dropped",
+                    stats['n_primary'], stats['n_secondary'],
+                    stats['n_bytes'], stats['n_mixed'],
+                    stats['n_stored_primary'], stats['n_dropped_primary'],
+                    stats['n_dropped_secondary'])
+
+    def request_config_from_device(self):
+        """Request configuration from device.
+
+        This includes gps positions and PMT currents. When the hardware
+        responds, the config objects are automatically updated by the hardware
+        classes when the message is read, and are available a short time after
+        calling this method.
+
+        """
+        super(PrimarySecondaryDataAcquisition, self).request_config_from_device()
+        self.secondary.send_message(messages.GetControlParameterList())
+
+    def check_silent_devices(self):
+        now = time.time()
+        if (now - self.t_last_msg > 20) or (now - self.t_last_secondary_msg > 20):
+            logger.error("Hardware is silent, resetting.")
+            self.reset_devices()
+
+    def flush_devices(self):
+        """Flush devices"""
+        super(PrimarySecondaryDataAcquisition, self).flush_devices()
+        self.secondary.flush_device()
+
+    def reset_devices(self):
+        """Reset hardware devices"""
+        super(PrimarySecondaryDataAcquisition, self).reset_devices()
+        self.secondary.reset_hardware()
+
+    def store_config_event(self):
+        config = ConfigEvent(self.primary.config, self.secondary.config)
+        self.storage_manager.store_event(config)
+        logger.info("Sent configuration message.")
+
+    def write_config(self):
+        self.secondary.config.write_config(self.config)
+        super(PrimarySecondaryDataAcquisition, self).write_config()
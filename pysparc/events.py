@@ -1,12 +1,19 @@
 from __future__ import division
 
+import bisect
 import collections
 import datetime
+import heapq
 import logging
+import multiprocessing
+import signal
 import time
 import zlib
 
 import numpy as np
+from lazy import lazy
+
+from messages import unpack_raw_traces
 
 
 logger = logging.getLogger(__name__)
@@ -16,8 +23,13 @@ logger = logging.getLogger(__name__)
 FRESHNESS_TIME = 10
 # Number of seconds over which to average event rate
 EVENTRATE_TIME = 60
+# Windows over which event rates are available, in seconds
+EVENTRATE_WINDOWS = (1, 10, 60, 600)
 # Maximum allowed time difference between primary and secondary events
 MAX_FOUR_CHANNEL_DELAY = 5000
+# Unmatched events older than this (in seconds), relative to the latest
+# event, are evicted from the mixer
+MIXER_HORIZON = 10
 
 SYNCHRONIZATION_BIT = 1 << 31
 CTP_BITS = (1 << 31) - 1
@@ -26,6 +38,10 @@ NANOSECONDS_PER_SECOND = int(1e9)
 INTEGRAL_THRESHOLD = 25
 # default low threshold for signals (approx. 30 mV above baseline)
 PEAK_THRESHOLD = 50
+# Initial number of samples searched at once for the start or end of a peak
+PEAK_BLOCK_SIZE = 64
+# Number of possible values of a 12-bit ADC sample
+N_SAMPLE_VALUES = 1 << 12
 
 
 class MissingOneSecondMessage(Exception):
@@ -33,20 +49,172 @@ class MissingOneSecondMessage(Exception):
     pass
 
 
+class EventRateCounter(object):
+
+    """Count events per GPS second in a ring buffer.
+
+    The counts of the last seconds are kept in a fixed-size circular
+    array, indexed by GPS second modulo the size.  For each window, the
+    number of events in the window is kept up to date when events are
+    counted and when the current second advances, so that counting an
+    event and looking up a rate take constant time.
+
+    The current second is still in progress, so the windows consist of
+    the complete seconds before the current second.
+
+    """
+
+    def __init__(self, windows=EVENTRATE_WINDOWS, size=None):
+        """Instantiate the class.
+
+        :param windows: windows over which rates are available, in
+            seconds.
+        :param size: number of seconds in the ring buffer.  Defaults to
+            one more than the largest window, which is the minimum.
+
+        """
+        self.windows = sorted(windows)
+        if size is None:
+            size = self.windows[-1] + 1
+        elif size <= self.windows[-1]:
+            raise ValueError("Size must be larger than the largest window.")
+        self.size = size
+        self._counts = np.zeros(size, dtype=np.int64)
+        self._totals = dict((window, 0) for window in self.windows)
+        self.current_second = None
+
+    def advance(self, timestamp):
+        """Advance the current second.
+
+        :param timestamp: GPS second.  If it is not later than the
+            current second, nothing happens.
+
+        """
+        current = self.current_second
+        if current is None or timestamp - current >= self.size:
+            self._counts[:] = 0
+            self._totals = dict((window, 0) for window in self.windows)
+        elif timestamp > current:
+            counts = self._counts
+            for second in range(current, timestamp):
+                # second is complete, and enters all windows
+                count = counts[second % self.size]
+                for window in self.windows:
+                    self._totals[window] += (
+                        count - counts[(second - window) % self.size])
+                counts[(second + 1) % self.size] = 0
+        else:
+            return
+        self.current_second = timestamp
+
+    def increment(self, timestamp, n=1):
+        """Count events.
+
+        :param timestamp: GPS second of the events.  Events older than
+            the ring buffer are ignored.
+        :param n: number of events.
+
+        """
+        if self.current_second is None or timestamp > self.current_second:
+            self.advance(timestamp)
+        age = self.current_second - timestamp
+        if age >= self.size:
+            return
+        self._counts[timestamp % self.size] += n
+        for window in self.windows:
+            if 0 < age <= window:
+                self._totals[window] += n
+
+    def count(self, window=EVENTRATE_TIME):
+        """Return the number of events in a window."""
+
+        return self._totals[window]
+
+    def rate(self, window=EVENTRATE_TIME):
+        """Return the event rate, averaged over a window.
+
+        :param window: one of the windows, in seconds.
+
+        """
+        return self._totals[window] / window
+
+    def get_rates(self):
+        """Return the event rates over all windows.
+
+        :returns: dictionary of event rates, by window.
+
+        """
+        return dict((window, self.rate(window)) for window in self.windows)
+
+    def get_counts(self, n_seconds=None):
+        """Return the number of events per second, e.g. for plotting.
+
+        :param n_seconds: number of complete seconds, at most the size of
+            the ring buffer minus one.  Defaults to the largest window.
+        :returns: tuple of arrays of the GPS seconds and the number of
+            events in each second, oldest first.
+
+        """
+        if n_seconds is None:
+            n_seconds = self.windows[-1]
+        if self.current_second is None:
+            return (np.array([], dtype=np.int64),
+                    np.array([], dtype=np.int64))
+        n_seconds = min(n_seconds, self.size - 1)
+        seconds = np.arange(self.current_second - n_seconds,
+                            self.current_second)
+        return seconds, self._counts[seconds % self.size]
+
+
 class Stew(object):
 
-    """Prepare events from event and one-second messages."""
+    """Prepare events from event and one-second messages.
+
+    Event messages are kept in buckets by GPS second.  The events of
+    second t can only be cooked when the one-second messages of seconds
+    t, t + 1 and t + 2 have arrived.  Adding a message marks the buckets
+    which may have become complete, so stirring only visits those
+    buckets, instead of trying every pending event message.
+
+    The GPS seconds of the stored messages and event rates are also kept
+    in min-heaps, so draining only visits the entries which are stale.
+    Event messages which are pending for more than FRESHNESS_TIME
+    seconds of wall time are also drained, so the stew does not grow
+    when the GPS timestamps stop advancing.
+
+    """
 
-    def __init__(self):
+    def __init__(self, pool=None):
+        """Instantiate the class.
+
+        :param pool: optional :class:`EventAnalysisPool`.  If given, the
+            traces of cooked events are analyzed by the pool.
+
+        """
+        self.pool = pool
+        # event messages by GPS second, then by (uncooked) ext_timestamp
         self._event_messages = {}
         self._one_second_messages = {}
+        # GPS seconds of buckets which may be ready to cook
+        self._ready_seconds = set()
         self._events = []
         self._latest_timestamp = 0
-        # Setting the defaultfactory to 0. This allows adding values to
-        # non-existing keys, like d[key] += 1 if key does not exist.
-        self._event_rates = collections.defaultdict(lambda: 0)
+        self._event_rates = EventRateCounter()
         self._last_update = 0
 
+        # min-heaps of the GPS seconds of the stored messages
+        self._one_second_heap = []
+        self._event_heap = []
+        self._event_heap_seconds = set()
+        # wall time at which each bucket of event messages was created,
+        # and a queue of (wall time, GPS second) in order of creation
+        self._bucket_times = {}
+        self._bucket_queue = collections.deque()
+
+        # number of drained entries, by reason
+        self.n_perished_events = 0
+        self.n_stale_one_second_messages = 0
+
     def add_one_second_message(self, msg):
         """Add a one-second message to the stew.
 
@@ -80,10 +248,18 @@ class Stew(object):
                         "Probably missing one-second message: %d", t)
             # store latest timestamp
             self._latest_timestamp = timestamp
+            self._event_rates.advance(timestamp)
 
         # store message
+        if timestamp not in self._one_second_messages:
+            heapq.heappush(self._one_second_heap, timestamp)
         self._one_second_messages[timestamp] = msg
 
+        # this message may complete the buckets of the last three seconds
+        for t in range(timestamp - 2, timestamp + 1):
+            if t in self._event_messages:
+                self._ready_seconds.add(t)
+
     def add_event_message(self, msg):
         """Add an event message to the stew.
 
@@ -94,27 +270,49 @@ class Stew(object):
         if not self._one_second_messages:
             logger.debug("No one-second messages yet, ignoring event.")
         else:
-            self._event_messages[msg.ext_timestamp] = msg
-            self._event_rates[msg.timestamp] += 1
+            timestamp = msg.timestamp
+            if timestamp not in self._event_messages:
+                self._event_messages[timestamp] = {}
+                if timestamp not in self._event_heap_seconds:
+                    heapq.heappush(self._event_heap, timestamp)
+                    self._event_heap_seconds.add(timestamp)
+                self._bucket_times[timestamp] = self._last_update
+                self._bucket_queue.append((self._last_update, timestamp))
+            self._event_messages[timestamp][msg.ext_timestamp] = msg
+            self._event_rates.increment(timestamp)
+            # a late event message may be ready to cook right away
+            self._ready_seconds.add(timestamp)
 
     def stir(self):
         """Stir stew to mix ingredients.
 
-        For all pending event messages, the necessary one-second messages
-        are looked up and the synchronization and quantization errors are
-        used to adjust the exact trigger time. If all the necessary
-        ingredients are in the stew,  resulting events are ready to be
-        served.
+        For the event messages of all seconds for which the necessary
+        one-second messages have arrived, the synchronization and
+        quantization errors are used to adjust the exact trigger time.
+        The resulting events are ready to be served.  Event messages of
+        other seconds are not visited.  Events are served in trigger
+        order.
 
         """
-        for key, msg in self._event_messages.items():
-            try:
-                event = self.cook_event_msg(msg)
-            except MissingOneSecondMessage:
-                pass
-            else:
-                self._events.append(event)
-                del self._event_messages[key]
+        cooked_msgs = []
+        for timestamp in self._ready_seconds:
+            if (timestamp in self._event_messages and
+                    self._has_one_second_messages(timestamp)):
+                bucket = self._event_messages.pop(timestamp)
+                del self._bucket_times[timestamp]
+                for msg in bucket.itervalues():
+                    self._correct_trigger_time(msg)
+                cooked_msgs.extend(bucket.itervalues())
+        self._ready_seconds.clear()
+
+        cooked_msgs.sort(key=lambda msg: msg.ext_timestamp)
+        if self.pool is not None and cooked_msgs:
+            analyses = self.pool.analyze(cooked_msgs)
+            events = [Event(msg, analysis=analysis)
+                      for msg, analysis in zip(cooked_msgs, analyses)]
+        else:
+            events = [Event(msg) for msg in cooked_msgs]
+        self._events.extend(events)
 
     def cook_event_msg(self, msg):
         """Cook an event message by correcting the trigger time.
@@ -126,6 +324,18 @@ class Stew(object):
 
         :returns: event
 
+        """
+        self._correct_trigger_time(msg)
+        return Event(msg)
+
+    def _correct_trigger_time(self, msg):
+        """Correct the trigger time of an event message in place.
+
+        Raises :class:`MissingOneSecondMessage` if the necessary one-second
+        messages are not (yet) received.
+
+        :param msg: event message
+
         """
         t0_msg = self._get_one_second_message(msg.timestamp)
         t1_msg = self._get_one_second_message(msg.timestamp + 1)
@@ -151,14 +361,24 @@ class Stew(object):
         # between LabVIEW DAQ and PySPARC. We don't know why.
         ext_timestamp += 1 * NANOSECONDS_PER_SECOND
 
-        # Correct timestamp (and datetime attribute)
+        # Correct timestamp (the datetime attribute is derived from it)
         msg.timestamp = int(ext_timestamp / NANOSECONDS_PER_SECOND)
         msg.nanoseconds = ext_timestamp % NANOSECONDS_PER_SECOND
         msg.ext_timestamp = ext_timestamp
-        msg.datetime = datetime.datetime.utcfromtimestamp(msg.timestamp)
+        lazy.invalidate(msg, 'datetime')
 
         logger.debug("Event message cooked, timestamp: %d", msg.timestamp)
-        return Event(msg)
+
+    def _has_one_second_messages(self, timestamp):
+        """Check if the events of a second can be cooked.
+
+        :param timestamp: GPS second of the event messages.
+        :returns: True if the one-second messages of timestamp and the
+            next two seconds are received.
+
+        """
+        return all(t in self._one_second_messages
+                   for t in range(timestamp, timestamp + 3))
 
     def _get_one_second_message(self, timestamp):
         """Return one-second message or raise MissingOneSecondMessage.
@@ -185,97 +405,292 @@ class Stew(object):
         self._events = []
         return events
 
-    def event_rate(self):
-        """Return event rate, averaged over EVENTRATE_TIME seconds."""
+    def event_rate(self, window=EVENTRATE_TIME):
+        """Return event rate, averaged over a window.
 
-        # if the hardware fell silent, return 0.0
+        :param window: one of EVENTRATE_WINDOWS, in seconds.
+
+        """
+        # if the hardware fell silent, return -999.0
         if time.time() - self._last_update > FRESHNESS_TIME:
             return -999.0
+        return self._event_rates.rate(window)
 
-        try:
-            number_of_events = sum(self._event_rates.values())
-            event_rate = number_of_events / EVENTRATE_TIME
-            return event_rate
-        except (ValueError, ZeroDivisionError):
-            # probably there are no events received yet in more than one
-            # second
-            return 0.0
+    def get_event_rates(self):
+        """Return the event rates over all EVENTRATE_WINDOWS.
+
+        :returns: dictionary of event rates, by window.  If the hardware
+            fell silent, all rates are -999.0.
+
+        """
+        return dict((window, self.event_rate(window))
+                    for window in self._event_rates.windows)
+
+    def get_event_counts(self, n_seconds=None):
+        """Return the number of events per GPS second, e.g. for plotting.
+
+        See :meth:`EventRateCounter.get_counts`.
+
+        """
+        return self._event_rates.get_counts(n_seconds)
 
     def drain(self):
         """Drain stale event and one-second messages from stew.
 
         Event and one-second messages which are no longer fresh (ie. their
-        timestamp is a long time in the past) are removed from the stew.
+        timestamp is a long time in the past, or the event messages
+        arrived a long time ago) are removed from the stew.  Only the
+        stale entries are visited.
 
         """
-        for timestamp in self._one_second_messages.keys():
-            if self._latest_timestamp - timestamp > FRESHNESS_TIME:
+        oldest = self._latest_timestamp - FRESHNESS_TIME
+        heap = self._one_second_heap
+        while heap and heap[0] < oldest:
+            timestamp = heapq.heappop(heap)
+            if self._one_second_messages.pop(timestamp, None) is not None:
                 logger.debug("Draining one-second message: %d", timestamp)
-                del self._one_second_messages[timestamp]
-
-        for key, msg in self._event_messages.items():
-            timestamp = msg.timestamp
-            if self._latest_timestamp - timestamp > FRESHNESS_TIME:
-                logger.warning("Perished; draining event message: %d",
-                               timestamp)
-                del self._event_messages[key]
+                self.n_stale_one_second_messages += 1
+
+        heap = self._event_heap
+        while heap and heap[0] < oldest:
+            timestamp = heapq.heappop(heap)
+            self._event_heap_seconds.remove(timestamp)
+            self._drain_event_messages(timestamp)
+
+        # event messages which wait too long, e.g. when the GPS timestamps
+        # stop advancing
+        oldest_update = time.time() - FRESHNESS_TIME
+        queue = self._bucket_queue
+        while queue and queue[0][0] < oldest_update:
+            created, timestamp = queue.popleft()
+            if self._bucket_times.get(timestamp) == created:
+                self._drain_event_messages(timestamp)
+
+    def _drain_event_messages(self, timestamp):
+        """Drain the event messages of a GPS second, if any."""
+
+        bucket = self._event_messages.pop(timestamp, None)
+        if bucket is not None:
+            del self._bucket_times[timestamp]
+            logger.warning("Perished; draining %d event messages: %d",
+                           len(bucket), timestamp)
+            self.n_perished_events += len(bucket)
+
+    def get_drain_stats(self):
+        """Return the number of drained entries, by reason.
+
+        :returns: dictionary with the number of perished event messages
+            and stale one-second messages.
 
-        for timestamp in self._event_rates.keys():
-            if self._latest_timestamp - timestamp > EVENTRATE_TIME:
-                logger.debug("Draining stale event rate value: %d", timestamp)
-                del self._event_rates[timestamp]
+        """
+        return {'perished_events': self.n_perished_events,
+                'stale_one_second_messages':
+                    self.n_stale_one_second_messages}
 
 
 class Mixer(object):
 
-    def __init__(self):
+    """Mix primary and secondary events into four-channel events.
+
+    A secondary event is mixed with the nearest primary event, if their
+    trigger times differ less than MAX_FOUR_CHANNEL_DELAY.
+
+    Events which are not matched within the time horizon are evicted
+    when draining the mixer, so the memory use is bounded.  Unmatched
+    primary events are either dropped or served as two-channel events.
+    Unmatched secondary events are always dropped, since they would be
+    mistaken for primary data if served as two-channel events.
+
+    """
+
+    def __init__(self, horizon=MIXER_HORIZON, store_unmatched=False):
+        """Instantiate the class.
+
+        :param horizon: unmatched events older than horizon seconds,
+            relative to the latest event, are evicted by :meth:`drain`.
+        :param store_unmatched: if True, unmatched primary events are
+            served as two-channel events.  Otherwise, they are dropped.
+
+        """
+        self.horizon = horizon
+        self.store_unmatched = store_unmatched
         self._primary_events = {}
         self._secondary_events = {}
         self._mixed_events = []
+        # min-heaps of the trigger times of the pending events
+        self._primary_heap = []
+        self._secondary_heap = []
+        self._latest_timestamp = 0
+        # sizes of the pending events, calculated once when they are added
+        self._primary_sizes = {}
+        self._secondary_sizes = {}
+
+        # approximate size of the data of the pending events, in bytes
+        self.n_bytes = 0
+        self.n_mixed = 0
+        self.n_stored_primary = 0
+        self.n_dropped_primary = 0
+        self.n_dropped_secondary = 0
 
     def add_primary_events(self, events):
-        for event in events:
-            self._primary_events[event.ext_timestamp] = event
+        self._add_events(events, self._primary_events, self._primary_sizes,
+                         self._primary_heap)
 
     def add_secondary_events(self, events):
+        self._add_events(events, self._secondary_events,
+                         self._secondary_sizes, self._secondary_heap)
+
+    def _add_events(self, events, pending_events, sizes, heap):
+        n_bytes = self.n_bytes
+        latest_timestamp = self._latest_timestamp
         for event in events:
-            self._secondary_events[event.ext_timestamp] = event
+            timestamp = event.ext_timestamp
+            if timestamp in pending_events:
+                n_bytes -= sizes.get(timestamp, 0)
+            else:
+                heapq.heappush(heap, timestamp)
+            pending_events[timestamp] = event
+            size = sizes[timestamp] = _event_size(event)
+            n_bytes += size
+            if timestamp > latest_timestamp:
+                latest_timestamp = timestamp
+        self.n_bytes = n_bytes
+        self._latest_timestamp = latest_timestamp
 
     def serve_events(self):
+        """Serve mixed events, and stored unmatched primary events.
+
+        :returns: list of events
+
+        """
         events = self._mixed_events
         self._mixed_events = []
         return events
 
     def drain(self):
-        pass
+        """Evict unmatched events which are older than the horizon.
 
-    def mix(self):
-        primary_timestamps = self._primary_events.keys()
-        if primary_timestamps:
-            for timestamp, secondary_event in self._secondary_events.items():
-                delta_t = [abs(u - timestamp) for u in primary_timestamps]
-                min_delta_t = min(delta_t)
+        Only the evicted events are visited.  Unmatched primary events are
+        stored or dropped, unmatched secondary events are dropped.
+
+        """
+        oldest = (self._latest_timestamp -
+                  self.horizon * NANOSECONDS_PER_SECOND)
+
+        heap = self._primary_heap
+        while heap and heap[0] < oldest:
+            timestamp = heapq.heappop(heap)
+            event = self._primary_events.pop(timestamp, None)
+            if event is not None:
+                self.n_bytes -= self._primary_sizes.pop(timestamp, 0)
+                if self.store_unmatched:
+                    self._mixed_events.append(event)
+                    self.n_stored_primary += 1
+                else:
+                    self.n_dropped_primary += 1
+
+        heap = self._secondary_heap
+        while heap and heap[0] < oldest:
+            timestamp = heapq.heappop(heap)
+            event = self._secondary_events.pop(timestamp, None)
+            if event is not None:
+                self.n_bytes -= self._secondary_sizes.pop(timestamp, 0)
+                self.n_dropped_secondary += 1
 
-                if min_delta_t < MAX_FOUR_CHANNEL_DELAY:
-                    primary_idx = delta_t.index(min_delta_t)
-                    nearest_timestamp = primary_timestamps[primary_idx]
-                    primary_event = self._primary_events[nearest_timestamp]
+    def get_stats(self):
+        """Return the counters and memory use of the mixer.
 
-                    mixed_event = FourChannelEvent(primary_event, secondary_event)
-                    self._mixed_events.append(mixed_event)
+        :returns: dictionary with the number of pending primary and
+            secondary events, the approximate size of their data in
+            bytes, the number of mixed events, the number of stored and
+            dropped unmatched primary events and the number of dropped
+            unmatched secondary events.
 
-                    del self._secondary_events[timestamp]
-                    del self._primary_events[nearest_timestamp]
+        """
+        return {'n_primary': len(self._primary_events),
+                'n_secondary': len(self._secondary_events),
+                'n_bytes': self.n_bytes,
+                'n_mixed': self.n_mixed,
+                'n_stored_primary': self.n_stored_primary,
+                'n_dropped_primary': self.n_dropped_primary,
+                'n_dropped_secondary': self.n_dropped_secondary}
+
+    def mix(self):
+        """Mix pending primary and secondary events.
+
+        The secondary events are matched in trigger order.  The nearest
+        primary event is looked up in the sorted primary trigger times by
+        bisection.  If two primary events are equally near, the earlier
+        one is taken.  Matched primary events are no longer available to
+        later secondary events.
+
+        """
+        primary_timestamps = sorted(self._primary_events)
+        if not primary_timestamps:
+            return
+
+        for timestamp in sorted(self._secondary_events):
+            idx = bisect.bisect_left(primary_timestamps, timestamp)
+            if idx > 0 and (idx == len(primary_timestamps) or
+                            timestamp - primary_timestamps[idx - 1] <=
+                            primary_timestamps[idx] - timestamp):
+                idx -= 1
+            if idx == len(primary_timestamps):
+                # all primary events are matched
+                break
+
+            nearest_timestamp = primary_timestamps[idx]
+            if abs(nearest_timestamp - timestamp) < MAX_FOUR_CHANNEL_DELAY:
+                primary_event = self._primary_events.pop(nearest_timestamp)
+                secondary_event = self._secondary_events.pop(timestamp)
+                del primary_timestamps[idx]
+                self.n_bytes -= (
+                    self._primary_sizes.pop(nearest_timestamp, 0) +
+                    self._secondary_sizes.pop(timestamp, 0))
+                self.n_mixed += 1
+
+                mixed_event = FourChannelEvent(primary_event, secondary_event)
+                self._mixed_events.append(mixed_event)
+
+
+def _event_size(event):
+    """Approximate size of the traces of an event, in bytes.
+
+    The raw (packed) traces are counted, not the unpacked traces, which
+    are only created when used.
+
+    """
+    size = event.raw_traces.nbytes
+    for zlib_trace in event.zlib_trace_ch1, event.zlib_trace_ch2:
+        if zlib_trace is not None:
+            size += len(zlib_trace)
+    return size
 
 
 class Event(object):
 
-    """A HiSPARC event, with preliminary analysis."""
+    """A HiSPARC event, with preliminary analysis.
+
+    The traces are unpacked from the raw traces of the message when they
+    are first used.  If the analysis is calculated elsewhere, e.g. by an
+    :class:`EventAnalysisPool`, the traces are not unpacked at all by the
+    storage and upload of the event.  Likewise, the datetime is derived
+    from the timestamp when it is first used.
+
+    """
+
+    def __init__(self, msg, event_rate=-1, analysis=None):
+        """Instantiate the class.
 
-    def __init__(self, msg, event_rate=-1):
+        :param msg: cooked event message.
+        :param event_rate: event rate at the time of the event.
+        :param analysis: result of :func:`analyze_traces` for the traces of
+            the message, e.g. calculated by an :class:`EventAnalysisPool`.
+            If None, the traces are analyzed here.
+
+        """
         self._msg = msg
 
-        self.datetime = msg.datetime
         self.timestamp = msg.timestamp
         self.nanoseconds = msg.nanoseconds
         self.ext_timestamp = msg.ext_timestamp
@@ -283,82 +698,329 @@ class Event(object):
         self.trigger_pattern = msg.trigger_pattern
         self.event_rate = event_rate
 
-        # Traces
-        self.trace_ch1 = self._msg.trace_ch1
-        self.trace_ch2 = self._msg.trace_ch2
+        if analysis is None:
+            analysis = analyze_traces(self.trace_ch1, self.trace_ch2)
+        (self.zlib_trace_ch1, self.zlib_trace_ch2, self.baselines,
+         self.std_dev, self.pulseheights, self.integrals,
+         self.n_peaks) = analysis
+
+    @lazy
+    def datetime(self):
+        """Date and time of the event, derived from the timestamp."""
+        return datetime.datetime.utcfromtimestamp(self.timestamp)
+
+    @property
+    def raw_traces(self):
+        """Raw trace data of both channels (read-only view)."""
+        return self._msg.raw_traces
+
+    @lazy
+    def trace_ch1(self):
+        """Signal trace of channel 1."""
+        return self._msg.trace_ch1
+
+    @lazy
+    def trace_ch2(self):
+        """Signal trace of channel 2."""
+        return self._msg.trace_ch2
 
-        # Compressed traces
-        self.zlib_trace_ch1 = zlib.compress(','.join([str(int(u)) for u in
-                                                      self.trace_ch1]))
-        self.zlib_trace_ch2 = zlib.compress(','.join([str(int(u)) for u in
-                                                      self.trace_ch2]))
-
-        # Mean value of the first 100 samples of the trace
-        baselines = [int(round(t[:100].mean())) for t in (self.trace_ch1,
-                                                          self.trace_ch2)]
-        self.baselines = baselines + [-1, -1]
-
-        # Standard deviation of the first 100 samples of the trace
-        std_dev = [int(round(1000 * t[:100].std())) for t in (self.trace_ch1,
-                                                              self.trace_ch2)]
-        self.std_dev = std_dev + [-1, -1]
-
-        # Maximum peak to baseline value in trace
-        self.pulseheights = [self.trace_ch1.max() - self.baselines[0],
-                             self.trace_ch2.max() - self.baselines[1],
-                             -1, -1]
-
-        self.integrals = self._calculate_integral_of_traces() + [-1, -1]
-
-        self.n_peaks = self._calculate_n_peaks() + [-1, -1]
-
-    def _calculate_integral_of_traces(self):
-        """Calculate integral of trace for all values over threshold.
-
-        The threshold is defined by INTEGRAL_THRESHOLD.
-
-        """
-        traces = np.vstack([self.trace_ch1, self.trace_ch2])
-        baselines = np.array([self.baselines[:2]])
-        traces -= baselines.T
-        integrals = [t.compress(t > INTEGRAL_THRESHOLD).sum() for t in traces]
-        return integrals
-
-    def _calculate_n_peaks(self):
-        """Calculate number of peaks in traces."""
-
-        n_peaks = []
-        for trace, baseline in zip([self.trace_ch1, self.trace_ch2],
-                                   self.baselines):
-            n_peak = 0
-            in_peak = False
-            local_minimum = 0
-            peak_threshold = PEAK_THRESHOLD + baseline
-            for value in trace:
-                if not in_peak:
-                    if value < local_minimum:
-                        local_minimum = value if value > 0 else 0
-                    elif value - local_minimum > peak_threshold:
-                        # enough signal over local minimum to be in a peak
-                        in_peak = True
-                        local_maximum = value
-                        n_peak += 1
-                else:
-                    if value > local_maximum:
-                        local_maximum = value
-                    elif local_maximum - value > peak_threshold:
-                        # enough signal decrease to be out of peak
-                        in_peak = False
-                        local_minimum = value if value > 0 else 0
-            n_peaks.append(n_peak)
 
-        return n_peaks
+def analyze_traces(trace_ch1, trace_ch2):
+    """Preliminary analysis of the traces of an event.
+
+    :param trace_ch1,trace_ch2: the traces of both channels.
+    :returns: tuple of the compressed traces of both channels, followed
+        by the baselines, standard deviations of the baselines,
+        pulseheights, integrals and numbers of peaks.  These are lists of
+        four values, of which the last two (channels 3 and 4) are -1.
+
+    """
+    # Compressed traces
+    zlib_trace_ch1 = compress_trace(trace_ch1)
+    zlib_trace_ch2 = compress_trace(trace_ch2)
+
+    statistics = _analyze_trace_array(np.vstack([trace_ch1, trace_ch2]))
+    baselines, std_dev, pulseheights, integrals, n_peaks = [
+        list(values) + [-1, -1] for values in statistics]
+
+    return (zlib_trace_ch1, zlib_trace_ch2, baselines, std_dev,
+            pulseheights, integrals, n_peaks)
+
+
+def _analyze_trace_array(traces):
+    """Calculate the statistics of traces of equal length.
+
+    :param traces: 2D array with a trace in each row.
+    :returns: tuple of lists of the baselines, standard deviations of
+        the baselines, pulseheights, integrals and numbers of peaks of
+        each trace.
+
+    """
+    # Mean value of the first 100 samples of the trace
+    baselines = _round(traces[:, :100].mean(axis=1))
+
+    # Standard deviation of the first 100 samples of the trace
+    std_dev = _round(1000 * traces[:, :100].std(axis=1))
+
+    # Maximum peak to baseline value in trace
+    pulseheights = traces.max(axis=1) - baselines
+
+    integrals = _calculate_integrals(traces, baselines)
+    n_peaks = _calculate_n_peaks(traces, baselines)
+
+    return (baselines.tolist(), std_dev.tolist(), pulseheights.tolist(),
+            integrals.tolist(), n_peaks)
+
+
+def _round(values):
+    """Round to integers, like the builtin round (half away from zero)."""
+
+    return np.copysign(np.floor(np.abs(values) + .5), values).astype(int)
+
+
+def _create_sample_table():
+    """Create a lookup table of the text representation of sample values.
+
+    Each entry holds the digits of a sample value followed by a comma,
+    padded with zeros to eight bytes, so that an entry can be looked up
+    as a single 64-bit integer.
+
+    :returns: tuple of the table of digits and the table of masks which
+        select the digits and the comma, both as uint64 arrays.
+
+    """
+    table = np.zeros((N_SAMPLE_VALUES, 8), dtype=np.uint8)
+    masks = np.zeros((N_SAMPLE_VALUES, 8), dtype=bool)
+    for value in range(N_SAMPLE_VALUES):
+        string = '%d,' % value
+        table[value, :len(string)] = np.frombuffer(string, dtype=np.uint8)
+        masks[value, :len(string)] = True
+    return table.view(np.uint64).ravel(), masks.view(np.uint64).ravel()
+
+
+_SAMPLE_DIGITS, _SAMPLE_MASKS = _create_sample_table()
+
+
+def serialize_trace(trace):
+    """Serialize a trace to comma-separated text.
+
+    The result is identical to ``','.join([str(int(u)) for u in trace])``,
+    the format used by the datastore.  Instead of converting each sample,
+    the characters of all samples are looked up in a table at once.
+    Traces containing values outside the 12-bit range are converted
+    sample by sample.
+
+    :param trace: array of integer sample values.
+    :returns: string containing the comma-separated values.
+
+    """
+    trace = np.asarray(trace)
+    if not len(trace):
+        return ''
+    if (trace.dtype.kind not in 'iu' or trace.min() < 0 or
+            trace.max() >= N_SAMPLE_VALUES):
+        return ','.join([str(int(u)) for u in trace])
+    digits = _SAMPLE_DIGITS.take(trace).view(np.uint8)
+    masks = _SAMPLE_MASKS.take(trace).view(bool)
+    # strip the trailing comma
+    return digits[masks][:-1].tostring()
+
+
+def compress_trace(trace, compressor=None):
+    """Serialize and compress a trace, as stored in zlib_trace_chN.
+
+    :param trace: array of integer sample values.
+    :param compressor: optional zlib compression object, e.g. created by
+        :func:`zlib.compressobj`.  It is not used itself, but copied for
+        each trace, so it can be reused for many traces.  The datastore
+        expects the default compression level of :func:`zlib.compress`,
+        which is used if no compressor is given.
+    :returns: string containing the compressed trace.
+
+    """
+    text = serialize_trace(trace)
+    if compressor is None:
+        return zlib.compress(text)
+    else:
+        compressor = compressor.copy()
+        return compressor.compress(text) + compressor.flush()
+
+
+def _calculate_integrals(traces, baselines):
+    """Calculate integral of traces for all values over threshold.
+
+    The threshold is defined by INTEGRAL_THRESHOLD.
+
+    :param traces: 2D array with a trace in each row.
+    :param baselines: array of the baselines of the traces.
+
+    """
+    traces = traces - baselines[:, np.newaxis]
+    return np.where(traces > INTEGRAL_THRESHOLD, traces, 0).sum(axis=1)
+
+
+def _calculate_n_peaks(traces, baselines):
+    """Calculate number of peaks in traces.
+
+    A peak starts when the signal rises more than the peak threshold
+    above the local minimum, and ends when the signal drops more than the
+    peak threshold below the local maximum of the peak.  The local
+    minimum is clamped to be non-negative.  The peak threshold is
+    PEAK_THRESHOLD above the baseline.
+
+    :param traces: a batch of traces, e.g. a list of traces or a 2D
+        array with a trace in each row.
+    :param baselines: the baselines of the traces.
+    :returns: list with the number of peaks in each trace.
+
+    """
+    return [_count_peaks(trace, PEAK_THRESHOLD + baseline)
+            for trace, baseline in zip(traces, baselines)]
+
+
+def _count_peaks(trace, peak_threshold):
+    """Count the peaks in a single trace.
+
+    This is a hysteresis state machine, but instead of looping over the
+    samples, the running minimum or maximum of a block of samples is
+    calculated at once, and the first sample at which the state changes
+    is looked up.  The block size doubles while the state does not
+    change, so the cost is proportional to the length of the trace, plus
+    a small constant per peak.
+
+    """
+    trace = np.asarray(trace)
+    if trace.dtype.kind in 'iub':
+        trace = trace.astype(np.int64)
+    clamped = np.maximum(trace, 0)
+    length = len(trace)
+
+    n_peaks = 0
+    in_peak = False
+    local_minimum = 0
+    local_maximum = 0
+    idx = 0
+    block_size = PEAK_BLOCK_SIZE
+    while idx < length:
+        stop = min(idx + block_size, length)
+        values = trace[idx:stop]
+        if not in_peak:
+            # local minimum *before* each sample
+            minima = np.minimum.accumulate(clamped[idx:stop])
+            previous = np.empty_like(minima)
+            previous[0] = local_minimum
+            np.minimum(minima[:-1], local_minimum, out=previous[1:])
+            rising = values - previous
+            change = (rising >= 0) & (rising > peak_threshold)
+        else:
+            # local maximum *before* each sample
+            maxima = np.maximum.accumulate(values)
+            previous = np.empty_like(maxima)
+            previous[0] = local_maximum
+            np.maximum(maxima[:-1], local_maximum, out=previous[1:])
+            falling = previous - values
+            change = (falling >= 0) & (falling > peak_threshold)
+
+        change_idx = change.argmax()
+        if change[change_idx]:
+            value = values[change_idx]
+            if not in_peak:
+                # enough signal over local minimum to be in a peak
+                local_maximum = value
+                n_peaks += 1
+            else:
+                # enough signal decrease to be out of peak
+                local_minimum = clamped[idx + change_idx]
+            in_peak = not in_peak
+            idx += change_idx + 1
+            block_size = PEAK_BLOCK_SIZE
+        else:
+            if not in_peak:
+                local_minimum = min(local_minimum, minima[-1])
+            else:
+                local_maximum = max(local_maximum, maxima[-1])
+            idx = stop
+            block_size *= 2
+
+    return n_peaks
+
+
+def _analyze_raw_traces(payload):
+    """Unpack and analyze raw traces in a worker process.
+
+    :param payload: tuple of the packed raw traces of both channels, as a
+        string, and the length of the raw trace of a single channel.
+    :returns: result of :func:`analyze_traces`.
+
+    """
+    raw_traces, trace_length = payload
+    raw_traces = np.frombuffer(raw_traces, dtype=np.uint8)
+    traces = unpack_raw_traces(raw_traces.reshape(2, trace_length))
+    return analyze_traces(traces[0], traces[1])
+
+
+def _ignore_interrupts():
+    """Let the main process handle interrupts, not the workers."""
+
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class EventAnalysisPool(object):
+
+    """Analyze event traces in a pool of worker processes.
+
+    Only the packed raw traces are sent to the workers, and only the
+    compressed traces and the results of the analysis are sent back.  The
+    results are returned in the order of the messages.
+
+    The main process no longer analyzes nor unpacks the traces, so it
+    handles events much faster (see scripts/benchmark_event_pool.py).
+    Whether the total throughput scales with the number of workers has not
+    been measured, since this was developed on a single-core machine.
+
+    """
+
+    def __init__(self, processes=None):
+        """Instantiate the class.
+
+        :param processes: number of worker processes.  Defaults to the
+            number of CPU cores.
+
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        self.processes = processes
+        self._pool = multiprocessing.Pool(processes, _ignore_interrupts)
+
+    def analyze(self, msgs):
+        """Analyze the traces of event messages.
+
+        :param msgs: list of event messages.
+        :returns: list of :func:`analyze_traces` results, in the order of
+            the messages.
+
+        """
+        payloads = [(msg.raw_traces.tostring(), msg.trace_length)
+                    for msg in msgs]
+        return self._pool.map(_analyze_raw_traces, payloads)
+
+    def close(self):
+        """Stop the worker processes."""
+
+        self._pool.close()
+        self._pool.join()
 
 
 class FourChannelEvent(Event):
 
+    """A HiSPARC event of a primary and a secondary device.
+
+    The traces are taken from the primary and secondary events when they
+    are first used.
+
+    """
+
     def __init__(self, primary_event, secondary_event):
-        self.datetime = primary_event.datetime
         self.timestamp = primary_event.timestamp
         self.nanoseconds = primary_event.nanoseconds
         self.ext_timestamp = primary_event.ext_timestamp
@@ -367,10 +1029,8 @@ class FourChannelEvent(Event):
         self.event_rate = primary_event.event_rate
 
         # Traces
-        self.trace_ch1 = primary_event.trace_ch1
-        self.trace_ch2 = primary_event.trace_ch2
-        self.trace_ch3 = secondary_event.trace_ch1
-        self.trace_ch4 = secondary_event.trace_ch2
+        self._primary_event = primary_event
+        self._secondary_event = secondary_event
 
         # Compressed traces
         self.zlib_trace_ch1 = primary_event.zlib_trace_ch1
@@ -386,6 +1046,225 @@ class FourChannelEvent(Event):
         self.integrals = primary_event.integrals[:2] + secondary_event.integrals[:2]
         self.n_peaks = primary_event.n_peaks[:2] + secondary_event.n_peaks[:2]
 
+    @lazy
+    def trace_ch1(self):
+        """Signal trace of channel 1."""
+        return self._primary_event.trace_ch1
+
+    @lazy
+    def trace_ch2(self):
+        """Signal trace of channel 2."""
+        return self._primary_event.trace_ch2
+
+    @lazy
+    def trace_ch3(self):
+        """Signal trace of channel 3."""
+        return self._secondary_event.trace_ch1
+
+    @lazy
+    def trace_ch4(self):
+        """Signal trace of channel 4."""
+        return self._secondary_event.trace_ch2
+
+
+class EventBatch(object):
+
+    """A batch of HiSPARC events, stored as columns.
+
+    Instead of a Python object for each event, the attributes of all
+    events are stored in NumPy arrays, with a row for each event.  The
+    statistics of the four channels are stored in arrays of shape (N, 4),
+    padded with -1 for missing channels, like the lists of an
+    :class:`Event`.  The traces of all events are concatenated in a single
+    array; trace_offsets and trace_lengths give the position of the trace
+    of each channel, with a length of -1 for missing channels.  The
+    compressed traces are stored in an object array, with None for
+    missing channels.
+
+    """
+
+    def __init__(self, n_events=0):
+        """Instantiate the class.
+
+        :param n_events: number of events.  All columns are allocated,
+            with the statistics set to -1 and all channels missing.
+
+        """
+        self.datetime = np.zeros(n_events, dtype='datetime64[s]')
+        self.timestamp = np.zeros(n_events, dtype=np.uint32)
+        self.nanoseconds = np.zeros(n_events, dtype=np.uint32)
+        self.ext_timestamp = np.zeros(n_events, dtype=np.uint64)
+        self.data_reduction = np.zeros(n_events, dtype=bool)
+        self.trigger_pattern = np.zeros(n_events, dtype=np.uint32)
+        self.event_rate = np.zeros(n_events, dtype=np.float64)
+
+        self.baselines = -np.ones((n_events, 4), dtype=np.int64)
+        self.std_dev = -np.ones((n_events, 4), dtype=np.int64)
+        self.pulseheights = -np.ones((n_events, 4), dtype=np.int64)
+        self.integrals = -np.ones((n_events, 4), dtype=np.int64)
+        self.n_peaks = -np.ones((n_events, 4), dtype=np.int64)
+
+        self.traces = np.zeros(0, dtype=np.int16)
+        self.trace_offsets = np.zeros((n_events, 4), dtype=np.int64)
+        self.trace_lengths = -np.ones((n_events, 4), dtype=np.int64)
+        self.zlib_traces = np.empty((n_events, 4), dtype=object)
+
+    def __len__(self):
+        return len(self.ext_timestamp)
+
+    @classmethod
+    def from_messages(cls, msgs, event_rates=None):
+        """Create a batch from cooked event messages, and analyze it.
+
+        :param msgs: list of cooked event messages.
+        :param event_rates: event rates at the time of the events, or
+            None.
+        :returns: the analyzed batch.
+
+        """
+        batch = cls(len(msgs))
+        for idx, msg in enumerate(msgs):
+            batch.timestamp[idx] = msg.timestamp
+            batch.nanoseconds[idx] = msg.nanoseconds
+            batch.ext_timestamp[idx] = msg.ext_timestamp
+            batch.trigger_pattern[idx] = msg.trigger_pattern
+        batch._set_datetime()
+        if event_rates is None:
+            batch.event_rate[:] = -1
+        else:
+            batch.event_rate[:] = event_rates
+        batch._set_traces([[msg.trace_ch1, msg.trace_ch2] for msg in msgs])
+        batch.analyze()
+        return batch
+
+    @classmethod
+    def from_events(cls, events):
+        """Create a batch from events.
+
+        :param events: list of :class:`Event` and
+            :class:`FourChannelEvent` instances.
+
+        """
+        batch = cls(len(events))
+        for idx, event in enumerate(events):
+            for name in ('timestamp', 'nanoseconds', 'ext_timestamp',
+                         'data_reduction', 'trigger_pattern', 'event_rate',
+                         'baselines', 'std_dev', 'pulseheights',
+                         'integrals', 'n_peaks'):
+                getattr(batch, name)[idx] = getattr(event, name)
+            for channel in range(4):
+                batch.zlib_traces[idx, channel] = getattr(
+                    event, 'zlib_trace_ch%d' % (channel + 1), None)
+        batch._set_datetime()
+        batch._set_traces([_get_traces(event) for event in events])
+        return batch
+
+    def _set_datetime(self):
+        """Derive the datetime column from the timestamps."""
+
+        self.datetime[:] = self.timestamp.astype(self.datetime.dtype)
+
+    def _set_traces(self, traces):
+        """Concatenate the traces of all events.
+
+        :param traces: list of the traces of each event.
+
+        """
+        offset = 0
+        for idx, event_traces in enumerate(traces):
+            for channel, trace in enumerate(event_traces):
+                self.trace_offsets[idx, channel] = offset
+                self.trace_lengths[idx, channel] = len(trace)
+                offset += len(trace)
+        all_traces = [trace for event_traces in traces
+                      for trace in event_traces]
+        if all_traces:
+            self.traces = np.concatenate(all_traces).astype(np.int16)
+
+    def get_trace(self, idx, channel):
+        """Return the trace of a channel of an event.
+
+        :param idx: index of the event.
+        :param channel: channel number, starting at 0.
+        :returns: a view on the trace, or None if the channel is missing.
+
+        """
+        length = self.trace_lengths[idx, channel]
+        if length < 0:
+            return None
+        offset = self.trace_offsets[idx, channel]
+        return self.traces[offset:offset + length]
+
+    def analyze(self):
+        """Calculate the statistics and compressed traces of all events.
+
+        Traces of equal length are analyzed together, as rows of a single
+        array.  Usually, all traces in a batch have the same length.
+
+        """
+        lengths = self.trace_lengths
+        for length in np.unique(lengths[lengths > 0]):
+            idxs, channels = np.nonzero(lengths == length)
+            offsets = self.trace_offsets[idxs, channels]
+            traces = self.traces[offsets[:, np.newaxis] + np.arange(length)]
+
+            statistics = _analyze_trace_array(traces)
+            for name, values in zip(('baselines', 'std_dev', 'pulseheights',
+                                     'integrals', 'n_peaks'), statistics):
+                getattr(self, name)[idxs, channels] = values
+
+            for idx, channel, trace in zip(idxs, channels, traces):
+                self.zlib_traces[idx, channel] = compress_trace(trace)
+
+    def get_event(self, idx):
+        """Return an event of the batch.
+
+        :param idx: index of the event.
+        :returns: a :class:`FourChannelEvent` instance if the event has
+            traces for all four channels, otherwise an :class:`Event`
+            instance.
+
+        """
+        channels = [channel for channel in range(4)
+                    if self.trace_lengths[idx, channel] >= 0]
+        if len(channels) == 4:
+            event = FourChannelEvent.__new__(FourChannelEvent)
+        else:
+            event = Event.__new__(Event)
+
+        for name in ('timestamp', 'nanoseconds', 'ext_timestamp',
+                     'data_reduction', 'trigger_pattern', 'event_rate',
+                     'baselines', 'std_dev', 'pulseheights', 'integrals',
+                     'n_peaks'):
+            setattr(event, name, getattr(self, name)[idx].tolist())
+        for channel in channels:
+            setattr(event, 'trace_ch%d' % (channel + 1),
+                    self.get_trace(idx, channel))
+            setattr(event, 'zlib_trace_ch%d' % (channel + 1),
+                    self.zlib_traces[idx, channel])
+        return event
+
+    def to_events(self):
+        """Return all events of the batch.
+
+        :returns: list of :class:`Event` and :class:`FourChannelEvent`
+            instances.
+
+        """
+        return [self.get_event(idx) for idx in range(len(self))]
+
+
+def _get_traces(event):
+    """Return the traces of the channels of an event."""
+
+    traces = []
+    for channel in range(1, 5):
+        try:
+            traces.append(getattr(event, 'trace_ch%d' % channel))
+        except AttributeError:
+            break
+    return traces
+
 
 class ConfigEvent(object):
 
@@ -41,6 +41,13 @@ READ_SIZE = 62
 # it ten-fold.
 BUFFER_SIZE = 10 * 64 * 62
 
+# Default latency timer in ms.  The chip sends a (possibly empty) USB
+# packet at least once per latency period.
+LATENCY_TIMER = 16
+# Valid range of the latency timer in ms
+MIN_LATENCY_TIMER = 1
+MAX_LATENCY_TIMER = 255
+
 # Sleep between read/write error retries in seconds
 RW_ERROR_WAIT = .5
 
@@ -125,6 +132,7 @@ class FtdiChip(object):
 
     _device = None
     closed = True
+    latency_timer = None
 
     def __init__(self, device_description=None, interface_select=0):
         self._device_description = device_description
@@ -150,7 +158,7 @@ class FtdiChip(object):
             else:
                 # force default latency timer of 16 ms
                 # on some systems, this reverts to 0 ms if not set explicitly
-                self._device.ftdi_fn.ftdi_set_latency_timer(16)
+                self.set_latency_timer(LATENCY_TIMER)
 
                 self.closed = False
                 self.flush()
@@ -171,6 +179,28 @@ class FtdiChip(object):
         """
         self._device.ftdi_fn.ftdi_set_line_property(bits, stop_bit, parity)
 
+    @property
+    def interface_select(self):
+        """The interface of the device."""
+
+        return self._interface_select
+
+    def set_latency_timer(self, latency):
+        """Set the latency timer of the chip.
+
+        The chip sends its buffered data when the buffer is full, or when
+        the latency timer expires.  A short latency reduces the delay of
+        small amounts of data, at the cost of more USB transfers.
+
+        :param latency: latency in ms, between 1 and 255.
+
+        """
+        if not MIN_LATENCY_TIMER <= latency <= MAX_LATENCY_TIMER:
+            raise ValueError("Latency timer must be between %d and %d ms." %
+                             (MIN_LATENCY_TIMER, MAX_LATENCY_TIMER))
+        self._device.ftdi_fn.ftdi_set_latency_timer(latency)
+        self.latency_timer = latency
+
     def close(self):
         """Close device."""
 
@@ -4,19 +4,32 @@ Parse and operate on messages from and to the Trimble GPS hardware.
 
 :class:`GPSMessage`: factory class for GPS messages
 
+:class:`TSIPBuffer`: read buffer which incrementally extracts TSIP packets
+
 """
 
+import collections
 import struct
 import logging
 import re
 from math import degrees, radians
 
-from messages import BaseMessage, MessageError, CorruptMessageError
+from messages import (BaseMessage, MessageError, CorruptMessageError,
+                      build_message_registry)
+from ring_buffer import RingBuffer
 
 
 logger = logging.getLogger(__name__)
 
 
+# TSIP framing characters
+DLE = 0x10
+ETX = 0x03
+_DLE_CHAR = chr(DLE)
+
+# TSIP super-packets have a sub-packet code following the identifier
+SUPER_PACKET_IDS = (0x8e, 0x8f)
+
 msg_ids = {'unparsable_packet': 0x13,
            'reset': 0x1e,
            'set_initial_position': 0x32,
@@ -47,7 +60,15 @@ class GPSMessage(BaseMessage):
 
     @classmethod
     def extract_message_from_buffer(cls, buff):
-        """Extract a single message from the buffer."""
+        """Extract a single message from the buffer.
+
+        If the buffer is a :class:`TSIPBuffer`, the buffer incrementally
+        extracts the message.  Otherwise, the entire buffer is scanned
+        for the stop codon.
+
+        """
+        if isinstance(buff, TSIPBuffer):
+            return buff.extract_message()
 
         if not buff.startswith('\x10'):
             try:
@@ -105,6 +126,97 @@ class GPSMessage(BaseMessage):
         return super(GPSMessage, self).encode()
 
 
+class TSIPBuffer(RingBuffer):
+
+    """Read buffer which incrementally extracts TSIP packets.
+
+    A TSIP packet starts with DLE and ends with DLE ETX.  DLE bytes inside
+    the packet are stuffed, i.e. sent twice.  Scanning for the end of a
+    packet resumes where the previous scan stopped, and the packet is
+    unstuffed during the scan.  So, every byte is scanned only once, even
+    if a packet arrives in many small pieces.  Since this is a
+    :class:`pysparc.ring_buffer.RingBuffer`, extracted packets are
+    consumed without shifting the remaining data.
+
+    The scan state is reset whenever data is consumed from the buffer.
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(TSIPBuffer, self).__init__(*args, **kwargs)
+        self._reset_scan()
+
+    def consume(self, n):
+        super(TSIPBuffer, self).consume(n)
+        self._reset_scan()
+
+    def _reset_scan(self):
+        # position where scanning resumes; 0 means no start codon found yet
+        self._scan_pos = 0
+        # True if the last scanned byte was an unpaired DLE
+        self._escape = False
+        # unstuffed contents of the packet, so far
+        self._packet = bytearray()
+
+    def extract_message(self):
+        """Extract a single unstuffed packet from the buffer.
+
+        Garbage in front of the start codon is discarded.  A DLE ETX at
+        the start of the buffer is the end of a previous packet, e.g. when
+        reading starts in the middle of the stream, and is discarded too.
+
+        :returns: the packet, without start and stop codons, or None if
+            there is no complete packet in the buffer.
+
+        """
+        while True:
+            if self._scan_pos == 0:
+                idx = self.find(_DLE_CHAR)
+                if idx == -1:
+                    if len(self):
+                        logger.warning("Garbage found, stripping buffer.")
+                        del self[:]
+                    return None
+                elif idx > 0:
+                    logger.warning("Garbage found, stripping buffer.")
+                    del self[:idx]
+                self._scan_pos = 1
+
+            # scan the underlying storage directly, using absolute positions
+            data, base, stop = self._data, self._read, self._write
+            if (self._scan_pos == 1 and base + 1 < stop and
+                    data[base + 1] == ETX):
+                # not a start codon, restart the scan after the DLE ETX
+                self.consume(2)
+            else:
+                break
+
+        pos, escape, packet = base + self._scan_pos, self._escape, self._packet
+        while pos < stop:
+            if escape:
+                escape = False
+                byte = data[pos]
+                if byte == ETX:
+                    self.consume(pos + 1 - base)
+                    return str(packet)
+                # a stuffed DLE, or (invalid) a lone DLE, which is kept
+                packet.append(DLE)
+                if byte == DLE:
+                    pos += 1
+            else:
+                idx = data.find(_DLE_CHAR, pos, stop)
+                if idx == -1:
+                    packet.extend(data[pos:stop])
+                    pos = stop
+                else:
+                    packet.extend(data[pos:idx])
+                    pos = idx + 1
+                    escape = True
+
+        self._scan_pos, self._escape = pos - base, escape
+        return None
+
+
 class PrimaryTimingPacket(GPSMessage):
 
     identifier = msg_ids['primary_timing']
@@ -255,46 +367,93 @@ class SetSurveyParameters(GPSMessage):
         self.data.extend([1, 1, num_fixes, 0])
 
 
+def packet_identifier(msg):
+    """Return the identifier of a TSIP packet.
+
+    The identifier of a super-packet consists of two bytes, the super-packet
+    identifier and the sub-packet code.  All other identifiers are a single
+    byte.
+
+    :param msg: a single unstuffed packet, without codons.
+    :return: the identifier as an integer.
+
+    """
+    identifier = ord(msg[0])
+    if identifier in SUPER_PACKET_IDS and len(msg) > 1:
+        identifier = identifier << 8 | ord(msg[1])
+    return identifier
+
+
+# Classes for all packets received from the hardware, keyed by identifier
+msg_classes = build_message_registry(GPSMessage)
+
+# Number of skipped packets, for packet types which are not parsed
+unparsed_packets = collections.Counter()
+
+
 def GPSMessageFactory(buff):
     """Return a message, extracted from the buffer
 
     Inspect the buffer and extract the first full message. A
     GPSMessage subclass instance will be returned, according to
-    the type of the message.
+    the type of the message.  Packets of types which are not parsed are
+    skipped and counted in :data:`unparsed_packets`.  Corrupt packets are
+    skipped.
 
     :param buff: the contents of the usb buffer
-    :return: instance of a GPSMessage subclass
+    :return: instance of a GPSMessage subclass, or None if there is no
+        full message in the buffer.
 
     """
-    msg = GPSMessage.extract_message_from_buffer(buff)
-    if msg:
-        try:
-            klass = find_message_class(msg, GPSMessage)
-        except UnknownMessageError as e:
-            logger.error(e)
+    while True:
+        msg = GPSMessage.extract_message_from_buffer(buff)
+        if msg is None:
             return None
-        else:
-            try:
-                return klass(msg)
-            except CorruptMessageError as exc:
-                logger.error(exc)
-                return None
-    else:
-        return None
+        elif not msg:
+            continue
+
+        try:
+            klass = find_message_class(msg)
+        except UnknownMessageError:
+            skip_unparsed_packet(msg)
+            continue
+
+        try:
+            return klass(msg)
+        except CorruptMessageError as exc:
+            logger.error(exc)
+
+
+def skip_unparsed_packet(msg):
+    """Count a packet of a type which is not parsed.
+
+    Only the first packet of each type is logged.
+
+    :param msg: a single unstuffed packet, without codons.
+
+    """
+    identifier = packet_identifier(msg)
+    if identifier not in unparsed_packets:
+        logger.info("Skipping packets with unknown identifier 0x%x",
+                    identifier)
+    unparsed_packets[identifier] += 1
 
 
-def find_message_class(msg, cls):
+def find_message_class(msg, registry=None):
     """Return the class implementing the correct message type.
 
-    Loop through all subclasses of :param cls: and find the one that implements
-    the message type of :param msg:.
+    The class is looked up by the (one or two byte) identifier of the
+    packet.
 
     :param msg: a single raw message
-    :param cls: the parent class implementing the message types.
+    :param registry: dictionary of classes, keyed by identifier.  Defaults
+        to :data:`msg_classes`.
     :return: the class implementing the correct message type.
 
     """
-    for klass in cls.__subclasses__():
-        if klass.is_message_for(msg):
-            return klass
-    raise UnknownMessageError("Unknown message: %r" % msg)
+    if registry is None:
+        registry = msg_classes
+    try:
+        return registry[packet_identifier(msg)]
+    except KeyError:
+        raise UnknownMessageError("Unknown message: %r" % msg)
@@ -0,0 +1,325 @@
+"""Collect timing telemetry from the Trimble GPS.
+
+The Trimble GPS continuously sends timing packets, which contain the
+clock bias and bias rate of the GPS oscillator, its temperature and the
+quantization error of the PPS.  These are decoded into fixed-size ring
+buffers, so windowed statistics are always available for timing
+diagnostics, at a constant cost per packet.
+
+Contents
+--------
+
+:class:`TimeSeries`
+    Fixed-size ring buffer with running statistics.
+
+:class:`GPSTelemetry`
+    Windowed time series of the GPS timing packets.
+
+:class:`GPSReader`
+    Thread which continuously reads the GPS into a :class:`GPSTelemetry`.
+
+"""
+
+from __future__ import division
+
+import logging
+import threading
+import time
+
+import numpy as np
+
+from gps_messages import PrimaryTimingPacket, SupplementalTimingPacket
+
+
+logger = logging.getLogger(__name__)
+
+
+# The GPS sends timing packets every second, so keep 10 minutes of data
+DEFAULT_WINDOW = 600
+# Number of bits in the alarms field of the supplemental timing packet
+N_ALARM_BITS = 16
+# Sleep time of the reader thread when no data is available
+READ_INTERVAL = .1
+
+_SERIES = ('clock_bias', 'clock_bias_rate', 'temperature',
+           'pps_quantization_error')
+
+
+class TimeSeries(object):
+
+    """Fixed-size ring buffer with running statistics.
+
+    The sum and sum of squares of the values in the buffer are updated
+    for every new value, so the mean and standard deviation are
+    available at O(1) cost.  To prevent accumulation of rounding errors,
+    the sums are recalculated once every time the buffer wraps around,
+    which is still O(1) amortized.
+
+    """
+
+    def __init__(self, size=DEFAULT_WINDOW):
+        """Instantiate the class.
+
+        :param size: maximum number of values in the buffer.
+
+        """
+        self._values = np.zeros(size)
+        self._idx = 0
+        self._n = 0
+        self._sum = 0.
+        self._sum_squares = 0.
+
+    @property
+    def size(self):
+        """Maximum number of values in the buffer."""
+
+        return len(self._values)
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def next_index(self):
+        """Position in the buffer at which the next value is written.
+
+        Once the buffer is full, this is the position of the oldest value,
+        which is replaced by the next value.  Use it to keep other data
+        in step with the buffer.
+
+        """
+        return self._idx
+
+    def append(self, value):
+        """Append a value, replacing the oldest value if the buffer is full.
+
+        :param value: the new value.
+
+        """
+        if self._n == self.size:
+            old = self._values[self._idx]
+            self._sum -= old
+            self._sum_squares -= old * old
+        else:
+            self._n += 1
+        self._values[self._idx] = value
+        self._sum += value
+        self._sum_squares += value * value
+
+        self._idx += 1
+        if self._idx == self.size:
+            self._idx = 0
+            self._sum = self._values.sum()
+            self._sum_squares = np.dot(self._values, self._values)
+
+    @property
+    def last(self):
+        """The most recent value, or None if the buffer is empty."""
+
+        if not self._n:
+            return None
+        return self._values[self._idx - 1]
+
+    def mean(self):
+        """Mean of the values in the buffer, or NaN if it is empty."""
+
+        if not self._n:
+            return np.nan
+        return self._sum / self._n
+
+    def std(self):
+        """Standard deviation of the values in the buffer, or NaN."""
+
+        if not self._n:
+            return np.nan
+        mean = self._sum / self._n
+        return np.sqrt(max(self._sum_squares / self._n - mean * mean, 0.))
+
+    def values(self):
+        """Return a copy of the values, from oldest to newest."""
+
+        if self._n < self.size:
+            return self._values[:self._n].copy()
+        return np.roll(self._values, -self._idx)
+
+
+class GPSTelemetry(object):
+
+    """Windowed time series of the GPS timing packets.
+
+    Feed the messages read from the GPS to :meth:`update`.  The telemetry
+    can be sampled at any time, from any thread, using :meth:`get_status`
+    or :meth:`get_time_series`, e.g. by the status logging of the data
+    acquisition.
+
+    """
+
+    def __init__(self, window=DEFAULT_WINDOW):
+        """Instantiate the class.
+
+        :param window: number of supplemental timing packets over which
+            the statistics are calculated.
+
+        """
+        self.window = window
+        self._lock = threading.Lock()
+
+        self._timestamps = TimeSeries(window)
+        self._series = dict((name, TimeSeries(window)) for name in _SERIES)
+        self._alarms = np.zeros(window, dtype=np.uint16)
+        self._alarm_counts = np.zeros(N_ALARM_BITS, dtype=int)
+
+        self.gps_time = None
+        self.alarms = None
+        self.receiver_mode = None
+        self.gps_status = None
+        self.survey_progress = None
+        self.latitude = self.longitude = self.altitude = None
+
+        self.n_primary_timing = 0
+        self.n_supplemental_timing = 0
+
+    def update(self, msg):
+        """Update the telemetry with a message read from the GPS.
+
+        Messages other than timing packets are ignored.
+
+        :param msg: a :class:`pysparc.gps_messages.GPSMessage` instance.
+
+        """
+        if isinstance(msg, SupplementalTimingPacket):
+            with self._lock:
+                self._update_supplemental_timing(msg)
+        elif isinstance(msg, PrimaryTimingPacket):
+            with self._lock:
+                # GPS time, not corrected for the UTC offset
+                self.gps_time = (msg.week_number, msg.time_of_week)
+                self.n_primary_timing += 1
+
+    def _update_supplemental_timing(self, msg):
+        idx = self._timestamps.next_index
+        if len(self._timestamps) == self.window:
+            self._count_alarms(self._alarms[idx], -1)
+        self._alarms[idx] = msg.alarms
+        self._count_alarms(msg.alarms, 1)
+
+        self._timestamps.append(time.time())
+        for name, series in self._series.iteritems():
+            series.append(getattr(msg, name))
+
+        self.alarms = msg.alarms
+        self.receiver_mode = msg.receiver_mode
+        self.gps_status = msg.gps_status
+        self.survey_progress = msg.survey_progress
+        self.latitude = msg.latitude
+        self.longitude = msg.longitude
+        self.altitude = msg.altitude
+        self.n_supplemental_timing += 1
+
+    def _count_alarms(self, alarms, delta):
+        """Add delta to the counts of all bits set in alarms."""
+
+        for bit in range(N_ALARM_BITS):
+            if alarms & (1 << bit):
+                self._alarm_counts[bit] += delta
+
+    def get_status(self):
+        """Return a snapshot of the windowed statistics.
+
+        :returns: dictionary with the number of packets in the window, the
+            mean and standard deviation of the clock bias, clock bias
+            rate, temperature and PPS quantization error, the number of
+            packets in the window in which each alarm bit was set, and the
+            latest alarms, receiver mode, GPS status, survey progress and
+            position.
+
+        """
+        with self._lock:
+            status = {'n_packets': len(self._timestamps),
+                      'alarms': self.alarms,
+                      'alarm_counts': self._alarm_counts.tolist(),
+                      'receiver_mode': self.receiver_mode,
+                      'gps_status': self.gps_status,
+                      'survey_progress': self.survey_progress,
+                      'latitude': self.latitude,
+                      'longitude': self.longitude,
+                      'altitude': self.altitude,
+                      'gps_time': self.gps_time}
+            for name, series in self._series.iteritems():
+                status[name] = series.last
+                status[name + '_mean'] = series.mean()
+                status[name + '_std'] = series.std()
+        return status
+
+    def get_time_series(self):
+        """Return copies of the time series in the window.
+
+        :returns: dictionary of arrays, from oldest to newest.  The
+            'timestamp' array contains the (host) time at which each packet
+            was received.
+
+        """
+        with self._lock:
+            series = dict((name, s.values()) for name, s in
+                          self._series.iteritems())
+            series['timestamp'] = self._timestamps.values()
+        return series
+
+
+class GPSReader(threading.Thread):
+
+    """Thread which continuously reads the GPS into a GPSTelemetry.
+
+    Reading the GPS continuously also prevents the device buffers from
+    filling up.
+
+    """
+
+    def __init__(self, gps, telemetry=None, shutdown_signal=None):
+        """Instantiate the class.
+
+        :param gps: :class:`pysparc.hardware.TrimbleGPS` instance.
+        :param telemetry: :class:`GPSTelemetry` instance.  If None, a new
+            instance is created.
+        :param shutdown_signal: signal to initiate a shutdown of the
+            thread.  If None, a new signal is created.
+
+        """
+        super(GPSReader, self).__init__()
+        self.daemon = True
+
+        self.gps = gps
+        if telemetry is None:
+            telemetry = GPSTelemetry()
+        self.telemetry = telemetry
+        if shutdown_signal is None:
+            shutdown_signal = threading.Event()
+        self._must_shutdown = shutdown_signal
+
+    def run(self):
+        """Read the GPS until a shutdown is signalled."""
+
+        while not self._must_shutdown.is_set():
+            try:
+                n_msgs = self.read_and_update()
+            except Exception:
+                logger.exception("Error reading GPS.")
+                n_msgs = 0
+            if not n_msgs:
+                self._must_shutdown.wait(READ_INTERVAL)
+
+    def read_and_update(self):
+        """Read all available messages and update the telemetry.
+
+        :returns: the number of messages read.
+
+        """
+        msgs = self.gps.read_messages()
+        for msg in msgs:
+            self.telemetry.update(msg)
+        return len(msgs)
+
+    def stop(self):
+        """Signal a shutdown and wait for the thread to finish."""
+
+        self._must_shutdown.set()
+        self.join()
@@ -6,6 +6,15 @@ Contents
 :class:`HardwareError`
     Raised on error with the hardware.
 
+:class:`AdaptiveReadPolicy`
+    Adapt the read size and latency timer to the observed data rate.
+
+:class:`DataAvailable`
+    Signal to wake up a consumer when data is available.
+
+:class:`DeviceReader`
+    Thread which continuously reads a hardware device into a queue.
+
 :class:`HiSPARCII`
     Access HiSPARC II hardware.
 
@@ -17,7 +26,16 @@ Contents
 
 """
 
+from __future__ import division
+
+import errno
+import fcntl
 import logging
+import math
+import os
+import Queue
+import select
+import threading
 import time
 
 import ftdi_chip
@@ -26,8 +44,9 @@ from messages import (HisparcMessageFactory, ResetMessage,
                       InitializeMessage, MeasuredDataMessage,
                       ControlParameterList, GetControlParameterList)
 import gps_messages
-from gps_messages import GPSMessageFactory
+from gps_messages import GPSMessageFactory, TSIPBuffer
 import config
+from ring_buffer import RingBuffer
 
 import pkg_resources
 
@@ -38,6 +57,30 @@ logger = logging.getLogger(__name__)
 READ_SIZE = 1024 * 62
 FPGA_BUFFER_SIZE = 64 * 1024
 
+# Bounds of the adaptive read size in bytes.  Must be multiples of 62.
+MIN_READ_SIZE = 62 * 16
+MAX_READ_SIZE = READ_SIZE
+# Bounds of the adaptive latency timer in ms.  At low data rates, the
+# latency timer is raised well above the fixed default of the chip.
+MIN_LATENCY_TIMER = 2
+MAX_LATENCY_TIMER = ftdi_chip.MAX_LATENCY_TIMER
+# Interval at which the adaptive read policy is updated, in seconds
+READ_POLICY_INTERVAL = 1.
+# Number of bytes per USB transfer the adaptive latency timer aims for
+TARGET_TRANSFER_SIZE = 4096
+# Ratio of the adaptive read size to the expected number of bytes per read
+READ_SIZE_HEADROOM = 4
+# Weight of the last interval in the moving average of the data rate
+RATE_SMOOTHING = .5
+
+# Maximum number of chunks in the hand-off queue of a device reader thread
+READER_QUEUE_SIZE = 256
+# Sleep time of a device reader thread after an empty read.  Well below
+# the default latency timer, so this hardly adds to the latency.
+READER_IDLE_SLEEP = .005
+# Timeout for putting a chunk in a full queue, before checking for shutdown
+READER_PUT_TIMEOUT = .1
+
 # FTDI MPSSE commands
 SET_BITS_LOW = 0x80
 GET_BITS_LOW = 0x81
@@ -70,10 +113,14 @@ class BaseHardware(object):
     description = "BaseHardware"
     _device = None
     _buffer = None
+    _buffer_type = bytearray
+    _capture = None
+    _reader = None
+    _read_policy = None
 
     def __init__(self):
         self.open()
-        self._buffer = bytearray()
+        self._buffer = self._buffer_type()
 
     def __del__(self):
         self.close()
@@ -87,6 +134,7 @@ class BaseHardware(object):
     def close(self):
         """Close the hardware device."""
 
+        self.stop_reader()
         if self._device and not self._device.closed:
             self._device.close()
 
@@ -98,7 +146,10 @@ class BaseHardware(object):
         was called is really newly measured.
 
         """
-        self._device.flush()
+        if self._reader is not None:
+            self._reader.flush()
+        else:
+            self._device.flush()
         del self._buffer[:]
 
     def send_message(self, msg):
@@ -117,22 +168,513 @@ class BaseHardware(object):
         If you just want to read messages from the device, use the
         appropriate methods.  This method is called by those methods.
 
+        If a reader thread is running, all chunks in its queue are placed
+        in the read buffer instead, without reading from the device.
+
         """
-        data = self._device.read(READ_SIZE)
-        self._buffer.extend(data)
+        if self._reader is not None:
+            for data in self._reader.get_chunks():
+                self._buffer.extend(data)
+        else:
+            self._buffer.extend(self.read_from_device())
+
+    def read_from_device(self):
+        """Read a single chunk of data from the device.
+
+        The data is written to the capture log, if capturing is enabled.
+        This method is called by :meth:`read_into_buffer`, or by the
+        reader thread if one is running.
+
+        :returns: string containing the data, possibly empty.
+
+        """
+        policy = self._read_policy
+        if policy is None:
+            data = self._device.read(READ_SIZE)
+        else:
+            data = self._device.read(policy.read_size)
+            policy.update(len(data))
+            if policy.latency_timer != self._device.latency_timer:
+                self._device.set_latency_timer(policy.latency_timer)
+        if self._capture is not None:
+            self._capture.write(self.description, data)
+        return data
+
+    def set_read_policy(self, policy):
+        """Adapt the read size and latency timer to the data rate.
+
+        By default, every read requests :data:`READ_SIZE` bytes and the
+        latency timer is fixed.
+
+        :param policy: a :class:`AdaptiveReadPolicy` instance, or None to
+            restore the default behaviour.
+
+        """
+        self._read_policy = policy
+        if policy is None:
+            latency = ftdi_chip.LATENCY_TIMER
+        else:
+            latency = policy.latency_timer
+        self._device.set_latency_timer(latency)
+
+    def get_read_policy_stats(self):
+        """Return statistics of the adaptive read policy.
+
+        :returns: dictionary as returned by
+            :meth:`AdaptiveReadPolicy.get_stats`, or None if no policy is
+            set.
+
+        """
+        if self._read_policy is not None:
+            return self._read_policy.get_stats()
+
+    def start_reader(self, queue_size=READER_QUEUE_SIZE,
+                     data_available=None):
+        """Start a thread which continuously reads from the device.
+
+        The thread reads the device as fast as data arrives and hands off
+        the data to :meth:`read_into_buffer` through a bounded queue.  This
+        decouples draining the USB buffers from processing the data, so
+        slow processing does not cause the hardware buffers to overflow.
+        Messages are still extracted in the calling thread.
+
+        :param queue_size: maximum number of chunks in the queue.  If the
+            queue is full, the thread waits until there is room.
+        :param data_available: optional :class:`DataAvailable` signal (or
+            :class:`threading.Event`) which is set whenever data is put in
+            the queue.  The signal can be shared by several devices, so
+            the consumer can wait for data from any of them.
+
+        """
+        if self._reader is None:
+            self._reader = DeviceReader(self, queue_size, data_available)
+            self._reader.start()
+            logger.info("Started reader thread for %s", self.description)
+
+    def stop_reader(self):
+        """Stop the reader thread, if running.
+
+        Data remaining in the queue is placed in the read buffer.
+
+        """
+        if self._reader is not None:
+            reader = self._reader
+            reader.stop()
+            self._reader = None
+            for data in reader.get_chunks(raise_errors=False):
+                self._buffer.extend(data)
+
+    def get_reader_stats(self):
+        """Return statistics of the reader thread.
+
+        :returns: dictionary as returned by :meth:`DeviceReader.get_stats`,
+            or None if no reader thread is running.
+
+        """
+        if self._reader is not None:
+            return self._reader.get_stats()
+
+    def start_capture(self, capture):
+        """Capture all raw data read from the device.
+
+        Every chunk of data read by :meth:`read_into_buffer` is written to
+        the capture log, together with a timestamp and the device
+        description.  Capturing is disabled by default.
+
+        :param capture: a :class:`pysparc.capture.CaptureWriter` instance.
+            A single writer can be shared by several devices.
+
+        """
+        self._capture = capture
+        logger.info("Started capturing raw data from %s", self.description)
+
+    def stop_capture(self):
+        """Stop capturing raw data read from the device.
+
+        The capture log is not closed, since it may be shared by other
+        devices.
+
+        """
+        self._capture = None
 
     def read_message(self):
         """Read a message from the hardware device.
 
         Call this method to communicate with the device.
 
-        This method should call :meth:`read_into_buffer` and should run
-        the return value through a MessageFactory class.
+        This method calls :meth:`read_into_buffer` and then extracts a
+        single message from the buffer using :meth:`extract_message`.
 
         """
         self.read_into_buffer()
+        return self.extract_message()
+
+    def read_messages(self):
+        """Read all available messages from the hardware device.
+
+        Data is read from the device only once, after which all complete
+        messages are extracted from the buffer.  Under high trigger rates,
+        this amortizes a single USB transfer over many messages.
+
+        :returns: list of messages, possibly empty.
+
+        """
+        self.read_into_buffer()
+        return list(self.iter_messages())
+
+    def iter_messages(self):
+        """Iterate over all complete messages in the read buffer.
+
+        No data is read from the device.  Iteration stops when there is
+        no complete message left in the buffer.
+
+        """
+        while True:
+            msg = self.extract_message()
+            if msg is None:
+                return
+            yield msg
+
+    def extract_message(self):
+        """Extract a single message from the read buffer.
+
+        This method should run the buffer through a MessageFactory class.
+
+        :returns: a message, or None if there is no complete message in the
+            buffer.
+
+        """
         raise NotImplementedError()
-        # return HisparcMessageFactory(self._buffer)
+
+
+class AdaptiveReadPolicy(object):
+
+    """Adapt the read size and latency timer to the observed data rate.
+
+    At low trigger rates, the fixed latency timer of 16 ms results in many
+    empty USB transfers, while at high rates a large read size allocates
+    large buffers which are mostly empty.  This policy keeps track of the
+    number of bytes returned by each read.  Once every interval, the
+    latency timer is set to collect about :data:`TARGET_TRANSFER_SIZE`
+    bytes per transfer, and the read size is set to a few times the
+    average number of bytes per read.  So, at low rates the latency timer
+    is raised up to :data:`MAX_LATENCY_TIMER`, and at high rates it is
+    lowered.  When a read fills the whole read size, data is waiting and
+    the read size is immediately set to the maximum.
+
+    """
+
+    def __init__(self, min_read_size=MIN_READ_SIZE,
+                 max_read_size=MAX_READ_SIZE,
+                 min_latency_timer=MIN_LATENCY_TIMER,
+                 max_latency_timer=MAX_LATENCY_TIMER,
+                 interval=READ_POLICY_INTERVAL):
+        """Instantiate the class.
+
+        :param min_read_size,max_read_size: bounds of the read size in
+            bytes.  Both must be a multiple of 62 bytes.
+        :param min_latency_timer,max_latency_timer: bounds of the latency
+            timer in ms.
+        :param interval: interval at which the policy is updated, in
+            seconds.
+
+        """
+        if min_read_size % 62 or max_read_size % 62:
+            raise ValueError("Read sizes must be a multiple of 62 bytes.")
+        if not 0 < min_read_size <= max_read_size:
+            raise ValueError("Invalid read size bounds.")
+        if not (ftdi_chip.MIN_LATENCY_TIMER <= min_latency_timer <=
+                max_latency_timer <= ftdi_chip.MAX_LATENCY_TIMER):
+            raise ValueError("Invalid latency timer bounds.")
+
+        self.min_read_size = min_read_size
+        self.max_read_size = max_read_size
+        self.min_latency_timer = min_latency_timer
+        self.max_latency_timer = max_latency_timer
+        self.interval = interval
+
+        # start with the defaults, until the data rate is known
+        self.read_size = max_read_size
+        self.latency_timer = min(max(ftdi_chip.LATENCY_TIMER,
+                                     min_latency_timer), max_latency_timer)
+
+        self.byte_rate = None
+        self.reads_per_second = 0.
+        self.transfers_per_second = 0.
+        self.bytes_per_transfer = 0.
+
+        self._t0 = None
+        self._n_reads = 0
+        self._n_transfers = 0
+        self._n_bytes = 0
+
+    def update(self, n_bytes, t=None):
+        """Update the policy with the result of a read.
+
+        :param n_bytes: the number of bytes returned by the read.
+        :param t: time of the read.  Defaults to the current time.
+
+        """
+        if t is None:
+            t = time.time()
+        if self._t0 is None:
+            self._t0 = t
+
+        self._n_reads += 1
+        if n_bytes:
+            self._n_transfers += 1
+            self._n_bytes += n_bytes
+        if n_bytes >= self.read_size:
+            self.read_size = self.max_read_size
+
+        dt = t - self._t0
+        if dt >= self.interval:
+            self._adapt(dt)
+            self._t0 = t
+            self._n_reads = self._n_transfers = self._n_bytes = 0
+
+    def _adapt(self, dt):
+        """Set the read size and latency timer from the last interval."""
+
+        byte_rate = self._n_bytes / dt
+        if self.byte_rate is None:
+            self.byte_rate = byte_rate
+        else:
+            self.byte_rate += RATE_SMOOTHING * (byte_rate - self.byte_rate)
+
+        self.reads_per_second = self._n_reads / dt
+        self.transfers_per_second = self._n_transfers / dt
+        if self._n_transfers:
+            self.bytes_per_transfer = self._n_bytes / self._n_transfers
+        else:
+            self.bytes_per_transfer = 0.
+
+        if self.byte_rate > 0:
+            latency = int(1e3 * TARGET_TRANSFER_SIZE / self.byte_rate)
+        else:
+            latency = self.max_latency_timer
+        self.latency_timer = min(max(latency, self.min_latency_timer),
+                                 self.max_latency_timer)
+
+        bytes_per_read = self.byte_rate / self.reads_per_second
+        # round up to a multiple of 62 bytes
+        read_size = 62 * int(math.ceil(READ_SIZE_HEADROOM * bytes_per_read /
+                                       62))
+        self.read_size = min(max(read_size, self.min_read_size),
+                             self.max_read_size)
+
+    def get_stats(self):
+        """Return the current settings and observed USB traffic.
+
+        :returns: dictionary with the read size in bytes, the latency timer
+            in ms, the smoothed data rate in bytes per second (None until
+            the first interval has passed), and the reads per second, USB
+            transfers (non-empty reads) per second and bytes per transfer
+            during the last interval.
+
+        """
+        return {'read_size': self.read_size,
+                'latency_timer': self.latency_timer,
+                'byte_rate': self.byte_rate,
+                'reads_per_second': self.reads_per_second,
+                'transfers_per_second': self.transfers_per_second,
+                'bytes_per_transfer': self.bytes_per_transfer}
+
+
+class DataAvailable(object):
+
+    """Signal to wake up a consumer when data is available.
+
+    This has the same interface as :class:`threading.Event`, but waiting
+    blocks in :func:`select.select` on a pipe.  In Python 2, waiting for a
+    :class:`threading.Event` with a timeout polls with sleeps of up to
+    50 ms, which adds latency and wakes up the process when idle.
+
+    """
+
+    _read_fd = _write_fd = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._is_set = False
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in self._read_fd, self._write_fd:
+            flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
+
+    def __del__(self):
+        self.close()
+
+    def is_set(self):
+        return self._is_set
+
+    def set(self):
+        """Set the signal, waking up a waiting consumer."""
+
+        with self._lock:
+            if not self._is_set:
+                self._is_set = True
+                os.write(self._write_fd, 'x')
+
+    def clear(self):
+        """Reset the signal."""
+
+        with self._lock:
+            if self._is_set:
+                self._is_set = False
+                try:
+                    os.read(self._read_fd, 1)
+                except OSError as exc:
+                    if exc.errno != errno.EAGAIN:
+                        raise
+
+    def wait(self, timeout=None):
+        """Block until the signal is set, or until a timeout occurs.
+
+        :param timeout: timeout in seconds, or None to wait indefinitely.
+        :returns: True if the signal is set.
+
+        """
+        select.select([self._read_fd], [], [], timeout)
+        return self._is_set
+
+    def close(self):
+        """Close the pipe."""
+
+        if self._read_fd is not None:
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+            self._read_fd = self._write_fd = None
+
+
+class DeviceReader(threading.Thread):
+
+    """Thread which continuously reads a hardware device into a queue.
+
+    Chunks of data are read using :meth:`BaseHardware.read_from_device` and
+    put in a bounded queue, to be consumed by :meth:`get_chunks`.  The
+    largest number of chunks ever waiting in the queue is tracked as the
+    high-water mark.  Errors while reading stop the thread and are raised
+    by :meth:`get_chunks` once the queue is empty.
+
+    """
+
+    def __init__(self, hardware, queue_size=READER_QUEUE_SIZE,
+                 data_available=None):
+        """Instantiate the class.
+
+        :param hardware: :class:`BaseHardware` instance.
+        :param queue_size: maximum number of chunks in the queue.
+        :param data_available: optional :class:`DataAvailable` signal
+            which is set whenever data is put in the queue.
+
+        """
+        super(DeviceReader, self).__init__()
+        self.daemon = True
+
+        self.hardware = hardware
+        self.queue = Queue.Queue(queue_size)
+        self.data_available = data_available
+        self.error = None
+        self._must_shutdown = threading.Event()
+        # Chunks read before a flush are discarded, see :meth:`flush`
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        self.n_chunks = 0
+        self.n_bytes = 0
+        self.n_full = 0
+        self.high_water_mark = 0
+
+    def run(self):
+        """Read the device until a shutdown is signalled."""
+
+        while not self._must_shutdown.is_set():
+            try:
+                with self._lock:
+                    data = self.hardware.read_from_device()
+                    generation = self._generation
+            except Exception as exc:
+                logger.error("Reader thread for %s stopped: %s",
+                             self.hardware.description, exc)
+                self.error = exc
+                # wake up the consumer, to raise the error
+                if self.data_available is not None:
+                    self.data_available.set()
+                return
+            if data:
+                self.put((generation, data))
+            else:
+                time.sleep(READER_IDLE_SLEEP)
+
+    def put(self, item):
+        """Put an item in the queue, waiting for room if necessary."""
+
+        if self.queue.full():
+            self.n_full += 1
+        while not self._must_shutdown.is_set():
+            try:
+                self.queue.put(item, timeout=READER_PUT_TIMEOUT)
+            except Queue.Full:
+                continue
+            else:
+                self.n_chunks += 1
+                self.n_bytes += len(item[1])
+                self.high_water_mark = max(self.high_water_mark,
+                                           self.queue.qsize())
+                if self.data_available is not None:
+                    self.data_available.set()
+                return
+
+    def get_chunks(self, raise_errors=True):
+        """Get all chunks of data waiting in the queue.
+
+        :param raise_errors: if True, raise the error which stopped the
+            thread, if the queue is empty.
+        :returns: list of strings.
+
+        """
+        chunks = []
+        while True:
+            try:
+                generation, data = self.queue.get_nowait()
+            except Queue.Empty:
+                break
+            if generation == self._generation:
+                chunks.append(data)
+        if raise_errors and not chunks and self.error is not None:
+            raise self.error
+        return chunks
+
+    def flush(self):
+        """Flush the device buffers and discard all data in the queue."""
+
+        with self._lock:
+            self.hardware._device.flush()
+            self._generation += 1
+        self.get_chunks(raise_errors=False)
+
+    def get_stats(self):
+        """Return statistics of the reader thread.
+
+        :returns: dictionary with the number of chunks and bytes read, the
+            current number of chunks in the queue, the high-water mark of
+            the queue, the queue size and the number of times the thread
+            found the queue full.
+
+        """
+        return {'n_chunks': self.n_chunks,
+                'n_bytes': self.n_bytes,
+                'queue_length': self.queue.qsize(),
+                'high_water_mark': self.high_water_mark,
+                'queue_size': self.queue.maxsize,
+                'n_full': self.n_full}
+
+    def stop(self):
+        """Signal a shutdown and wait for the thread to finish."""
+
+        self._must_shutdown.set()
+        self.join()
 
 
 class HiSPARCII(BaseHardware):
@@ -145,6 +687,9 @@ class HiSPARCII(BaseHardware):
     """
 
     description = "HiSPARC II Master"
+    # Messages are consumed from the front of the buffer, so use a buffer
+    # which does not shift its contents on every message.
+    _buffer_type = RingBuffer
 
     def __init__(self, secondary=False):
         if secondary:
@@ -163,16 +708,16 @@ class HiSPARCII(BaseHardware):
         # Read (some) config values from device
         self.send_message(GetControlParameterList())
 
-    def read_message(self):
-        """Read a message from the hardware device.
+    def extract_message(self):
+        """Extract a single message from the read buffer.
 
-        Call this method to communicate with the device.
+        If the message is a :class:`ControlParameterList`, the device
+        configuration is updated.
 
         :returns: a :class:`pysparc.messages.HisparcMessage` subclass
-            instance
+            instance, or None.
 
         """
-        self.read_into_buffer()
         msg = HisparcMessageFactory(self._buffer)
         if isinstance(msg, ControlParameterList):
             self.config.update_from_config_message(msg)
@@ -332,6 +877,8 @@ class TrimbleGPS(BaseHardware):
     """Access Trimble GPS unit inside the HiSPARC hardware."""
 
     description = "FT232R USB UART"
+    # Packets are scanned incrementally, instead of rescanning the buffer
+    _buffer_type = TSIPBuffer
 
     def open(self):
         """Open the hardware device and set line settings."""
@@ -343,16 +890,13 @@ class TrimbleGPS(BaseHardware):
         self._device.set_line_settings(ftdi_chip.BITS_8, ftdi_chip.PARITY_ODD,
                                        ftdi_chip.STOP_BIT_1)
 
-    def read_message(self):
-        """Read a message from the hardware device.
+    def extract_message(self):
+        """Extract a single message from the read buffer.
 
-        Call this method to communicate with the device.
-
-        This method should call :meth:`read_into_buffer` and should run
-        the return value through a MessageFactory class.
+        :returns: a :class:`pysparc.gps_messages.GPSMessage` subclass
+            instance, or None.
 
         """
-        self.read_into_buffer()
         return GPSMessageFactory(self._buffer)
 
     def reset_defaults(self):
@@ -4,6 +4,8 @@ Parse and operate on messages from and to the HiSPARC II / III hardware.
 
 :class:`HisparcMessage`: factory class for HiSPARC messages
 
+:func:`build_message_registry`: map message identifiers to message classes
+
 """
 
 import struct
@@ -66,6 +68,13 @@ command_ids = {'soft_reset': 0xff,
 
 NANOSECONDS_PER_SECOND = int(1e9)
 
+# Number of GPS date and time to timestamp conversions to remember
+TIMESTAMP_CACHE_SIZE = 64
+# Offsets of the pre-coincidence, coincidence and post-coincidence times
+# in the header of a measured data message
+COINCIDENCE_TIME_OFFSETS = (5, 7, 9)
+_timestamp_cache = {}
+
 
 class MessageError(Exception):
 
@@ -82,6 +91,43 @@ class CorruptMessageError(MessageError):
     pass
 
 
+def copy_frame(buff, length):
+    """Return an immutable copy of the first bytes of the buffer.
+
+    In contrast to ``str(buff[:length])``, the data is copied only once.
+
+    :param buff: the contents of the usb buffer
+    :param length: the number of bytes to copy.  If the buffer is shorter,
+        the entire buffer is copied.
+
+    """
+    if hasattr(buff, 'tobytes'):
+        return buff.tobytes(length)
+    else:
+        return memoryview(buff)[:length].tobytes()
+
+
+def gps_timestamp(year, month, day, hours, minutes, seconds):
+    """Return the unix timestamp for a GPS date and time.
+
+    The GPS date and time only change once per second, so all messages
+    sent in the same second share the same result.  Results are cached.
+    Raises :class:`ValueError` for an invalid date or time.
+
+    """
+    key = (year, month, day, hours, minutes, seconds)
+    try:
+        return _timestamp_cache[key]
+    except KeyError:
+        if len(_timestamp_cache) >= TIMESTAMP_CACHE_SIZE:
+            _timestamp_cache.clear()
+        # validate the date and time by creating a datetime instance
+        dt = datetime.datetime(*key)
+        timestamp = calendar.timegm(dt.utctimetuple())
+        _timestamp_cache[key] = timestamp
+        return timestamp
+
+
 class BaseMessage(object):
 
     """HiSPARC Message base/factory class
@@ -181,32 +227,38 @@ class OneSecondMessage(HisparcMessage):
 
     identifier = msg_ids['one_second']
     msg_format = '>2B2BH3BIf4H61s1B'
+    msg_struct = struct.Struct(msg_format)
 
     def __init__(self, buff):
         super(OneSecondMessage, self).__init__()
         self.parse_message(buff)
 
     def parse_message(self, buff):
-        msg_length = struct.calcsize(self.msg_format)
-        str_buff = str(buff[:msg_length])
+        msg_length = self.msg_struct.size
+        str_buff = copy_frame(buff, msg_length)
 
         (header, identifier, self.gps_day, self.gps_month, self.gps_year,
          self.gps_hours, self.gps_minutes, self.gps_seconds,
          self.count_ticks_PPS, self.quantization_error,
          self.count_ch2_high, self.count_ch2_low, self.count_ch1_high,
          self.count_ch1_low, self.satellite_info, end) = \
-            struct.unpack_from(self.msg_format, str_buff)
+            self.msg_struct.unpack_from(str_buff)
 
         self.validate_codons_and_id(header, identifier, end)
 
-        self.datetime = datetime.datetime(self.gps_year, self.gps_month,
-                                          self.gps_day, self.gps_hours,
-                                          self.gps_minutes,
-                                          self.gps_seconds)
-        self.timestamp = calendar.timegm(self.datetime.utctimetuple())
+        self.timestamp = gps_timestamp(self.gps_year, self.gps_month,
+                                       self.gps_day, self.gps_hours,
+                                       self.gps_minutes, self.gps_seconds)
 
         del buff[:msg_length]
 
+    @lazy
+    def datetime(self):
+        """GPS date and time of the message."""
+        return datetime.datetime(self.gps_year, self.gps_month,
+                                 self.gps_day, self.gps_hours,
+                                 self.gps_minutes, self.gps_seconds)
+
     def __str__(self):
         return 'One second message: %s %d %f %d %d %d %d' % (
             self.datetime, self.count_ticks_PPS & ((1 << 31) - 1),
@@ -216,49 +268,78 @@ class OneSecondMessage(HisparcMessage):
 
 class MeasuredDataMessage(HisparcMessage):
 
+    """Measured data (event) messages from HiSPARC hardware.
+
+    The message data is copied from the buffer only once, into an
+    immutable frame.  The raw traces are views into that frame.
+
+    """
+
     identifier = msg_ids['measured_data']
     msg_format = '>2BB4H2BH3BI'
-    msg_tail_format = '>%dsB'
+    msg_struct = struct.Struct(msg_format)
 
     def __init__(self, buff):
         super(MeasuredDataMessage, self).__init__()
         self.parse_message(buff)
 
     def parse_message(self, buff):
-        msg_length = struct.calcsize(self.msg_format)
-        str_buff = str(buff[:msg_length])
+        msg_length = self.msg_struct.size
+        if len(buff) < msg_length:
+            raise struct.error("Message is too short")
+
+        # The pre-coincidence, coincidence and post-coincidence times
+        # (big-endian shorts) determine the length of the message.  Read
+        # them from the buffer, so the frame is copied only once.
+        event_length = sum(buff[idx] << 8 | buff[idx + 1]
+                           for idx in COINCIDENCE_TIME_OFFSETS)
+        # 12 bits * 2 adcs / (8 bits / byte)
+        trace_length = 3 * event_length
+        # message contains data from two channels, followed by stop codon
+        total_length = msg_length + 2 * trace_length + 1
+
+        frame = copy_frame(buff, total_length)
+        if len(frame) < total_length:
+            raise struct.error("Message is too short")
 
         (header, identifier, self.trigger_condition, self.trigger_pattern,
          self.pre_coincidence_time, self.coincidence_time,
          self.post_coincidence_time, self.gps_day, self.gps_month,
          self.gps_year, self.gps_hours, self.gps_minutes,
          self.gps_seconds, self.count_ticks_PPS) = \
-            struct.unpack_from(self.msg_format, str_buff)
-
-        event_length = (self.pre_coincidence_time + self.coincidence_time +
-                        self.post_coincidence_time)
-        # 12 bits * 2 adcs / (8 bits / byte)
-        trace_length = 3 * event_length
-        # message contains data from two channels
-        msg_tail_format = self.msg_tail_format % (2 * trace_length)
-        msg_tail_length = struct.calcsize(msg_tail_format)
-        total_length = msg_length + msg_tail_length
-        str_buff = str(buff[msg_length:total_length])
-
-        self.raw_traces, end = struct.unpack_from(msg_tail_format, str_buff)
+            self.msg_struct.unpack_from(frame)
+        end = ord(frame[-1])
 
         self.validate_codons_and_id(header, identifier, end)
 
+        self._frame = frame
+        self._traces_offset = msg_length
         self.trace_length = trace_length
-        self.datetime = datetime.datetime(self.gps_year, self.gps_month,
-                                          self.gps_day, self.gps_hours,
-                                          self.gps_minutes,
-                                          self.gps_seconds)
-        self.timestamp = calendar.timegm(self.datetime.utctimetuple())
+        self.timestamp = gps_timestamp(self.gps_year, self.gps_month,
+                                       self.gps_day, self.gps_hours,
+                                       self.gps_minutes, self.gps_seconds)
         self.nanoseconds = self.count_ticks_PPS * 5
 
         del buff[:total_length]
 
+    @lazy
+    def datetime(self):
+        """Date and time of the message, derived from the timestamp.
+
+        When the trigger time is corrected, the timestamp is updated and
+        this attribute is invalidated.
+
+        """
+        return datetime.datetime.utcfromtimestamp(self.timestamp)
+
+    @property
+    def raw_traces(self):
+        """Raw trace data of both channels (read-only view)."""
+
+        return np.frombuffer(self._frame, dtype=np.uint8,
+                             count=2 * self.trace_length,
+                             offset=self._traces_offset)
+
     def __str__(self):
         bl1 = self.trace_ch1[:100].mean()
         ph1 = self.trace_ch1.max() - bl1
@@ -269,6 +350,12 @@ class MeasuredDataMessage(HisparcMessage):
         return 'Event message: %s %d pulseheights ch1: %d ch2: %d' % (
             self.datetime, self.nanoseconds, ph1, ph2)
 
+    @lazy
+    def traces(self):
+        """Signal traces of both channels, shape (2, number of samples)."""
+        raw_traces = self.raw_traces.reshape(2, self.trace_length)
+        return unpack_raw_traces(raw_traces)
+
     @lazy
     def trace_ch1(self):
         """Signal trace of channel 1."""
@@ -305,10 +392,7 @@ class MeasuredDataMessage(HisparcMessage):
         if ch not in [1, 2]:
             raise ValueError("Undefined signal channel: %d" % ch)
         else:
-            idx_start = (ch - 1) * self.trace_length
-            idx_stop = idx_start + self.trace_length
-            raw_trace = self.raw_traces[idx_start:idx_stop]
-            return self._unpack_raw_trace(raw_trace)
+            return self.traces[ch - 1]
 
     @lazy
     def ext_timestamp(self):
@@ -316,34 +400,77 @@ class MeasuredDataMessage(HisparcMessage):
 
         return self.timestamp * NANOSECONDS_PER_SECOND + self.nanoseconds
 
-    def _unpack_raw_trace(self, raw_trace):
-        """Unpack a raw trace from 12-bit sequences.
-
-        This has to be very fast, since this must run on a Raspberry Pi
-        and still be able to handle lots of events.  It uses some NumPy
-        magic to accomplish this.  Rule #1: DO NOT LOOP.  Really, looping
-        over thousands of samples and calling some function
-        (struct.unpack, for example) is unbearably slow, even without
-        doing anything.  Rule #2: do not create an array from thousands of
-        values (e.g. np.array(result_from_struct_unpack)).  This is very
-        slow. Rule #3: if you really must loop, DO NOT LOOP.  So, this
-        code does not loop, and uses NumPy functions to create an array
-        directly from binary data.  Bit manipulations are done on the
-        entire array.
-        """
-        # convert every byte to a numerical value
-        byte_values = np.fromstring(raw_trace, dtype=np.uint8)
-        # cast to *signed* 16-bit, so there's room for 12-bit values, and
-        # baseline subtraction gives negative values
-        values = byte_values.astype(np.int16)
 
-        # for every 3 bytes:
-        # create array of first 12 bits
-        a1 = (values[::3] << 4) + (values[1::3] >> 4)
-        # create array of last 12 bits
-        a2 = ((values[1::3] & 0x0f) << 8) + values[2::3]
-        # stack them together and flatten to 1D-array
-        return np.dstack((a1, a2)).ravel()
+def unpack_raw_traces(raw_traces, out=None):
+    """Unpack raw traces from 12-bit sequences.
+
+    This has to be very fast, since this must run on a Raspberry Pi
+    and still be able to handle lots of events.  It uses some NumPy
+    magic to accomplish this.  Rule #1: DO NOT LOOP.  Really, looping
+    over thousands of samples and calling some function
+    (struct.unpack, for example) is unbearably slow, even without
+    doing anything.  Rule #2: do not create an array from thousands of
+    values (e.g. np.array(result_from_struct_unpack)).  This is very
+    slow. Rule #3: if you really must loop, DO NOT LOOP.  So, this
+    code does not loop, and uses NumPy functions to create an array
+    directly from binary data.  Bit manipulations are done on the
+    entire array, writing directly into the output array.
+
+    :param raw_traces: array of bytes (uint8), of any shape.  The length
+        of the last axis must be a multiple of three.
+    :param out: optional int16 array to unpack into.  The last axis must
+        be two-thirds the length of that of the raw traces.
+    :returns: array of *signed* 16-bit values, so there's room for 12-bit
+        values, and baseline subtraction gives negative values.
+
+    """
+    raw_traces = np.asarray(raw_traces, dtype=np.uint8)
+    shape = raw_traces.shape[:-1] + (raw_traces.shape[-1] // 3 * 2,)
+    if out is None:
+        out = np.empty(shape, dtype=np.int16)
+    elif out.shape != shape:
+        raise ValueError("Output array has wrong shape: %s, expected %s" %
+                         (out.shape, shape))
+
+    # for every 3 bytes: the first 12 bits in the even samples, the last
+    # 12 bits in the odd samples
+    first = out[..., ::2]
+    last = out[..., 1::2]
+    first[...] = raw_traces[..., ::3]
+    first <<= 4
+    first |= raw_traces[..., 1::3] >> 4
+    last[...] = raw_traces[..., 1::3] & 0x0f
+    last <<= 8
+    last |= raw_traces[..., 2::3]
+    return out
+
+
+def unpack_traces_of_messages(msgs):
+    """Unpack the traces of many measured data messages in one pass.
+
+    All messages must have the same trace length.  The traces are unpacked
+    into a single array, and the traces of the messages are set to be
+    views into that array.
+
+    :param msgs: list of :class:`MeasuredDataMessage` instances
+    :returns: array of shape (number of messages, 2, number of samples)
+
+    """
+    if not msgs:
+        return np.empty((0, 2, 0), dtype=np.int16)
+
+    trace_length = msgs[0].trace_length
+    raw_traces = np.empty((len(msgs), 2, trace_length), dtype=np.uint8)
+    for raw, msg in zip(raw_traces, msgs):
+        if msg.trace_length != trace_length:
+            raise ValueError("Messages have different trace lengths")
+        raw[...] = msg.raw_traces.reshape(2, trace_length)
+
+    traces = unpack_raw_traces(raw_traces)
+    for msg, msg_traces in zip(msgs, traces):
+        msg.traces = msg_traces
+        msg.trace_ch1, msg.trace_ch2 = msg_traces
+    return traces
 
 
 class GetControlParameterList(HisparcMessage):
@@ -453,53 +580,98 @@ class ResetMessage(HisparcMessage):
     identifier = msg_ids['reset']
 
 
+def build_message_registry(cls):
+    """Map message identifiers to the classes parsing those messages.
+
+    Only subclasses of :param cls: which implement :meth:`parse_message`
+    are included.  Messages which are only sent to the hardware are left
+    out.
+
+    """
+    registry = {}
+    for klass in cls.__subclasses__():
+        if klass.identifier is not None and 'parse_message' in vars(klass):
+            registry[klass.identifier] = klass
+    return registry
+
+
+# Classes for all messages received from the hardware, keyed by identifier
+msg_classes = build_message_registry(HisparcMessage)
+
+
+def resynchronize(buff, offset=0):
+    """Strip bytes from the buffer until a plausible message start is found.
+
+    A plausible message start is a start codon, followed by the identifier
+    of a known message type.  All garbage is stripped in one go.  If the
+    start codon is the last byte in the buffer, it is kept, since the
+    identifier has not yet been received.
+
+    :param buff: the contents of the usb buffer
+    :param offset: number of bytes at the start of the buffer which are
+        known to be garbage
+    :return: the number of bytes discarded
+
+    """
+    start_codon = chr(HisparcMessage.codons['start'])
+    length = len(buff)
+    idx = buff.find(start_codon, offset)
+    while idx != -1 and idx + 1 < length and buff[idx + 1] not in msg_classes:
+        idx = buff.find(start_codon, idx + 1)
+    if idx == -1:
+        idx = length
+
+    del buff[:idx]
+    logger.warning("Discarded %d bytes while resynchronizing.", idx)
+    return idx
+
+
 def HisparcMessageFactory(buff):
     """Return a message, extracted from the buffer
 
     Inspect the buffer and extract the first full message. A
     HisparcMessage subclass instance will be returned, according to
-    the type of the message.
+    the type of the message.  Garbage and corrupt messages are stripped
+    from the buffer.
 
     :param buff: the contents of the usb buffer
-    :return: instance of a HisparcMessage subclass
+    :return: instance of a HisparcMessage subclass, or None if there is no
+        full message in the buffer.
 
     """
-    while True:
-        try:
-            HisparcMessage.validate_message_start(buff)
-        except StartCodonError:
+    start_codon = HisparcMessage.codons['start']
+
+    while len(buff) >= 2:
+        if buff[0] != start_codon:
             logger.warning("Start codon error, stripping buffer.")
-            HisparcMessage.strip_until_start_codon(buff)
-        except IndexError:
+            resynchronize(buff)
+            continue
+
+        cls = msg_classes.get(buff[1])
+        if cls is None:
+            # Unknown message type.  This usually happens after a partial
+            # or corrupt message is stripped away until a new start codon
+            # is found.  This 'start codon' is probably not an actual start
+            # codon, but somewhere in the middle of a partial message.
+            logger.warning("Unknown message type (probably corrupt), "
+                           "stripping buffer.")
+            resynchronize(buff, offset=1)
+            continue
+
+        try:
+            return cls(buff)
+        except CorruptMessageError:
+            logger.warning("Corrupt message, stripping buffer.")
+            resynchronize(buff, offset=1)
+        except struct.error:
+            # message is too short, wait for the rest to come in.
+            logger.debug("Message is too short, wait for more data.")
             return None
-        else:
-            break
-
-    for cls in HisparcMessage.__subclasses__():
-        if cls.is_message_for(buff):
-            try:
-                return cls(buff)
-            except CorruptMessageError:
-                logger.warning("Corrupt message, stripping buffer.")
-                HisparcMessage.strip_partial_message(buff)
-                return HisparcMessageFactory(buff)
-            except struct.error:
-                # message is too short, wait for the rest to come in.
-                logger.debug("Message is too short, wait for more data.")
-                return None
-            except ValueError:
-                # some value in a message could not be converted.
-                # Probably a corrupt message
-                logger.warning("ValueError, so probably a corrupt message; "
-                               "stripping buffer.")
-                HisparcMessage.strip_partial_message(buff)
-                return HisparcMessageFactory(buff)
-
-    # Unknown message type.  This usually happens after a partial or
-    # corrupt message is stripped away until a new start codon is found.
-    # This 'start codon' is probably not an actual start codon, but
-    # somewhere in the middle of a partial message.
-    logger.warning("Unknown message type (probably corrupt), "
-                   "stripping buffer.")
-    HisparcMessage.strip_partial_message(buff)
-    return HisparcMessageFactory(buff)
+        except ValueError:
+            # some value in a message could not be converted.
+            # Probably a corrupt message
+            logger.warning("ValueError, so probably a corrupt message; "
+                           "stripping buffer.")
+            resynchronize(buff, offset=1)
+
+    return None
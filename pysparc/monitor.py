@@ -32,6 +32,8 @@ STATUS_MSG = {OK: 'OK', WARNING: 'WARNING', CRITICAL: 'CRITICAL',
               UNKNOWN: 'UNKNOWN'}
 
 CPU_THRESHOLD = 2.0
+# Warn if the standard deviation of the GPS clock bias exceeds this (ns)
+CLOCK_BIAS_STD_THRESHOLD = 100.
 
 
 class Monitor(object):
@@ -59,18 +61,50 @@ class Monitor(object):
         uptime = re.search('up (.*),[ 0-9]+ user', output).group(1)
         return uptime
 
-    def send_trigger_rate(self, trigger_rate):
-        """Send the trigger rate to the monitor."""
+    def send_trigger_rate(self, trigger_rate, rates=None):
+        """Send the trigger rate to the monitor.
 
+        :param trigger_rate: the trigger rate.
+        :param rates: optional dictionary of trigger rates averaged over
+            other windows, by window in seconds.  These are added to the
+            message.
+
+        """
         if trigger_rate:
             status = OK
             msg = "%.1f Hz" % trigger_rate
+            if rates:
+                msg += " (%s)" % ', '.join(
+                    "%d s: %.1f Hz" % (window, rates[window])
+                    for window in sorted(rates))
         else:
             status = CRITICAL
             msg = "No recorded events."
 
         self._send_status_for_service('TriggerRate', status, msg)
 
+    def send_gps_status(self, gps_status):
+        """Send the GPS timing status to the monitor.
+
+        :param gps_status: dictionary as returned by
+            :meth:`pysparc.gps_telemetry.GPSTelemetry.get_status`.
+
+        """
+        if not gps_status['n_packets']:
+            status = CRITICAL
+            msg = "No GPS timing packets."
+        else:
+            if gps_status['clock_bias_std'] > CLOCK_BIAS_STD_THRESHOLD:
+                status = WARNING
+            else:
+                status = OK
+            msg = ("clock bias %.1f +- %.1f ns, alarms: %s, survey: %d%%" %
+                   (gps_status['clock_bias_mean'],
+                    gps_status['clock_bias_std'],
+                    bin(gps_status['alarms']), gps_status['survey_progress']))
+
+        self._send_status_for_service('GPS', status, msg)
+
     def send_cpu_load(self):
         """Send the system cpu load to the monitor."""
 
@@ -0,0 +1,423 @@
+"""Replay a captured raw data stream.
+
+A capture log, written by :class:`pysparc.capture.CaptureWriter`, is
+replayed through the same code paths as data read from the hardware.
+The replayed hardware classes only replace the USB device, and are
+plugged into the data acquisition of :mod:`pysparc.daq`.  So message
+framing, reader threads, the analysis pool, the stew, the mixer, storage
+and the status logging are all exercised exactly as in a live data run.
+Only the capture of raw data and the capture process, which open the USB
+devices themselves, are not used.  Replays run in real time (or a
+multiple thereof), or as fast as possible.  This makes it possible to
+benchmark and regression-test the full data acquisition pipeline without
+hardware.
+
+Contents
+--------
+
+:class:`Replay`
+    Demultiplex a capture log into the data streams of the devices.
+
+:class:`ReplayChip`
+    Stand-in for a :class:`pysparc.ftdi_chip.FtdiChip`, returning
+    recorded data.
+
+:class:`ReplayHiSPARCII`
+    HiSPARC II or III hardware, replayed from a capture log.
+
+:class:`ReplayTrimbleGPS`
+    Trimble GPS unit, replayed from a capture log.
+
+:class:`ReplayDataAcquisition`
+    Data acquisition of a single device, replayed from a capture log.
+
+:class:`ReplayPrimarySecondaryDataAcquisition`
+    Data acquisition of a primary/secondary setup, replayed from a
+    capture log.
+
+"""
+
+import collections
+import logging
+import threading
+import time
+
+from hardware import HiSPARCII, TrimbleGPS
+from daq import (DataAcquisition, PrimarySecondaryDataAcquisition,
+                 ALL_CONFIG_FILES)
+
+
+logger = logging.getLogger(__name__)
+
+
+# Process events every PROCESS_INTERVAL seconds of recorded time
+PROCESS_INTERVAL = 1.
+# Log the status every STATUS_INTERVAL seconds of recorded time
+STATUS_INTERVAL = 60.
+# Sleep time when no data is due yet, when replaying in real time
+IDLE_SLEEP = .001
+
+
+class Replay(object):
+
+    """Demultiplex a capture log into the data streams of the devices.
+
+    Each device reads its own recorded chunks, in the order in which they
+    were recorded.  The records are read from the capture lazily, so
+    arbitrarily long captures can be replayed.  Only the data of
+    registered devices is replayed; the data of other devices in the
+    capture is skipped.  The devices may be read from different threads.
+
+    """
+
+    def __init__(self, records, speed=None):
+        """Instantiate the class.
+
+        :param records: a :class:`pysparc.capture.CaptureReader` instance,
+            or any iterable of (timestamp, description, data) records.
+        :param speed: replay speed relative to real time, e.g. 1. for real
+            time or 10. for ten times faster.  If None, replay as fast as
+            possible.
+
+        """
+        self.speed = speed
+        self._records = iter(records)
+        self._pending = {}
+        self._no_more_records = False
+        self._wall_start = None
+        self._capture_start = None
+        self._lock = threading.Lock()
+
+        # timestamp of the most recent chunk which was replayed
+        self.capture_time = None
+        self.n_chunks = 0
+        self.n_bytes = 0
+
+    @property
+    def exhausted(self):
+        """True if all recorded chunks have been replayed."""
+
+        return self._no_more_records and not any(self._pending.values())
+
+    def register(self, description):
+        """Register a device to replay.
+
+        :param description: description of the device.
+
+        """
+        self._pending.setdefault(description, collections.deque())
+
+    def read(self, description):
+        """Return the next recorded chunk of a device.
+
+        When replaying in real time, a chunk is only returned when it is
+        due.  Otherwise, an empty string is returned, just like when
+        reading from an idle device.
+
+        :param description: description of the device.
+        :returns: string containing the data.
+
+        """
+        with self._lock:
+            return self._read(description)
+
+    def _read(self, description):
+        if self._wall_start is None:
+            self._wall_start = time.time()
+
+        pending = self._pending[description]
+        if not pending:
+            self._read_records_until(description)
+            if not pending:
+                return ''
+
+        timestamp, data = pending[0]
+        if self.speed is not None and not self._is_due(timestamp):
+            return ''
+        pending.popleft()
+
+        if self.capture_time is None or timestamp > self.capture_time:
+            self.capture_time = timestamp
+        self.n_chunks += 1
+        self.n_bytes += len(data)
+        return data
+
+    def _read_records_until(self, description):
+        """Read records until a chunk of the device is found."""
+
+        for timestamp, record_description, data in self._records:
+            if self._capture_start is None:
+                self._capture_start = timestamp
+            pending = self._pending.get(record_description)
+            if pending is None:
+                continue
+            pending.append((timestamp, data))
+            if record_description == description:
+                return
+        self._no_more_records = True
+
+    def _is_due(self, timestamp):
+        """Return True if the chunk recorded at timestamp is due."""
+
+        recorded_delay = (timestamp - self._capture_start) / self.speed
+        return time.time() - self._wall_start >= recorded_delay
+
+
+class ReplayChip(object):
+
+    """Stand-in for a FtdiChip, returning recorded data.
+
+    Data written to the device is discarded.
+
+    """
+
+    closed = False
+    latency_timer = None
+
+    def __init__(self, replay, description):
+        """Instantiate the class.
+
+        :param replay: :class:`Replay` instance.
+        :param description: description of the replayed device.
+
+        """
+        self.replay = replay
+        self.description = description
+        replay.register(description)
+
+    def read(self, read_size=None):
+        """Return the next recorded chunk.
+
+        The recorded chunks are returned as-is.  Since they were read from
+        the hardware with the same read size, read_size is ignored.
+
+        """
+        return self.replay.read(self.description)
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def set_latency_timer(self, latency):
+        self.latency_timer = latency
+
+    def close(self):
+        self.closed = True
+
+
+class ReplayHiSPARCII(HiSPARCII):
+
+    """HiSPARC II or III hardware, replayed from a capture log.
+
+    Messages sent to the device are discarded.
+
+    """
+
+    def __init__(self, replay, description=HiSPARCII.description):
+        """Instantiate the class.
+
+        :param replay: :class:`Replay` instance.
+        :param description: description of the recorded device, e.g.
+            'HiSPARC III Slave'.
+
+        """
+        self.replay = replay
+        self.description = description
+        super(ReplayHiSPARCII, self).__init__()
+
+    def open(self):
+        """Open the replayed device."""
+
+        self._device = ReplayChip(self.replay, self.description)
+        logger.info("Replaying %s" % self.description)
+
+
+class ReplayTrimbleGPS(TrimbleGPS):
+
+    """Trimble GPS unit, replayed from a capture log."""
+
+    def __init__(self, replay, description=TrimbleGPS.description):
+        """Instantiate the class.
+
+        :param replay: :class:`Replay` instance.
+        :param description: description of the recorded device.
+
+        """
+        self.replay = replay
+        self.description = description
+        super(ReplayTrimbleGPS, self).__init__()
+
+    def open(self):
+        """Open the replayed device."""
+
+        self._device = ReplayChip(self.replay, self.description)
+        logger.info("Replaying %s" % self.description)
+
+
+class ReplayDataAcquisition(DataAcquisition):
+
+    """Data acquisition of a single device, replayed from a capture log.
+
+    The pysparc_daq data acquisition reads the replayed devices, and its
+    own methods process and store the messages and events.  Only the main
+    loop is replaced: events are processed and the status is logged at
+    intervals of recorded time instead of wall time, so that the result
+    of a replay does not depend on the replay speed, and the loop ends
+    when all recorded data is processed.
+
+    The hardware is not initialized (no ADC alignment and GPS reset), and
+    the configuration is not written back to the config file.
+
+    """
+
+    def __init__(self, replay, primary=HiSPARCII.description,
+                 storage_manager=None, config_files=ALL_CONFIG_FILES,
+                 interval=PROCESS_INTERVAL):
+        """Instantiate the class.
+
+        :param replay: :class:`Replay` instance.
+        :param primary: description of the recorded primary device.
+        :param storage_manager: a :class:`pysparc.storage.StorageManager`
+            or any object with a store_event method.  If None, events are
+            counted, but not stored.
+        :param config_files: config files to read.
+        :param interval: process events every interval seconds of
+            recorded time.
+
+        """
+        self.replay = replay
+        self.primary_description = primary
+        self.replay_storage_manager = storage_manager
+        self.config_files = config_files
+        self.interval = interval
+
+        self._last_processed = None
+        self._last_logged = None
+        self.n_messages = 0
+        self.n_events = 0
+
+        super(ReplayDataAcquisition, self).__init__()
+
+    def read_config(self):
+        logger.info("Reading config from file")
+        self.config.read(self.config_files)
+
+    def open_hisparc_hardware(self):
+        self.primary = ReplayHiSPARCII(self.replay, self.primary_description)
+        self.t_last_msg = time.time()
+
+    def open_gps(self):
+        self.gps = ReplayTrimbleGPS(self.replay)
+
+    def initialize_hardware(self):
+        self.configure_devices()
+
+    def initialize_gps(self):
+        pass
+
+    def write_config(self):
+        pass
+
+    def start_capture(self):
+        """Do not capture, since the capture log is replayed"""
+
+        self.capture = None
+
+    def move_devices_to_capture_process(self):
+        """Read the devices in the main process"""
+
+        # the capture process opens the USB devices itself
+        self.capture_process = None
+        self.n_overruns = 0
+
+    def start_storage(self):
+        self.storage_manager = self.replay_storage_manager
+
+    def close_storage(self):
+        pass
+
+    def run(self):
+        """Replay until all recorded data is processed."""
+
+        logger.info("Replaying data.")
+        while not self.replay.exhausted:
+            if not self.step():
+                self.wait_for_data()
+
+        # process the data left in the reader queues and the stews
+        for device in self.hisparc_devices():
+            device.stop_reader()
+        self.n_messages += self.read_and_process_messages()
+        self.process_and_store_events()
+
+    def step(self):
+        """Read and process messages, and process events when due.
+
+        :returns: the number of messages read.
+
+        """
+        n_messages = self.read_and_process_messages()
+        self.n_messages += n_messages
+
+        capture_time = self.replay.capture_time
+        if capture_time is not None:
+            if self._last_processed is None:
+                self._last_processed = self._last_logged = capture_time
+            if capture_time - self._last_processed >= self.interval:
+                self.process_and_store_events()
+                self._last_processed = capture_time
+            if capture_time - self._last_logged >= STATUS_INTERVAL:
+                self.log_status()
+                self._last_logged = capture_time
+
+        return n_messages
+
+    def wait_for_data(self):
+        """Wait for data, when no data was read.
+
+        With reader threads, block until any of them has read data.
+        Otherwise, only sleep when replaying in real time.
+
+        """
+        if self.data_available is not None:
+            self.data_available.wait(IDLE_SLEEP)
+            self.data_available.clear()
+        elif self.replay.speed is not None:
+            time.sleep(IDLE_SLEEP)
+
+    def store_events(self, events):
+        self.n_events += len(events)
+        if self.storage_manager is not None:
+            super(ReplayDataAcquisition, self).store_events(events)
+
+
+class ReplayPrimarySecondaryDataAcquisition(ReplayDataAcquisition,
+                                            PrimarySecondaryDataAcquisition):
+
+    """Data acquisition of a primary/secondary setup, replayed from a
+    capture log.
+
+    """
+
+    def __init__(self, replay, primary=HiSPARCII.description,
+                 secondary='HiSPARC II Slave', **kwargs):
+        """Instantiate the class.
+
+        :param replay: :class:`Replay` instance.
+        :param primary,secondary: descriptions of the recorded primary and
+            secondary devices.
+        :param kwargs: see :class:`ReplayDataAcquisition`.
+
+        """
+        self.secondary_description = secondary
+        super(ReplayPrimarySecondaryDataAcquisition, self).__init__(
+            replay, primary, **kwargs)
+
+    def open_hisparc_hardware(self):
+        self.secondary = ReplayHiSPARCII(self.replay,
+                                         self.secondary_description)
+        self.t_last_secondary_msg = time.time()
+        super(ReplayPrimarySecondaryDataAcquisition,
+              self).open_hisparc_hardware()
@@ -0,0 +1,182 @@
+"""Read buffer for framing hardware messages.
+
+Contents
+--------
+
+:class:`RingBuffer`
+    Byte buffer with read and write cursors.
+
+"""
+
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Initial capacity of the buffer, enough for a single full USB read
+DEFAULT_CAPACITY = 64 * 1024
+# Only compact the buffer if at least this many bytes have been consumed
+COMPACT_THRESHOLD = 16 * 1024
+
+
+class RingBuffer(object):
+
+    """Byte buffer with read and write cursors.
+
+    New data is written at the write cursor, messages are consumed at the
+    read cursor.  Consuming a message from the front of the buffer only
+    moves the read cursor; no data is shifted.  The consumed space in
+    front of the read cursor is only reclaimed (compacted) when there is
+    no room left for new data and the consumed space is larger than the
+    compaction threshold.  Otherwise, the storage grows.  When the buffer
+    runs empty, both cursors are simply rewound.
+
+    The buffer mimics the parts of the :class:`bytearray` interface which
+    are used by the message factories, so it can be used as a drop-in
+    replacement.  Indexes are relative to the read cursor.  Only the
+    front of the buffer can be deleted, e.g. ``del buff[:n]``.
+
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY,
+                 compact_threshold=COMPACT_THRESHOLD):
+        """Instantiate the class.
+
+        :param capacity: initial size of the underlying storage.  The
+            buffer grows if necessary.
+        :param compact_threshold: minimum number of consumed bytes before
+            the buffer is compacted to make room for new data.
+
+        """
+        self._data = bytearray(capacity)
+        self._read = 0
+        self._write = 0
+        self.compact_threshold = compact_threshold
+        self.n_compactions = 0
+
+    @property
+    def capacity(self):
+        """Size of the underlying storage."""
+
+        return len(self._data)
+
+    def __len__(self):
+        return self._write - self._read
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step is None and key.start is None and key.stop >= 0:
+                # fast path for buff[:n], used when parsing messages
+                stop = min(self._read + key.stop, self._write)
+                return self._data[self._read:stop]
+            start, stop, step = key.indices(len(self))
+            if step != 1:
+                raise ValueError("Slice step not supported")
+            stop = max(start, stop)
+            return self._data[self._read + start:self._read + stop]
+        else:
+            if key < 0:
+                key += len(self)
+            idx = self._read + key
+            if not self._read <= idx < self._write:
+                raise IndexError("RingBuffer index out of range")
+            return self._data[idx]
+
+    def __delitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(len(self))
+            if start != 0 or step != 1:
+                raise ValueError("Only the front of the buffer can be "
+                                 "deleted")
+            self.consume(stop)
+        elif key in (0, -len(self)) and len(self):
+            self.consume(1)
+        else:
+            raise ValueError("Only the front of the buffer can be deleted")
+
+    def __str__(self):
+        return str(self._data[self._read:self._write])
+
+    def __repr__(self):
+        return 'RingBuffer(%d bytes)' % len(self)
+
+    def tobytes(self, length=None):
+        """Return an immutable copy of the first length bytes.
+
+        The data is copied only once.
+
+        :param length: number of bytes to copy.  If None, or if the buffer
+            is shorter, the entire buffer is copied.
+
+        """
+        stop = self._write
+        if length is not None:
+            stop = min(self._read + length, stop)
+        return memoryview(self._data)[self._read:stop].tobytes()
+
+    def consume(self, n):
+        """Advance the read cursor by n bytes.
+
+        :param n: number of bytes to discard from the front of the buffer.
+
+        """
+        n = max(0, min(n, len(self)))
+        self._read += n
+        if self._read == self._write:
+            # empty, rewinding both cursors is free
+            self._read = self._write = 0
+
+    def extend(self, data):
+        """Write data at the write cursor.
+
+        :param data: string or bytearray with the new data.
+
+        """
+        length = len(data)
+        if self._write + length > len(self._data):
+            self._make_room(length)
+        self._data[self._write:self._write + length] = data
+        self._write += length
+
+    def _make_room(self, length):
+        """Compact and/or grow the storage to fit length more bytes."""
+
+        if self._read >= self.compact_threshold:
+            size = len(self)
+            self._data[:size] = self._data[self._read:self._write]
+            self._read, self._write = 0, size
+            self.n_compactions += 1
+            logger.debug("Compacted buffer, %d bytes remaining", len(self))
+
+        required = self._write + length
+        if required > len(self._data):
+            capacity = len(self._data) or 1
+            while capacity < required:
+                capacity *= 2
+            self._data.extend(bytearray(capacity - len(self._data)))
+
+    def index(self, sub, start=0, end=None):
+        """Return lowest index of sub, relative to the read cursor.
+
+        Raises :class:`ValueError` if sub is not found.
+
+        """
+        idx = self.find(sub, start, end)
+        if idx == -1:
+            raise ValueError("substring not found")
+        return idx
+
+    def find(self, sub, start=0, end=None):
+        """Return lowest index of sub, relative to the read cursor, or -1."""
+
+        start, end, _ = slice(start, end).indices(len(self))
+        idx = self._data.find(sub, self._read + start, self._read + end)
+        if idx == -1:
+            return -1
+        return idx - self._read
+
+    def startswith(self, prefix):
+        """Return True if the buffer starts with prefix."""
+
+        return self[:len(prefix)] == prefix
@@ -34,6 +34,7 @@ import re
 import threading
 import time
 
+import numpy as np
 import tables
 import requests
 from requests.exceptions import HTTPError, ConnectionError, Timeout
@@ -378,6 +379,41 @@ class TablesDataStore(BaseDataStore):
             row.append()
             events.flush()
 
+    def store_batch(self, batch, table='events'):
+        """Store a batch of events in the datastore.
+
+        All rows are appended to the event table at once.  The rows and
+        compressed traces are identical to those of storing each event
+        with :meth:`store_event`.
+
+        :param batch: a :class:`pysparc.events.EventBatch` instance.
+        :param table: the name of the event table.
+
+        """
+        events = self.data.get_node(self.group, table)
+        rows = np.zeros(len(batch), dtype=events.dtype)
+        rows['event_id'] = np.arange(len(events), len(events) + len(batch))
+        rows['timestamp'] = batch.timestamp
+        rows['nanoseconds'] = batch.nanoseconds
+        rows['ext_timestamp'] = batch.ext_timestamp
+        rows['data_reduction'] = batch.data_reduction
+        rows['trigger_pattern'] = batch.trigger_pattern
+        rows['baseline'] = batch.baselines
+        rows['std_dev'] = batch.std_dev
+        rows['n_peaks'] = batch.n_peaks
+        rows['pulseheights'] = batch.pulseheights
+        rows['integrals'] = batch.integrals
+        rows['event_rate'] = batch.event_rate
+
+        trace_idxs = -np.ones((len(batch), 4), dtype=np.int32)
+        for idx, channel in zip(*np.nonzero(batch.trace_lengths >= 0)):
+            trace_idxs[idx, channel] = len(self.blobs)
+            self.blobs.append(batch.zlib_traces[idx, channel])
+        rows['traces'] = trace_idxs
+
+        events.append(rows)
+        events.flush()
+
     def _get_new_sequential_group(self):
         """Create a new group name, sequentially numbered.
 
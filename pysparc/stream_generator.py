@@ -0,0 +1,499 @@
+"""Generate synthetic HiSPARC data streams.
+
+Synthesise byte-exact measured data, one-second and control parameter
+list messages, as sent by the HiSPARC II / III hardware.  The generated
+streams can be fed to the message factory, the stew and storage to test
+and stress the data acquisition without hardware.
+
+The timing information in the messages is consistent with the way the
+:class:`pysparc.events.Stew` reconstructs the trigger times.  Each
+one-second message contains the number of clock ticks in the previous
+second and the GPS quantization error of the PPS.  The trigger times of
+the events are converted to clock ticks since the last PPS using the
+clock ticks and quantization errors of the following one-second messages.
+
+Contents
+--------
+
+:func:`pack_traces`
+    Pack traces into 12-bit sequences.
+
+:func:`pulse_template`
+    Return a normalized pulse shape.
+
+:func:`encode_one_second_message`
+    Encode a one-second message.
+
+:func:`encode_measured_data_message`
+    Encode a measured data (event) message.
+
+:func:`encode_control_parameter_list`
+    Encode a control parameter list message.
+
+:class:`StreamGenerator`
+    Generate a synthetic data stream of a single device.
+
+:class:`FakeEvent`
+    Event with only the attributes needed for mixing.
+
+"""
+
+from __future__ import division
+
+import struct
+import time
+from math import pi
+
+import numpy as np
+
+from messages import (OneSecondMessage, MeasuredDataMessage,
+                      ControlParameterList, NANOSECONDS_PER_SECOND)
+
+
+START_CODON = OneSecondMessage.codons['start']
+STOP_CODON = OneSecondMessage.codons['stop']
+
+# Clock frequency of the HiSPARC hardware, in ticks per second
+CLOCK_FREQUENCY = 200000000
+# Sample time of the interleaved ADCs, in ns
+SAMPLE_TIME = 2.5
+SYNCHRONIZATION_BIT = 1 << 31
+MAX_ADC_VALUE = (1 << 12) - 1
+
+DEFAULT_TRIGGER_RATE = 1000.
+# pre, coincidence and post times in units of 5 ns (1 us, 2 us and 2 us)
+DEFAULT_PRE_COINCIDENCE_TIME = 200
+DEFAULT_COINCIDENCE_TIME = 400
+DEFAULT_POST_COINCIDENCE_TIME = 400
+# Trimble GPS PPS quantization errors are within this many ns
+QUANTIZATION_ERROR = 20.
+# Number of noise samples from which the trace noise is drawn
+NOISE_TABLE_SIZE = 1 << 20
+# Timestamp of 2015-02-01 03:04:05 UTC
+DEFAULT_START_TIMESTAMP = 1422759845
+
+CONTROL_PARAMETER_DEFAULTS = {
+    'ch1_offset_positive': 128, 'ch1_offset_negative': 128,
+    'ch2_offset_positive': 128, 'ch2_offset_negative': 128,
+    'ch1_gain_positive': 128, 'ch1_gain_negative': 128,
+    'ch2_gain_positive': 128, 'ch2_gain_negative': 128,
+    'common_offset': 0, 'full_scale': 0,
+    'ch1_integrator_time': 0, 'ch2_integrator_time': 0,
+    'comparator_low': 0, 'comparator_high': 0,
+    'ch1_voltage': 0, 'ch2_voltage': 0,
+    'ch1_threshold_low': 250, 'ch1_threshold_high': 320,
+    'ch2_threshold_low': 250, 'ch2_threshold_high': 320,
+    'trigger_condition': 2,
+    'pre_coincidence_time': DEFAULT_PRE_COINCIDENCE_TIME,
+    'coincidence_time': DEFAULT_COINCIDENCE_TIME,
+    'post_coincidence_time': DEFAULT_POST_COINCIDENCE_TIME,
+    'status': 0, 'ch1_current': 0, 'ch2_current': 0,
+    'gps_longitude': 4.95, 'gps_latitude': 52.36, 'gps_altitude': 56.,
+    'temperature': 20., 'firmware_version': 0, 'serial_number': 0,
+}
+
+_one_second_struct = OneSecondMessage.msg_struct
+_measured_data_struct = MeasuredDataMessage.msg_struct
+_control_parameter_struct = struct.Struct(ControlParameterList.msg_format)
+
+
+def pack_traces(traces):
+    """Pack traces into 12-bit sequences, as sent by the hardware.
+
+    This is the inverse of :func:`pysparc.messages.unpack_raw_traces`.
+    Every two 12-bit samples are packed into three bytes.
+
+    :param traces: array of ADC values with the samples along the last
+        axis, which must have even length.  Values must be in the range
+        0 - 4095.
+    :returns: uint8 array with the same shape, except that the last axis
+        is 3/2 times as long.
+
+    """
+    traces = np.asarray(traces)
+    if traces.shape[-1] % 2:
+        raise ValueError("Traces must have an even number of samples")
+    if traces.size and (traces.min() < 0 or traces.max() > MAX_ADC_VALUE):
+        raise ValueError("Trace values must be 12-bit")
+
+    a1 = traces[..., ::2].astype(np.uint16)
+    a2 = traces[..., 1::2].astype(np.uint16)
+    packed = np.empty(traces.shape[:-1] + (3 * a1.shape[-1],),
+                      dtype=np.uint8)
+    packed[..., ::3] = a1 >> 4
+    packed[..., 1::3] = ((a1 & 0xf) << 4) | (a2 >> 8)
+    packed[..., 2::3] = a2 & 0xff
+    return packed
+
+
+def pulse_template(rise_time=4., decay_time=25., sample_time=SAMPLE_TIME):
+    """Return a normalized pulse shape.
+
+    The pulse is the difference of two exponentials, with a maximum of 1.
+    It is truncated when it decays below 0.1% of its maximum.
+
+    :param rise_time,decay_time: time constants of the pulse, in ns.
+    :param sample_time: time between samples, in ns.
+
+    """
+    if not 0 < rise_time < decay_time:
+        raise ValueError("Rise time must be positive and shorter than the "
+                         "decay time")
+    length = int(np.ceil(8 * decay_time / sample_time))
+    t = np.arange(length) * sample_time
+    pulse = np.exp(-t / decay_time) - np.exp(-t / rise_time)
+    pulse /= pulse.max()
+    return pulse[:np.flatnonzero(pulse >= 1e-3)[-1] + 1]
+
+
+def _gps_date_time(timestamp):
+    """Return (day, month, year, hours, minutes, seconds) of timestamp."""
+
+    t = time.gmtime(timestamp)
+    return (t.tm_mday, t.tm_mon, t.tm_year, t.tm_hour, t.tm_min, t.tm_sec)
+
+
+def encode_one_second_message(timestamp, count_ticks_PPS=CLOCK_FREQUENCY,
+                              quantization_error=0., counts=(0, 0, 0, 0),
+                              satellite_info='', synchronization_error=False):
+    """Encode a one-second message.
+
+    :param timestamp: GPS timestamp of the PPS.
+    :param count_ticks_PPS: number of clock ticks in the previous second.
+    :param quantization_error: GPS quantization error of the PPS, in ns.
+    :param counts: number of low and high signals in channels 1 and 2,
+        as (ch1_low, ch1_high, ch2_low, ch2_high).
+    :param satellite_info: satellite information, up to 61 bytes.
+    :param synchronization_error: if True, set the synchronization bit.
+    :returns: string containing the message.
+
+    """
+    if synchronization_error:
+        count_ticks_PPS |= SYNCHRONIZATION_BIT
+    ch1_low, ch1_high, ch2_low, ch2_high = counts
+    day, month, year, hours, minutes, seconds = _gps_date_time(timestamp)
+    return _one_second_struct.pack(
+        START_CODON, OneSecondMessage.identifier, day, month, year, hours,
+        minutes, seconds, count_ticks_PPS, quantization_error, ch2_high,
+        ch2_low, ch1_high, ch1_low, satellite_info, STOP_CODON)
+
+
+def encode_measured_data_message(timestamp, count_ticks_PPS, traces,
+                                 pre_coincidence_time,
+                                 coincidence_time, post_coincidence_time,
+                                 trigger_condition=2, trigger_pattern=0):
+    """Encode a measured data (event) message.
+
+    :param timestamp: GPS timestamp of the second of the trigger.
+    :param count_ticks_PPS: number of clock ticks since the PPS.
+    :param traces: packed traces of both channels, as returned by
+        :func:`pack_traces`, with shape (2, 3 * event length).
+    :param pre_coincidence_time,coincidence_time,post_coincidence_time:
+        length of the trace windows, in units of 5 ns.
+    :returns: string containing the message.
+
+    """
+    event_length = (pre_coincidence_time + coincidence_time +
+                    post_coincidence_time)
+    traces = np.asarray(traces, dtype=np.uint8)
+    if traces.shape != (2, 3 * event_length):
+        raise ValueError("Traces do not match the coincidence windows")
+    day, month, year, hours, minutes, seconds = _gps_date_time(timestamp)
+    header = _measured_data_struct.pack(
+        START_CODON, MeasuredDataMessage.identifier, trigger_condition,
+        trigger_pattern, pre_coincidence_time, coincidence_time,
+        post_coincidence_time, day, month, year, hours, minutes, seconds,
+        count_ticks_PPS)
+    return header + traces.tostring() + chr(STOP_CODON)
+
+
+def encode_control_parameter_list(timestamp, **parameters):
+    """Encode a control parameter list message.
+
+    :param timestamp: GPS timestamp of the message.
+    :param parameters: values of the parameters, see
+        :data:`CONTROL_PARAMETER_DEFAULTS`.  GPS longitude and latitude
+        are in degrees.
+    :returns: string containing the message.
+
+    """
+    unknown = set(parameters) - set(CONTROL_PARAMETER_DEFAULTS)
+    if unknown:
+        raise TypeError("Unknown control parameters: %s" %
+                        ', '.join(sorted(unknown)))
+    p = dict(CONTROL_PARAMETER_DEFAULTS, **parameters)
+    version = struct.pack('>L', p['firmware_version'] << 16 |
+                          p['serial_number'])[1:]
+    day, month, year, hours, minutes, seconds = _gps_date_time(timestamp)
+    return _control_parameter_struct.pack(
+        START_CODON, ControlParameterList.identifier,
+        p['ch1_offset_positive'], p['ch1_offset_negative'],
+        p['ch2_offset_positive'], p['ch2_offset_negative'],
+        p['ch1_gain_positive'], p['ch1_gain_negative'],
+        p['ch2_gain_positive'], p['ch2_gain_negative'],
+        p['common_offset'], p['full_scale'],
+        p['ch1_integrator_time'], p['ch2_integrator_time'],
+        p['comparator_low'], p['comparator_high'],
+        p['ch1_voltage'], p['ch2_voltage'],
+        p['ch1_threshold_low'], p['ch1_threshold_high'],
+        p['ch2_threshold_low'], p['ch2_threshold_high'],
+        p['trigger_condition'], p['pre_coincidence_time'],
+        p['coincidence_time'], p['post_coincidence_time'], p['status'],
+        p['ch1_current'], p['ch2_current'],
+        day, month, year, hours, minutes, seconds,
+        p['gps_longitude'] * 2 * pi / 360, p['gps_latitude'] * 2 * pi / 360,
+        p['gps_altitude'], p['temperature'], version, STOP_CODON)
+
+
+class StreamGenerator(object):
+
+    """Generate a synthetic data stream of a single device.
+
+    Every second of data consists of a one-second message, followed by
+    the event messages of that second.  The trigger times are Poisson
+    distributed.  Each event has a pulse at the trigger position in both
+    channels, on top of a noisy baseline.
+
+    To simulate a primary and secondary device, use two generators with
+    the same trigger times.  For example::
+
+        >>> primary, secondary = StreamGenerator(), StreamGenerator()
+        >>> times = primary.trigger_times()
+        >>> data = primary.encode_second(times)
+        >>> data2 = secondary.encode_second(times + 10)
+
+    The true trigger times of the most recently generated second are
+    available as :attr:`last_trigger_times`, in ns since the PPS.
+
+    """
+
+    def __init__(self, trigger_rate=DEFAULT_TRIGGER_RATE,
+                 pre_coincidence_time=DEFAULT_PRE_COINCIDENCE_TIME,
+                 coincidence_time=DEFAULT_COINCIDENCE_TIME,
+                 post_coincidence_time=DEFAULT_POST_COINCIDENCE_TIME,
+                 start_timestamp=DEFAULT_START_TIMESTAMP, baseline=200,
+                 noise=2., pulse_height=200., pulse_shape=None,
+                 quantization_error=QUANTIZATION_ERROR, clock_drift=0.,
+                 synchronization_error_rate=0., corruption_rate=0.,
+                 seed=None):
+        """Instantiate the class.
+
+        :param trigger_rate: mean trigger rate, in Hz.
+        :param pre_coincidence_time,coincidence_time,post_coincidence_time:
+            length of the trace windows, in units of 5 ns.
+        :param start_timestamp: GPS timestamp of the first second.
+        :param baseline: baseline of the traces, in ADC counts.
+        :param noise: standard deviation of the baseline noise.
+        :param pulse_height: mean pulse height, in ADC counts.  Pulse
+            heights are exponentially distributed.
+        :param pulse_shape: normalized pulse shape, see
+            :func:`pulse_template`.
+        :param quantization_error: maximum GPS quantization error, in ns.
+        :param clock_drift: relative deviation of the clock frequency.
+        :param synchronization_error_rate: fraction of one-second messages
+            with the synchronization bit set.
+        :param corruption_rate: fraction of messages which are corrupted
+            by truncation, garbage or a flipped byte.
+        :param seed: seed for the random number generator.
+
+        """
+        self.trigger_rate = trigger_rate
+        self.pre_coincidence_time = pre_coincidence_time
+        self.coincidence_time = coincidence_time
+        self.post_coincidence_time = post_coincidence_time
+        self.timestamp = start_timestamp
+        self.baseline = baseline
+        self.noise = noise
+        self.pulse_height = pulse_height
+        if pulse_shape is None:
+            pulse_shape = pulse_template()
+        self.pulse_shape = pulse_shape
+        self.quantization_error = quantization_error
+        self.clock_drift = clock_drift
+        self.synchronization_error_rate = synchronization_error_rate
+        self.corruption_rate = corruption_rate
+        self.random = np.random.RandomState(seed)
+
+        # clock ticks, quantization error and sync error per one-second msg
+        self._pps = {}
+        self._noise_table = None
+        self.last_trigger_times = np.array([])
+
+        self.n_one_second_messages = 0
+        self.n_events = 0
+        self.n_corrupted = 0
+
+    @property
+    def n_samples(self):
+        """Number of samples in a trace."""
+
+        return 2 * (self.pre_coincidence_time + self.coincidence_time +
+                    self.post_coincidence_time)
+
+    def trigger_times(self):
+        """Return random trigger times for one second.
+
+        :returns: sorted array of trigger times, in ns since the PPS.
+
+        """
+        n_events = self.random.poisson(self.trigger_rate)
+        return np.sort(self.random.uniform(0, NANOSECONDS_PER_SECOND,
+                                           n_events))
+
+    def encode_second(self, trigger_times=None):
+        """Encode the messages of the next second.
+
+        :param trigger_times: trigger times in ns since the PPS.  If None,
+            random trigger times are used.
+        :returns: string containing the one-second message, followed by
+            the event messages.
+
+        """
+        if trigger_times is None:
+            trigger_times = self.trigger_times()
+        trigger_times = np.asarray(trigger_times)
+        timestamp = self.timestamp
+
+        count_ticks, quantization_error, sync_error = self._get_pps(timestamp)
+        frames = [encode_one_second_message(
+            timestamp, count_ticks, quantization_error,
+            synchronization_error=sync_error)]
+        self.n_one_second_messages += 1
+
+        ticks = self.count_ticks(timestamp, trigger_times)
+        traces = pack_traces(self.create_traces(len(trigger_times)))
+        for count_ticks_PPS, event_traces in zip(ticks, traces):
+            frames.append(encode_measured_data_message(
+                timestamp, count_ticks_PPS, event_traces,
+                self.pre_coincidence_time, self.coincidence_time,
+                self.post_coincidence_time))
+        self.n_events += len(ticks)
+
+        if self.corruption_rate:
+            frames = [self._corrupt(frame) for frame in frames]
+
+        self._pps.pop(timestamp - 1, None)
+        self.timestamp += 1
+        self.last_trigger_times = trigger_times
+        return ''.join(frames)
+
+    def generate(self, n_seconds):
+        """Generate n_seconds of data.
+
+        :returns: string containing all messages.
+
+        """
+        return ''.join(self.encode_second() for _ in range(n_seconds))
+
+    def count_ticks(self, timestamp, trigger_times):
+        """Convert trigger times to clock ticks since the PPS.
+
+        This is the inverse of the trigger time reconstruction in
+        :meth:`pysparc.events.Stew.cook_event_msg`.
+
+        :param timestamp: GPS timestamp of the second of the triggers.
+        :param trigger_times: trigger times in ns since the PPS.
+        :returns: integer array of clock ticks.
+
+        """
+        sync_error = 2.5 if self._get_pps(timestamp)[2] else 0.
+        count_ticks, qe1, _ = self._get_pps(timestamp + 1)
+        qe2 = self._get_pps(timestamp + 2)[1]
+        ticks = np.round((trigger_times - sync_error - qe1) * count_ticks /
+                         (NANOSECONDS_PER_SECOND - qe1 + qe2))
+        return ticks.clip(0, count_ticks - 1).astype(np.int64)
+
+    def create_traces(self, n_events):
+        """Create traces with a pulse in both channels.
+
+        Drawing normally distributed noise for every sample is expensive,
+        so the noise is taken from random windows into a table of noise
+        samples, which is created once.
+
+        :returns: integer array of shape (n_events, 2, number of samples).
+
+        """
+        n_samples = self.n_samples
+        noise = self._get_noise_table(n_samples)
+        offsets = self.random.randint(len(noise) - n_samples + 1,
+                                      size=(n_events, 2, 1))
+        traces = noise[offsets + np.arange(n_samples)]
+        traces += self.baseline
+
+        trigger = 2 * self.pre_coincidence_time
+        pulse = self.pulse_shape[:n_samples - trigger]
+        heights = self.random.exponential(self.pulse_height, (n_events, 2))
+        pulses = np.round(heights[..., None] * pulse).astype(np.int32)
+        traces[..., trigger:trigger + len(pulse)] += pulses
+        return traces.clip(0, MAX_ADC_VALUE, out=traces)
+
+    def _get_noise_table(self, n_samples):
+        """Return a table of (integer) noise samples."""
+
+        size = max(NOISE_TABLE_SIZE, 2 * n_samples)
+        if self._noise_table is None or len(self._noise_table) < size:
+            self._noise_table = np.round(self.random.normal(
+                0, self.noise, size)).astype(np.int32)
+        return self._noise_table
+
+    def _get_pps(self, timestamp):
+        """Return clock ticks, quantization error and sync error of a PPS."""
+
+        try:
+            return self._pps[timestamp]
+        except KeyError:
+            count_ticks = int(round(CLOCK_FREQUENCY *
+                                    (1 + self.clock_drift)))
+            quantization_error = self.random.uniform(
+                -self.quantization_error, self.quantization_error)
+            sync_error = (self.random.uniform() <
+                          self.synchronization_error_rate)
+            pps = self._pps[timestamp] = (count_ticks, quantization_error,
+                                          sync_error)
+            return pps
+
+    def _corrupt(self, frame):
+        """Corrupt a frame, with probability corruption_rate."""
+
+        if self.random.uniform() >= self.corruption_rate:
+            return frame
+
+        self.n_corrupted += 1
+        kind = self.random.randint(3)
+        if kind == 0:
+            # truncated message
+            return frame[:self.random.randint(1, len(frame))]
+        elif kind == 1:
+            # garbage in front of the message
+            garbage = self.random.randint(256, size=self.random.randint(
+                1, 64)).astype(np.uint8).tostring()
+            return garbage + frame
+        else:
+            # flipped byte, anywhere in the message
+            idx = self.random.randint(len(frame))
+            return (frame[:idx] + chr(ord(frame[idx]) ^ 0xff) +
+                    frame[idx + 1:])
+
+
+class FakeEvent(object):
+
+    """Event with only the attributes needed for mixing.
+
+    Used to test and benchmark the :class:`pysparc.events.Mixer` without
+    generating and analyzing traces.
+
+    """
+
+    def __init__(self, ext_timestamp):
+        self.ext_timestamp = ext_timestamp
+        self.timestamp = ext_timestamp // int(1e9)
+        self.nanoseconds = ext_timestamp % int(1e9)
+        self.datetime = None
+        self.trigger_pattern = 0
+        self.event_rate = 0.
+        # the trace identifies the secondary event of a four-channel event
+        self.trace_ch1 = self.trace_ch2 = np.array([ext_timestamp])
+        self.raw_traces = np.zeros(6, dtype=np.uint8)
+        self.zlib_trace_ch1 = self.zlib_trace_ch2 = None
+        self.baselines = self.std_dev = self.pulseheights = [0, 0, -1, -1]
+        self.integrals = self.n_peaks = [0, 0, -1, -1]
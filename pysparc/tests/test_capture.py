@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from pysparc import capture
+
+
+class CaptureTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmpdir, 'capture')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_records(self, records, **kwargs):
+        writer = capture.CaptureWriter(self.prefix, **kwargs)
+        for timestamp, description, data in records:
+            writer.write(description, data, timestamp)
+        writer.close()
+        return writer
+
+    def create_records(self, n):
+        return [(1000. + i, 'HiSPARC II Master', 'data%d' % i)
+                for i in range(n)]
+
+    def test_round_trip(self):
+        records = self.create_records(5)
+        writer = self.write_records(records)
+        self.assertEqual(writer.n_records, 5)
+        self.assertEqual(writer.n_bytes, 25)
+        self.assertEqual(list(capture.CaptureReader(self.prefix)), records)
+
+    def test_empty_data_is_not_recorded(self):
+        writer = self.write_records([(1000., 'GPS', '')])
+        self.assertEqual(writer.n_records, 0)
+        self.assertEqual(list(capture.CaptureReader(self.prefix)), [])
+
+    def test_round_trip_compressed(self):
+        records = self.create_records(5)
+        self.write_records(records, compress=True)
+        self.assertTrue(os.path.exists(self.prefix + '.00000.raw.gz'))
+        self.assertEqual(list(capture.CaptureReader(self.prefix)), records)
+
+    def test_compressed_capture_is_complete_after_close(self):
+        records = self.create_records(5)
+        writer = capture.CaptureWriter(self.prefix, compress=True,
+                                       index_interval=3600.)
+        for timestamp, description, data in records:
+            writer.write(description, data, timestamp)
+        # records since the last index entry are buffered, and the gzip
+        # trailer is missing
+        self.assertRaises(IOError, list, capture.CaptureReader(self.prefix))
+        writer.close()
+        self.assertEqual(list(capture.CaptureReader(self.prefix)), records)
+
+    def test_rotation(self):
+        records = self.create_records(10)
+        self.write_records(records, max_file_size=100)
+        files = capture._find_capture_files(self.prefix)
+        self.assertTrue(len(files) > 1)
+        self.assertEqual([number for number, path in files],
+                         range(len(files)))
+        self.assertEqual(list(capture.CaptureReader(self.prefix)), records)
+
+    def test_existing_capture_is_continued(self):
+        records = self.create_records(10)
+        self.write_records(records[:5])
+        self.write_records(records[5:])
+        self.assertEqual(len(capture._find_capture_files(self.prefix)), 2)
+        self.assertEqual(list(capture.CaptureReader(self.prefix)), records)
+
+    def test_index(self):
+        self.write_records(self.create_records(10), max_file_size=100,
+                           index_interval=2.)
+        index = capture.CaptureReader(self.prefix).read_index()
+        # an entry at the start of every file
+        self.assertEqual(index[0], (1000., 0, len(capture.MAGIC)))
+        self.assertEqual(sorted(index), index)
+
+    def test_seek(self):
+        records = self.create_records(10)
+        for kwargs in {}, {'max_file_size': 100}, {'compress': True}:
+            self.tearDown()
+            self.setUp()
+            self.write_records(records, index_interval=3., **kwargs)
+            reader = capture.CaptureReader(self.prefix)
+            reader.seek(1004.)
+            self.assertEqual(list(reader), records[4:])
+            reader.seek(0.)
+            self.assertEqual(list(reader), records)
+
+    def test_reader_raises_if_no_capture(self):
+        self.assertRaises(capture.CaptureError, capture.CaptureReader,
+                          self.prefix)
+
+    def test_reader_stops_at_truncated_record(self):
+        records = self.create_records(3)
+        self.write_records(records)
+        path = self.prefix + '.00000.raw'
+        with open(path, 'rb+') as f:
+            f.truncate(os.path.getsize(path) - 2)
+        self.assertEqual(list(capture.CaptureReader(self.prefix)),
+                         records[:2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import time
+import unittest
+
+from mock import patch, Mock
+
+from pysparc import capture_process, ftdi_chip
+
+
+class SharedRingBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = capture_process.SharedRingBuffer(10)
+
+    def test_write_and_read(self):
+        self.assertTrue(self.ring.write('foo'))
+        self.assertTrue(self.ring.write('bar'))
+        self.assertEqual(len(self.ring), 6)
+        view = self.ring.peek()
+        self.assertIsInstance(view, buffer)
+        self.assertEqual(str(view), 'foobar')
+        self.ring.consume(4)
+        self.assertEqual(str(self.ring.peek()), 'ar')
+
+    def test_peek_max_size(self):
+        self.ring.write('foobar')
+        self.assertEqual(str(self.ring.peek(4)), 'foob')
+
+    def test_wrap_around(self):
+        self.ring.write('12345678')
+        self.ring.consume(8)
+        self.assertTrue(self.ring.write('abcdef'))
+        # only contiguous data is returned
+        self.assertEqual(str(self.ring.peek()), 'ab')
+        self.ring.consume(2)
+        self.assertEqual(str(self.ring.peek()), 'cdef')
+
+    def test_overrun_drops_chunk(self):
+        self.ring.write('12345678')
+        self.assertFalse(self.ring.write('abc'))
+        self.assertEqual(str(self.ring.peek()), '12345678')
+        stats = self.ring.get_stats()
+        self.assertEqual(stats['n_overruns'], 1)
+        self.assertEqual(stats['n_bytes_dropped'], 3)
+        self.assertEqual(stats['n_bytes'], 8)
+        self.assertEqual(stats['high_water_mark'], 8)
+        self.assertEqual(stats['size'], 10)
+
+    def test_discard(self):
+        self.ring.write('foo')
+        self.ring.discard()
+        self.assertEqual(len(self.ring), 0)
+        self.assertEqual(str(self.ring.peek()), '')
+
+
+class SharedMemoryChipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.process = Mock()
+        self.ring = capture_process.SharedRingBuffer(100)
+        self.process.rings = {'foo': self.ring}
+        self.chip = capture_process.SharedMemoryChip(self.process, 'foo')
+
+    def test_read_consumes_on_next_read(self):
+        self.ring.write('bar')
+        self.assertEqual(str(self.chip.read()), 'bar')
+        self.assertEqual(len(self.ring), 3)
+        self.assertEqual(str(self.chip.read()), '')
+        self.assertEqual(len(self.ring), 0)
+
+    def test_read_raises_if_process_stopped(self):
+        self.process.is_alive.return_value = False
+        self.assertRaises(ftdi_chip.ReadError, self.chip.read)
+
+    def test_write_sends_command(self):
+        self.chip.write('baz')
+        self.process.send_command.assert_called_once_with('foo', 'write',
+                                                          'baz')
+
+    def test_flush(self):
+        self.ring.write('bar')
+        self.chip.read()
+        self.chip.flush()
+        self.assertEqual(len(self.ring), 0)
+        self.process.flush.assert_called_once_with('foo')
+
+    def test_set_latency_timer(self):
+        self.chip.set_latency_timer(4)
+        self.process.send_command.assert_called_once_with(
+            'foo', 'latency_timer', 4)
+        self.assertEqual(self.chip.latency_timer, 4)
+
+
+class EchoChip(object):
+
+    """Fake FTDI device, which returns the data written to it."""
+
+    def __init__(self, description, interface_select=0):
+        self.data = 'hello'
+
+    def read(self, read_size=None):
+        data, self.data = self.data, ''
+        return data
+
+    def write(self, data):
+        self.data += data
+
+    def flush(self):
+        self.data = ''
+
+    def close(self):
+        pass
+
+
+class StartCaptureProcessTest(unittest.TestCase):
+
+    def read_until(self, chip, n_bytes, timeout=5.):
+        data = ''
+        t0 = time.time()
+        while len(data) < n_bytes and time.time() - t0 < timeout:
+            data += str(chip.read())
+        return data
+
+    @patch('pysparc.capture_process.FtdiChip', EchoChip)
+    def test_capture_process(self):
+        device = Mock()
+        device.description = 'foo'
+        device._device.interface_select = 2
+        old_chip = device._device
+
+        process = capture_process.start_capture_process([device],
+                                                        ring_size=100)
+        try:
+            old_chip.close.assert_called_once_with()
+            self.assertEqual(process.devices, [('foo', 2)])
+            chip = device._device
+            self.assertIsInstance(chip, capture_process.SharedMemoryChip)
+
+            self.assertEqual(self.read_until(chip, 5), 'hello')
+            chip.write('bar')
+            self.assertEqual(self.read_until(chip, 3), 'bar')
+            chip.flush()
+            self.assertEqual(len(chip.ring), 0)
+            self.assertEqual(process.get_stats()['foo']['n_bytes'], 8)
+        finally:
+            process.stop()
+        self.assertFalse(process.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,93 @@
+import collections
+import datetime
 import unittest
+import zlib
 
-from pysparc import events
+import numpy as np
+from mock import patch
+
+from pysparc import events, messages, stream_generator
+from pysparc.ring_buffer import RingBuffer
+from pysparc.stream_generator import FakeEvent
+
+
+def generate_messages(n_seconds=4, trigger_rate=20, seed=1,
+                      coincidence_time=40):
+    generator = stream_generator.StreamGenerator(
+        trigger_rate=trigger_rate, pre_coincidence_time=20,
+        coincidence_time=coincidence_time, post_coincidence_time=40,
+        seed=seed)
+    buff = RingBuffer()
+    buff.extend(generator.generate(n_seconds))
+    msgs = []
+    while True:
+        msg = messages.HisparcMessageFactory(buff)
+        if msg is None:
+            return msgs
+        msgs.append(msg)
+
+
+def cook(stew, msgs):
+    for msg in msgs:
+        if isinstance(msg, messages.OneSecondMessage):
+            stew.add_one_second_message(msg)
+        else:
+            stew.add_event_message(msg)
+    stew.stir()
+    return stew.serve_events()
+
+
+def event_attributes(event):
+    return (event.ext_timestamp, event.zlib_trace_ch1, event.zlib_trace_ch2,
+            event.baselines, event.std_dev, event.pulseheights,
+            event.integrals, event.n_peaks)
+
+
+def all_event_attributes(event):
+    attributes = dict((key, value) for key, value in vars(event).items()
+                      if not key.startswith('_'))
+    traces = dict((key, attributes.pop(key).tolist())
+                  for key in attributes.keys() if key.startswith('trace_'))
+    return attributes, traces
+
+
+def count_peaks_loop(trace, baseline):
+    """Reference implementation: the original per-sample loop."""
+
+    n_peak = 0
+    in_peak = False
+    local_minimum = 0
+    peak_threshold = events.PEAK_THRESHOLD + baseline
+    for value in trace:
+        if not in_peak:
+            if value < local_minimum:
+                local_minimum = value if value > 0 else 0
+            elif value - local_minimum > peak_threshold:
+                in_peak = True
+                local_maximum = value
+                n_peak += 1
+        else:
+            if value > local_maximum:
+                local_maximum = value
+            elif local_maximum - value > peak_threshold:
+                in_peak = False
+                local_minimum = value if value > 0 else 0
+    return n_peak
+
+
+def mix_brute_force(primary_timestamps, secondary_timestamps):
+    """Reference implementation of the mixer matching."""
+
+    primary_timestamps = sorted(primary_timestamps)
+    pairs = []
+    for timestamp in sorted(secondary_timestamps):
+        candidates = [(abs(u - timestamp), u) for u in primary_timestamps]
+        if candidates:
+            delta_t, nearest = min(candidates)
+            if delta_t < events.MAX_FOUR_CHANNEL_DELAY:
+                pairs.append((nearest, timestamp))
+                primary_timestamps.remove(nearest)
+    return pairs
 
 
 class TestMixer(unittest.TestCase):
@@ -13,6 +100,560 @@ class TestMixer(unittest.TestCase):
 
         self.mixer.mix()
 
+    def mix(self, primary_timestamps, secondary_timestamps):
+        self.mixer.add_primary_events(
+            [FakeEvent(t) for t in primary_timestamps])
+        self.mixer.add_secondary_events(
+            [FakeEvent(t) for t in secondary_timestamps])
+        self.mixer.mix()
+        return [(event.ext_timestamp, event.trace_ch3[0])
+                for event in self.mixer.serve_events()]
+
+    def test_mix_nearest_events(self):
+        self.assertEqual(self.mix([1000, 20000, 30000, 60000],
+                                  [21000, 29500, 45000]),
+                         [(20000, 21000), (30000, 29500)])
+        self.assertEqual(sorted(self.mixer._primary_events), [1000, 60000])
+        self.assertEqual(sorted(self.mixer._secondary_events), [45000])
+
+    def test_mix_equally_near_events(self):
+        self.assertEqual(self.mix([1000, 3000], [2000]), [(1000, 2000)])
+
+    def test_primary_events_are_mixed_once(self):
+        self.assertEqual(self.mix([10000], [9000, 10500]), [(10000, 9000)])
+        self.assertEqual(sorted(self.mixer._secondary_events), [10500])
+
+    def test_drain_unmatched_events(self):
+        second = int(1e9)
+        self.mix([1000, 5 * second], [2 * second, 3 * second])
+        self.mixer.add_primary_events([FakeEvent(13 * second)])
+        self.mixer.drain()
+        self.assertEqual(sorted(self.mixer._primary_events),
+                         [5 * second, 13 * second])
+        self.assertEqual(sorted(self.mixer._secondary_events), [3 * second])
+        self.assertEqual(self.mixer.serve_events(), [])
+        stats = self.mixer.get_stats()
+        self.assertEqual(stats['n_primary'], 2)
+        self.assertEqual(stats['n_secondary'], 1)
+        self.assertEqual(stats['n_dropped_primary'], 1)
+        self.assertEqual(stats['n_dropped_secondary'], 1)
+        self.assertEqual(stats['n_stored_primary'], 0)
+
+    def test_store_unmatched_primary_events(self):
+        self.mixer = events.Mixer(horizon=1, store_unmatched=True)
+        self.mix([1000], [10000])
+        self.mixer.add_secondary_events([FakeEvent(int(2e9))])
+        self.mixer.add_primary_events([FakeEvent(int(1e9))])
+        self.mixer.drain()
+        served = self.mixer.serve_events()
+        self.assertEqual([event.ext_timestamp for event in served], [1000])
+        self.assertIsInstance(served[0], FakeEvent)
+        stats = self.mixer.get_stats()
+        self.assertEqual(stats['n_stored_primary'], 1)
+        self.assertEqual(stats['n_dropped_secondary'], 1)
+        self.assertEqual(stats['n_primary'], 1)
+        self.assertEqual(stats['n_secondary'], 1)
+
+    def test_drain_skips_mixed_events(self):
+        self.mix([1000], [1500])
+        self.mixer.add_primary_events([FakeEvent(int(20e9))])
+        self.mixer.drain()
+        stats = self.mixer.get_stats()
+        self.assertEqual(stats['n_mixed'], 1)
+        self.assertEqual(stats['n_dropped_primary'], 0)
+        self.assertEqual(stats['n_dropped_secondary'], 0)
+        self.assertEqual(self.mixer._primary_heap, [int(20e9)])
+
+    def test_memory_use(self):
+        cooked = cook(events.Stew(), generate_messages())
+        size = events._event_size(cooked[0])
+        self.assertTrue(size > cooked[0].raw_traces.nbytes)
+        self.mixer.add_primary_events(cooked[:1])
+        # a replaced event is counted once
+        self.mixer.add_primary_events(cooked[:1])
+        self.mixer.add_secondary_events(cooked[1:2])
+        self.assertEqual(self.mixer.get_stats()['n_bytes'],
+                         size + events._event_size(cooked[1]))
+        self.mixer.mix()
+        self.mixer.add_primary_events(cooked[2:3])
+        self.mixer.drain()
+        later_event = FakeEvent(cooked[2].ext_timestamp + int(60e9))
+        self.mixer.add_primary_events([later_event])
+        self.mixer.drain()
+        self.assertEqual(self.mixer.get_stats()['n_bytes'],
+                         events._event_size(later_event))
+
+    def test_matches_brute_force(self):
+        random = np.random.RandomState(1)
+        for i in range(50):
+            primary = set(random.randint(0, 100000, random.randint(0, 40)))
+            secondary = set(random.randint(0, 100000, random.randint(0, 40)))
+            self.mixer = events.Mixer()
+            self.assertEqual(self.mix(primary, secondary),
+                             mix_brute_force(primary, secondary))
+
+
+class EventTest(unittest.TestCase):
+
+    def setUp(self):
+        self.msg = generate_messages(n_seconds=1)[1]
+
+    def test_analysis(self):
+        event = events.Event(self.msg)
+        trace = self.msg.trace_ch1
+        self.assertEqual(event.baselines[0], int(round(trace[:100].mean())))
+        self.assertEqual(event.baselines[2:], [-1, -1])
+        self.assertEqual(event.pulseheights[0],
+                         trace.max() - event.baselines[0])
+        self.assertEqual(event.n_peaks[2:], [-1, -1])
+        self.assertEqual(event.zlib_trace_ch1.decode('zlib'),
+                         ','.join(str(u) for u in trace))
+
+    def test_analysis_of_raw_traces(self):
+        payload = (self.msg.raw_traces.tostring(), self.msg.trace_length)
+        analysis = events._analyze_raw_traces(payload)
+        self.assertEqual(analysis,
+                         events.analyze_traces(self.msg.trace_ch1,
+                                               self.msg.trace_ch2))
+
+    def test_event_with_analysis(self):
+        analysis = ('foo', 'bar', [1, 2, -1, -1], [3, 4, -1, -1],
+                    [5, 6, -1, -1], [7, 8, -1, -1], [1, 0, -1, -1])
+        event = events.Event(self.msg, analysis=analysis)
+        self.assertEqual(event.zlib_trace_ch1, 'foo')
+        self.assertEqual(event.n_peaks, [1, 0, -1, -1])
+
+    def test_traces_are_not_unpacked_with_analysis(self):
+        payload = (self.msg.raw_traces.tostring(), self.msg.trace_length)
+        event = events.Event(self.msg,
+                             analysis=events._analyze_raw_traces(payload))
+        mixed = events.FourChannelEvent(event, event)
+        events._event_size(event)
+        self.assertNotIn('traces', vars(self.msg))
+
+        traces = messages.unpack_raw_traces(
+            self.msg.raw_traces.reshape(2, self.msg.trace_length))
+        np.testing.assert_array_equal(event.trace_ch2, traces[1])
+        np.testing.assert_array_equal(mixed.trace_ch3, traces[0])
+
+    def test_datetime_is_lazy(self):
+        event = events.Event(self.msg)
+        mixed = events.FourChannelEvent(event, event)
+        self.assertNotIn('datetime', vars(self.msg))
+        self.assertNotIn('datetime', vars(event))
+        expected = datetime.datetime.utcfromtimestamp(self.msg.timestamp)
+        self.assertEqual(event.datetime, expected)
+        self.assertEqual(mixed.datetime, expected)
+
+
+class CalculateNPeaksTest(unittest.TestCase):
+
+    def assert_equivalent(self, traces, baselines):
+        expected = [count_peaks_loop(trace, baseline)
+                    for trace, baseline in zip(traces, baselines)]
+        actual = events._calculate_n_peaks(traces, baselines)
+        self.assertEqual(actual, expected)
+        return actual
+
+    def test_known_peaks(self):
+        trace = [0, 100, 0, 100, 0, 10, 0]
+        self.assertEqual(self.assert_equivalent([trace], [0]), [2])
+        self.assertEqual(self.assert_equivalent([trace], [-45]), [3])
+        self.assertEqual(self.assert_equivalent([trace], [100]), [0])
+
+    def test_local_minimum_is_clamped(self):
+        # the rise from -100 to 40 exceeds the threshold, but the local
+        # minimum is clamped to 0
+        trace = [-100, 40, -100, 60]
+        self.assertEqual(self.assert_equivalent([trace], [0]), [1])
+
+    def test_empty_trace(self):
+        self.assert_equivalent([[]], [0])
+
+    def test_batch_of_traces(self):
+        traces = np.random.randint(0, 400, size=(6, 500)).astype(np.int16)
+        baselines = [0, 50, 100, 150, 200, 250]
+        self.assert_equivalent(traces, baselines)
+
+    def test_equivalent_to_loop_on_random_traces(self):
+        # property-based test: many random traces with random pulses,
+        # lengths and thresholds, including negative values and
+        # negative thresholds
+        random = np.random.RandomState(42)
+        for i in range(300):
+            length = random.randint(0, 3000)
+            baseline = random.randint(-80, 300)
+            noise = random.choice([1, 10, 100])
+            trace = baseline + random.normal(0, noise, length)
+            for pos in random.randint(0, max(length, 1),
+                                      size=random.randint(0, 20)):
+                trace[pos:pos + 50] += random.exponential(300)
+            trace = np.round(trace).astype(np.int16)
+            self.assert_equivalent([trace], [baseline])
+
+    def test_generated_events(self):
+        msgs = [msg for msg in generate_messages()
+                if isinstance(msg, messages.MeasuredDataMessage)]
+        for msg in msgs:
+            baselines = [int(round(t[:100].mean())) for t in msg.traces]
+            self.assert_equivalent(msg.traces, baselines)
+
+
+class SerializeTraceTest(unittest.TestCase):
+
+    def assert_serialized(self, trace):
+        expected = ','.join([str(int(u)) for u in trace])
+        self.assertEqual(events.serialize_trace(trace), expected)
+
+    def test_all_sample_values(self):
+        self.assert_serialized(np.arange(events.N_SAMPLE_VALUES,
+                                         dtype=np.int16))
+
+    def test_random_traces(self):
+        random = np.random.RandomState(1)
+        for length in 0, 1, 2, 100, 6800:
+            trace = random.randint(0, events.N_SAMPLE_VALUES, length)
+            self.assert_serialized(trace.astype(np.int16))
+
+    def test_values_outside_sample_range(self):
+        self.assert_serialized(np.array([-1, 0, 4095, 4096, 100000]))
+        self.assert_serialized([1, 22, 333])
+
+    def test_compress_trace(self):
+        trace = np.random.randint(0, 400, 1000).astype(np.int16)
+        expected = zlib.compress(','.join([str(int(u)) for u in trace]))
+        self.assertEqual(events.compress_trace(trace), expected)
+        compressor = zlib.compressobj()
+        for i in range(2):
+            self.assertEqual(events.compress_trace(trace, compressor),
+                             expected)
+
+
+class EventRateCounterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.counter = events.EventRateCounter(windows=(1, 3), size=5)
+
+    def test_size_must_exceed_windows(self):
+        self.assertRaises(ValueError, events.EventRateCounter, (1, 10), 10)
+        counter = events.EventRateCounter((1, 10))
+        self.assertEqual(counter.size, 11)
+
+    def test_current_second_is_not_counted(self):
+        self.counter.increment(100, 2)
+        self.assertEqual(self.counter.current_second, 100)
+        self.assertEqual(self.counter.count(1), 0)
+        self.counter.advance(101)
+        self.assertEqual(self.counter.count(1), 2)
+        self.assertEqual(self.counter.rate(3), 2 / 3.)
+
+    def test_windows(self):
+        for second, n in (100, 1), (101, 2), (102, 4), (103, 8):
+            self.counter.increment(second, n)
+        self.counter.advance(104)
+        self.assertEqual(self.counter.count(1), 8)
+        self.assertEqual(self.counter.count(3), 14)
+        self.counter.advance(106)
+        self.assertEqual(self.counter.count(1), 0)
+        self.assertEqual(self.counter.count(3), 8)
+        self.assertEqual(self.counter.get_rates(), {1: 0., 3: 8 / 3.})
+
+    def test_late_events(self):
+        self.counter.advance(100)
+        self.counter.increment(99)
+        self.counter.increment(97)
+        # too old for the ring buffer
+        self.counter.increment(95)
+        self.assertEqual(self.counter.count(1), 1)
+        self.assertEqual(self.counter.count(3), 2)
+        seconds, counts = self.counter.get_counts()
+        self.assertEqual(seconds.tolist(), [97, 98, 99])
+        self.assertEqual(counts.tolist(), [1, 0, 1])
+
+    def test_large_jump_resets_counts(self):
+        self.counter.increment(100, 5)
+        self.counter.increment(200)
+        self.counter.advance(201)
+        self.assertEqual(self.counter.count(3), 1)
+        self.assertEqual(self.counter.get_counts(4)[1].tolist(),
+                         [0, 0, 0, 1])
+
+    def test_matches_sum_over_windows(self):
+        counter = events.EventRateCounter()
+        random = np.random.RandomState(1)
+        counts = collections.defaultdict(int)
+        second = 1000
+        for i in range(2000):
+            second += random.choice([0, 0, 0, 1, 1, 2, 30])
+            counter.advance(second)
+            timestamp = second - random.randint(0, 3)
+            counter.increment(timestamp)
+            if second - timestamp < counter.size:
+                counts[timestamp] += 1
+            if i % 50 == 0:
+                for window in counter.windows:
+                    expected = sum(n for t, n in counts.items()
+                                   if second - window <= t < second)
+                    self.assertEqual(counter.count(window), expected)
+
+    def test_get_counts_empty(self):
+        seconds, counts = self.counter.get_counts()
+        self.assertEqual(len(seconds), 0)
+        self.assertEqual(len(counts), 0)
+
+
+class StewTest(unittest.TestCase):
+
+    def test_events_are_served_in_trigger_order(self):
+        served = cook(events.Stew(), generate_messages())
+        self.assertTrue(len(served) > 10)
+        timestamps = [event.ext_timestamp for event in served]
+        self.assertEqual(timestamps, sorted(timestamps))
+
+    def split_messages(self, n_seconds=6):
+        one_second_msgs = []
+        event_msgs = collections.defaultdict(list)
+        for msg in generate_messages(n_seconds):
+            if isinstance(msg, messages.OneSecondMessage):
+                one_second_msgs.append(msg)
+            else:
+                event_msgs[msg.timestamp].append(msg)
+        return one_second_msgs, event_msgs
+
+    def test_seconds_are_cooked_when_complete(self):
+        stew = events.Stew()
+        one_second_msgs, event_msgs = self.split_messages()
+        t0 = one_second_msgs[0].timestamp
+        for msg in one_second_msgs:
+            stew.add_one_second_message(msg)
+            for event_msg in event_msgs[msg.timestamp]:
+                stew.add_event_message(event_msg)
+            stew.stir()
+            served = stew.serve_events()
+            if msg.timestamp < t0 + 2:
+                self.assertEqual(served, [])
+            else:
+                self.assertEqual([event._msg for event in served],
+                                 event_msgs[msg.timestamp - 2])
+
+    def test_datetime_follows_corrected_timestamp(self):
+        msgs = generate_messages()
+        for msg in msgs:
+            # evaluate the datetime before the trigger time is corrected
+            msg.datetime
+        for event in cook(events.Stew(), msgs):
+            self.assertEqual(
+                event._msg.datetime,
+                datetime.datetime.utcfromtimestamp(event.timestamp))
+
+    def test_stir_only_cooks_complete_seconds(self):
+        stew = events.Stew()
+        one_second_msgs, event_msgs = self.split_messages()
+        for msg in one_second_msgs[:3]:
+            stew.add_one_second_message(msg)
+        for msgs in event_msgs.values():
+            for msg in msgs:
+                stew.add_event_message(msg)
+        with patch.object(stew, '_correct_trigger_time',
+                          wraps=stew._correct_trigger_time) as correct:
+            stew.stir()
+            n_msgs = len(event_msgs[one_second_msgs[0].timestamp])
+            self.assertEqual(correct.call_count, n_msgs)
+            self.assertEqual(len(stew.serve_events()), n_msgs)
+            # nothing has changed, so nothing is visited
+            stew.stir()
+            self.assertEqual(correct.call_count, n_msgs)
+
+    def test_late_event_messages_are_cooked(self):
+        stew = events.Stew()
+        one_second_msgs, event_msgs = self.split_messages()
+        for msg in one_second_msgs:
+            stew.add_one_second_message(msg)
+        stew.stir()
+        late_msgs = event_msgs[one_second_msgs[1].timestamp]
+        for msg in late_msgs:
+            stew.add_event_message(msg)
+        stew.stir()
+        self.assertEqual([event._msg for event in stew.serve_events()],
+                         late_msgs)
+
+    @patch('pysparc.events.logger')
+    def test_drain_perished_event_messages(self, mock_logger):
+        stew = events.Stew()
+        one_second_msgs, event_msgs = self.split_messages()
+        t0 = one_second_msgs[0].timestamp
+        stew.add_one_second_message(one_second_msgs[0])
+        for msg in event_msgs[t0]:
+            stew.add_event_message(msg)
+        msg = one_second_msgs[-1]
+        msg.timestamp += events.FRESHNESS_TIME
+        stew.add_one_second_message(msg)
+        stew.drain()
+        self.assertEqual(stew._event_messages, {})
+        self.assertTrue(mock_logger.warning.called)
+        stew.stir()
+        self.assertEqual(stew.serve_events(), [])
+        self.assertEqual(stew.get_drain_stats(),
+                         {'perished_events': len(event_msgs[t0]),
+                          'stale_one_second_messages': 1})
+
+    def test_drain_keeps_fresh_entries(self):
+        stew = events.Stew()
+        one_second_msgs, event_msgs = self.split_messages(n_seconds=14)
+        for msg in one_second_msgs:
+            stew.add_one_second_message(msg)
+            for event_msg in event_msgs[msg.timestamp]:
+                stew.add_event_message(event_msg)
+            stew.stir()
+            stew.drain()
+        latest = one_second_msgs[-1].timestamp
+        self.assertEqual(sorted(stew._one_second_messages),
+                         range(latest - events.FRESHNESS_TIME, latest + 1))
+        self.assertEqual(sorted(stew._event_messages), [latest - 1, latest])
+        self.assertEqual(stew.n_stale_one_second_messages, 3)
+        self.assertEqual(stew.n_perished_events, 0)
+
+    @patch('pysparc.events.time.time')
+    def test_event_rate(self, mock_time):
+        mock_time.return_value = 1000.
+        stew = events.Stew()
+        one_second_msgs, event_msgs = self.split_messages()
+        for msg in one_second_msgs:
+            stew.add_one_second_message(msg)
+            for event_msg in event_msgs[msg.timestamp]:
+                stew.add_event_message(event_msg)
+        # the last second is still in progress
+        n_events = sum(len(event_msgs[msg.timestamp])
+                       for msg in one_second_msgs[:-1])
+        self.assertEqual(stew.event_rate(), n_events / 60.)
+        rates = stew.get_event_rates()
+        self.assertEqual(sorted(rates), [1, 10, 60, 600])
+        last_second = one_second_msgs[-2].timestamp
+        self.assertEqual(rates[1], len(event_msgs[last_second]))
+        self.assertEqual(rates[10], n_events / 10.)
+
+        seconds, counts = stew.get_event_counts(10)
+        self.assertEqual(len(seconds), 10)
+        self.assertEqual(seconds[-1], last_second)
+        self.assertEqual(counts.sum(), n_events)
+
+        mock_time.return_value += events.FRESHNESS_TIME + 1
+        self.assertEqual(stew.event_rate(), -999.)
+        self.assertEqual(stew.get_event_rates()[10], -999.)
+
+    @patch('pysparc.events.logger')
+    @patch('pysparc.events.time.time')
+    def test_drain_event_messages_waiting_too_long(self, mock_time,
+                                                   mock_logger):
+        # the GPS timestamps stop advancing
+        mock_time.return_value = 1000.
+        stew = events.Stew()
+        one_second_msgs, event_msgs = self.split_messages()
+        t0 = one_second_msgs[0].timestamp
+        stew.add_one_second_message(one_second_msgs[0])
+        for msg in event_msgs[t0]:
+            stew.add_event_message(msg)
+        stew.drain()
+        self.assertEqual(stew.n_perished_events, 0)
+
+        mock_time.return_value += events.FRESHNESS_TIME + 1
+        stew.add_one_second_message(one_second_msgs[0])
+        stew.drain()
+        self.assertEqual(stew._event_messages, {})
+        self.assertEqual(stew.n_perished_events, len(event_msgs[t0]))
+        # the same second may receive new event messages
+        stew.add_event_message(event_msgs[t0][0])
+        stew.drain()
+        self.assertEqual(len(stew._event_messages[t0]), 1)
+
+
+class EventAnalysisPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = events.EventAnalysisPool(processes=2)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def test_default_processes(self):
+        self.assertEqual(self.pool.processes, 2)
+
+    def test_analyze_preserves_order(self):
+        msgs = [msg for msg in generate_messages()
+                if isinstance(msg, messages.MeasuredDataMessage)]
+        expected = [events.analyze_traces(msg.trace_ch1, msg.trace_ch2)
+                    for msg in msgs]
+        self.assertEqual(self.pool.analyze(msgs), expected)
+
+    def test_stew_with_pool(self):
+        expected = cook(events.Stew(), generate_messages())
+        actual = cook(events.Stew(self.pool), generate_messages())
+        self.assertEqual([event_attributes(event) for event in actual],
+                         [event_attributes(event) for event in expected])
+
+
+class EventBatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.events = cook(events.Stew(), generate_messages())
+
+    def assert_events_equal(self, actual, expected):
+        self.assertEqual(len(actual), len(expected))
+        for actual_event, expected_event in zip(actual, expected):
+            self.assertIs(type(actual_event), type(expected_event))
+            self.assertEqual(all_event_attributes(actual_event),
+                             all_event_attributes(expected_event))
+
+    def test_empty_batch(self):
+        batch = events.EventBatch()
+        self.assertEqual(len(batch), 0)
+        self.assertEqual(batch.to_events(), [])
+        batch.analyze()
+
+    def test_columns(self):
+        batch = events.EventBatch.from_events(self.events)
+        self.assertEqual(len(batch), len(self.events))
+        self.assertEqual(batch.baselines.shape, (len(self.events), 4))
+        np.testing.assert_array_equal(
+            batch.ext_timestamp, [event.ext_timestamp for event in self.events])
+        np.testing.assert_array_equal(batch.trace_lengths[:, 2:], -1)
+        np.testing.assert_array_equal(batch.get_trace(1, 1),
+                                      self.events[1].trace_ch2)
+        self.assertIsNone(batch.get_trace(1, 2))
+
+    def test_round_trip(self):
+        batch = events.EventBatch.from_events(self.events)
+        self.assert_events_equal(batch.to_events(), self.events)
+
+    def test_round_trip_four_channel_events(self):
+        mixed = [events.FourChannelEvent(primary, secondary)
+                 for primary, secondary in zip(self.events,
+                                               self.events[1:])]
+        batch = events.EventBatch.from_events(mixed)
+        self.assertTrue((batch.trace_lengths > 0).all())
+        self.assert_events_equal(batch.to_events(), mixed)
+
+    def test_from_messages(self):
+        msgs = [event._msg for event in self.events]
+        rates = np.arange(len(msgs), dtype=float)
+        for event, rate in zip(self.events, rates):
+            event.event_rate = rate
+        batch = events.EventBatch.from_messages(msgs, rates)
+        self.assert_events_equal(batch.to_events(), self.events)
+
+    def test_analyze_traces_of_different_lengths(self):
+        longer = cook(events.Stew(), generate_messages(coincidence_time=80))
+        mixed = self.events[:5] + longer[:5] + self.events[5:10]
+        batch = events.EventBatch.from_events(mixed)
+        self.assertEqual(len(np.unique(batch.trace_lengths[:, :2])), 2)
+        baselines = batch.baselines.copy()
+        zlib_traces = batch.zlib_traces.copy()
+        batch.baselines[:] = -1
+        batch.zlib_traces[:] = None
+        batch.analyze()
+        np.testing.assert_array_equal(batch.baselines, baselines)
+        np.testing.assert_array_equal(batch.zlib_traces, zlib_traces)
+        self.assert_events_equal(batch.to_events(), mixed)
 
 if __name__ == '__main__':
     unittest.main()
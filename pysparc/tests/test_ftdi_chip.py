@@ -38,6 +38,17 @@ class FtdiChipTest(unittest.TestCase):
         self.mock_device = Mock()
         self.device._device = self.mock_device
 
+    def test_set_latency_timer(self):
+        self.device.set_latency_timer(2)
+        self.mock_device.ftdi_fn.ftdi_set_latency_timer.assert_called_once_with(2)
+        self.assertEqual(self.device.latency_timer, 2)
+
+    def test_set_latency_timer_checks_range(self):
+        self.assertRaises(ValueError, self.device.set_latency_timer, 0)
+        self.assertRaises(ValueError, self.device.set_latency_timer, 256)
+        self.assertFalse(
+            self.mock_device.ftdi_fn.ftdi_set_latency_timer.called)
+
     @patch('pysparc.ftdi_chip.pylibftdi.Device')
     def test_init_stores_device_description(self, mock_Device):
         device = ftdi_chip.FtdiChip(sentinel.description)
@@ -251,6 +262,7 @@ class FtdiChipTestWithClosedDevice(unittest.TestCase):
         mock_device = mock_Device.return_value
         self.device.open()
         mock_device.ftdi_fn.ftdi_set_latency_timer.assert_called_once_with(16)
+        self.assertEqual(self.device.latency_timer, 16)
 
     @patch('pysparc.ftdi_chip.pylibftdi.Device')
     @patch.object(ftdi_chip.FtdiChip, 'flush')
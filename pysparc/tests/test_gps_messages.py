@@ -1,7 +1,9 @@
 import logging
+import random
+import struct
 import unittest
 
-from mock import patch, sentinel, Mock, MagicMock, create_autospec
+from mock import patch, sentinel, create_autospec
 
 from pysparc import messages, gps_messages
 
@@ -117,6 +119,118 @@ class GPSMessageTest(unittest.TestCase):
         self.assertEqual(encoded_msg, '\x10\x12\x34\x10\x03')
 
 
+class TSIPBufferTest(unittest.TestCase):
+
+    def create_buffer(self, data=''):
+        buff = gps_messages.TSIPBuffer()
+        buff.extend(data)
+        return buff
+
+    def extract(self, data):
+        return self.create_buffer(data).extract_message()
+
+    def test_extract_message(self):
+        self.assertEqual(self.extract('\x10foo\x10\x03'), 'foo')
+        self.assertEqual(self.extract('\x10foo\x10\x03bar'), 'foo')
+        self.assertEqual(self.extract('\x10foo\x10\x03\x10bar\x10\x03'),
+                         'foo')
+        self.assertEqual(self.extract('\x10foo\x10\x10bar\x10\x03'),
+                         'foo\x10bar')
+        self.assertEqual(
+            self.extract('\x10foo\x10\x10\x10\x10bar\x10\x03'),
+            'foo\x10\x10bar')
+        self.assertEqual(self.extract('\x10foo\x10\x10\x03'), None)
+        self.assertEqual(self.extract('\x10foo\x10\x10\x03\x10\x03'),
+                         'foo\x10\x03')
+        self.assertEqual(self.extract('baz\x10foo\x10\x03'), 'foo')
+        self.assertEqual(self.extract('baz'), None)
+        self.assertEqual(self.extract('\x10foo'), None)
+        self.assertEqual(self.extract('\x10\x03\x10foo\x10\x03'), 'foo')
+        self.assertEqual(self.extract('\x10\x03\x10\x03\x10foo\x10\x03'),
+                         'foo')
+
+    def test_extract_message_deletes_from_buffer(self):
+        buff = self.create_buffer('\x10foo\x10\x03barbaz')
+        buff.extract_message()
+        self.assertEqual(str(buff), 'barbaz')
+
+    def test_garbage_without_start_codon_is_discarded(self):
+        buff = self.create_buffer('baz')
+        self.assertIs(buff.extract_message(), None)
+        self.assertEqual(len(buff), 0)
+
+    def test_incremental_scan(self):
+        buff = gps_messages.TSIPBuffer()
+        data = '\x10foo\x10\x10\x03bar\x10\x03\x10baz\x10\x03'
+        msgs = []
+        for c in data:
+            buff.extend(c)
+            msg = buff.extract_message()
+            if msg is not None:
+                msgs.append(msg)
+        self.assertEqual(msgs, ['foo\x10\x03bar', 'baz'])
+        self.assertEqual(len(buff), 0)
+
+    def test_scan_resumes_where_it_stopped(self):
+        buff = self.create_buffer('\x10foo\x10')
+        self.assertIs(buff.extract_message(), None)
+        self.assertEqual(buff._scan_pos, 5)
+        self.assertTrue(buff._escape)
+        buff.extend('\x03')
+        self.assertEqual(buff.extract_message(), 'foo')
+
+    def test_delete_resets_scan(self):
+        buff = self.create_buffer('\x10foo\x10')
+        buff.extract_message()
+        del buff[:]
+        buff.extend('\x10bar\x10\x03')
+        self.assertEqual(buff.extract_message(), 'bar')
+
+    def test_same_packets_as_rescanning_buffer(self):
+        rng = random.Random(1)
+        # packet ids are never DLE or ETX, the data may contain anything
+        packets = [chr(rng.choice([0x8f, 0xab])) +
+                   ''.join(chr(rng.choice([0x10, 0x03, 0x8f, 0xab]))
+                           for _ in range(rng.randint(0, 30)))
+                   for _ in range(100)]
+        data = ''.join('\x10' + packet.replace('\x10', '\x10\x10') +
+                       '\x10\x03' for packet in packets)
+        self.assert_same_packets_as_rescanning_buffer(data, packets, rng)
+        # reading starts at the stop codon of the previous packet
+        self.assert_same_packets_as_rescanning_buffer('\x10\x03' + data,
+                                                      packets, rng)
+
+    def assert_same_packets_as_rescanning_buffer(self, data, packets, rng):
+        func = gps_messages.GPSMessage.extract_message_from_buffer
+
+        expected = []
+        buff = bytearray(data)
+        while True:
+            msg = func(buff)
+            if msg is None:
+                break
+            # the rescanning buffer returns an empty packet for a stop
+            # codon at the start of the buffer
+            if msg:
+                expected.append(msg)
+
+        actual = []
+        buff = gps_messages.TSIPBuffer()
+        idx = 0
+        while idx < len(data):
+            size = rng.randint(1, 20)
+            buff.extend(data[idx:idx + size])
+            idx += size
+            while True:
+                msg = func(buff)
+                if msg is None:
+                    break
+                actual.append(msg)
+
+        self.assertEqual(expected, packets)
+        self.assertEqual(actual, expected)
+
+
 class UnpackMessagesTest(unittest.TestCase):
 
     def test_primary_timing_packet(self):
@@ -132,100 +246,96 @@ class UnpackMessagesTest(unittest.TestCase):
                           gps_messages.SoftwareVersionMessage, 'msg')
 
 
+def create_packet(msg):
+    """Frame an unstuffed packet, as sent by the GPS."""
+
+    return '\x10' + msg.replace('\x10', '\x10\x10') + '\x10\x03'
+
+
 class GPSMessageFactoryTest(unittest.TestCase):
 
     def setUp(self):
-        patcher1 = patch('pysparc.gps_messages.GPSMessage')
-        patcher2 = patch('pysparc.gps_messages.find_message_class')
-        self.addCleanup(patcher1.stop)
-        self.addCleanup(patcher2.stop)
-        self.mock_GPSMessage = patcher1.start()
-        self.mock_find_message_class = patcher2.start()
+        self.version_msg = struct.pack('11B', 0x45, 1, 2, 3, 4, 5, 6, 7, 8,
+                                       9, 10)
+        patcher = patch.dict(gps_messages.unparsed_packets, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     def test_factory_calls_extract_message_from_buffer(self):
-        gps_messages.GPSMessageFactory(sentinel.buffer)
-        self.mock_GPSMessage.extract_message_from_buffer\
-            .assert_called_once_with(sentinel.buffer)
-
-    def test_factory_calls_find_message_class(self):
-        self.mock_GPSMessage.extract_message_from_buffer.return_value = \
-            sentinel.msg
-        gps_messages.GPSMessageFactory(sentinel.buffer)
-        self.mock_find_message_class.assert_called_once_with(
-            sentinel.msg, self.mock_GPSMessage)
+        with patch.object(gps_messages.GPSMessage,
+                          'extract_message_from_buffer') as mock_extract:
+            mock_extract.return_value = None
+            gps_messages.GPSMessageFactory(sentinel.buffer)
+        mock_extract.assert_called_once_with(sentinel.buffer)
 
     def test_factory_return_none_if_no_message(self):
-        self.mock_GPSMessage.extract_message_from_buffer.return_value = \
-            None
-        actual = gps_messages.GPSMessageFactory(sentinel.buffer)
-        self.assertFalse(self.mock_find_message_class.called)
-        self.assertIsNone(actual)
+        buff = bytearray(create_packet(self.version_msg)[:-1])
+        self.assertIsNone(gps_messages.GPSMessageFactory(buff))
 
     def test_factory_returns_message_instance(self):
-        self.mock_GPSMessage.extract_message_from_buffer.return_value = \
-            sentinel.msg
-        mock_Class = Mock()
-        mock_instance = mock_Class.return_value
-        self.mock_find_message_class.return_value = mock_Class
-
-        inst = gps_messages.GPSMessageFactory(sentinel.buffer)
-
-        mock_Class.assert_called_once_with(sentinel.msg)
-        self.assertIs(inst, mock_instance)
-
-    def test_factory_catches_UnknownMessageError(self):
-        self.mock_find_message_class.side_effect = \
-            gps_messages.UnknownMessageError
-
-        actual = gps_messages.GPSMessageFactory(sentinel.buffer)
-
-        self.assertIsNone(actual)
+        buff = bytearray(create_packet(self.version_msg))
+        msg = gps_messages.GPSMessageFactory(buff)
+        self.assertIsInstance(msg, gps_messages.SoftwareVersionMessage)
+        self.assertEqual(msg.version_major, 1)
+        self.assertEqual(len(buff), 0)
+
+    def test_factory_skips_unknown_packets(self):
+        buff = bytearray(create_packet('\x8f\x20foo') +
+                         create_packet('\x8f\x20bar') +
+                         create_packet('\x47baz') +
+                         create_packet(self.version_msg))
+        msg = gps_messages.GPSMessageFactory(buff)
+        self.assertIsInstance(msg, gps_messages.SoftwareVersionMessage)
+        self.assertEqual(gps_messages.unparsed_packets,
+                         {0x8f20: 2, 0x47: 1})
 
     @patch.object(gps_messages, 'logger', autospec=True)
-    def test_factory_catches_CorruptMessageError(self, mock_logger):
-        corrupt_message_error = gps_messages.CorruptMessageError()
-        mock_Class = Mock()
-        mock_Class.side_effect = corrupt_message_error
-        self.mock_find_message_class.return_value = mock_Class
+    def test_unknown_packets_are_logged_once(self, mock_logger):
+        buff = bytearray(2 * create_packet('\x8f\x20foo'))
+        gps_messages.GPSMessageFactory(buff)
+        self.assertEqual(mock_logger.info.call_count, 1)
+        self.assertFalse(mock_logger.error.called)
 
-        actual = gps_messages.GPSMessageFactory(sentinel.buffer)
+    @patch.object(gps_messages, 'logger', autospec=True)
+    def test_factory_skips_corrupt_message(self, mock_logger):
+        buff = bytearray(create_packet('\x8f\xabfoo') +
+                         create_packet(self.version_msg))
+        msg = gps_messages.GPSMessageFactory(buff)
+        self.assertIsInstance(msg, gps_messages.SoftwareVersionMessage)
+        self.assertEqual(mock_logger.error.call_count, 1)
 
-        self.assertIsNone(actual)
-        mock_logger.error.assert_called_once_with(corrupt_message_error)
 
+class MessageRegistryTest(unittest.TestCase):
 
-class FindMessageForTest(unittest.TestCase):
+    def test_registry_contains_received_packets(self):
+        self.assertEqual(gps_messages.msg_classes, {
+            0x13: gps_messages.UnparsablePacket,
+            0x45: gps_messages.SoftwareVersionMessage,
+            0x8fab: gps_messages.PrimaryTimingPacket,
+            0x8fac: gps_messages.SupplementalTimingPacket})
 
-    class MockGPSMessage(gps_messages.GPSMessage):
+    def test_packet_identifier(self):
+        self.assertEqual(gps_messages.packet_identifier('\x45foo'), 0x45)
+        self.assertEqual(gps_messages.packet_identifier('\x8f\xabfoo'),
+                         0x8fab)
+        self.assertEqual(gps_messages.packet_identifier('\x8e\xa9'), 0x8ea9)
+        self.assertEqual(gps_messages.packet_identifier('\x8f'), 0x8f)
 
-        __subclasses__ = Mock()
 
-    def test_find_message_class_calls_all_is_message_for_and_raises(self):
-        msgs = []
-        for i in range(3):
-            msg = create_autospec(gps_messages.GPSMessage)
-            msg.is_message_for.return_value = False
-            msgs.append(msg)
-        self.MockGPSMessage.__subclasses__.return_value = msgs
-        mock_msg = MagicMock()
+class FindMessageForTest(unittest.TestCase):
 
+    def test_find_message_class_raises(self):
         self.assertRaises(gps_messages.UnknownMessageError,
-                          gps_messages.find_message_class, mock_msg,
-                          self.MockGPSMessage)
-
-        for msg in msgs:
-            msg.is_message_for.assert_called_once_with(mock_msg)
+                          gps_messages.find_message_class, '\x8f\x20foo')
 
     def test_find_message_class_returns_class(self):
-        Msg = Mock()
-        Msg.is_message_for.return_value = True
-        self.MockGPSMessage.__subclasses__.return_value = [Msg]
-
-        actual = gps_messages.find_message_class(sentinel.msg,
-                                                 self.MockGPSMessage)
+        self.assertIs(gps_messages.find_message_class('\x8f\xacfoo'),
+                      gps_messages.SupplementalTimingPacket)
 
-        self.assertFalse(Msg.called)
-        self.assertEqual(actual, Msg)
+    def test_find_message_class_uses_registry(self):
+        actual = gps_messages.find_message_class('\x8f\x20foo',
+                                                 {0x8f20: sentinel.Msg})
+        self.assertIs(actual, sentinel.Msg)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,151 @@
+import struct
+import threading
+import unittest
+
+import numpy as np
+from mock import Mock, patch
+
+from pysparc import gps_telemetry, gps_messages
+
+
+def create_supplemental_timing(clock_bias=0., alarms=0, survey_progress=100,
+                               temperature=30.):
+    msg = struct.pack(gps_messages.SupplementalTimingPacket.msg_format,
+                      0x8fac, 7, 0, survey_progress, 0, 0, alarms, 0, 0, 0,
+                      0, clock_bias, .5, 0, 0, temperature, 0., 0., 0., 1.5,
+                      '\x00' * 4)
+    return gps_messages.SupplementalTimingPacket(msg)
+
+
+def create_primary_timing(time_of_week=1000, week_number=1800):
+    msg = struct.pack(gps_messages.PrimaryTimingPacket.msg_format, 0x8fab,
+                      time_of_week, week_number, 16, 3, 0, 0, 0, 1, 2, 2015)
+    return gps_messages.PrimaryTimingPacket(msg)
+
+
+class TimeSeriesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.series = gps_telemetry.TimeSeries(5)
+
+    def test_empty(self):
+        self.assertEqual(len(self.series), 0)
+        self.assertIsNone(self.series.last)
+        self.assertTrue(np.isnan(self.series.mean()))
+        self.assertTrue(np.isnan(self.series.std()))
+        self.assertEqual(len(self.series.values()), 0)
+        self.assertEqual(self.series.next_index, 0)
+
+    def test_partially_filled(self):
+        for value in 1., 2., 3.:
+            self.series.append(value)
+        self.assertEqual(len(self.series), 3)
+        self.assertEqual(self.series.last, 3.)
+        np.testing.assert_array_equal(self.series.values(), [1., 2., 3.])
+        self.assertAlmostEqual(self.series.mean(), 2.)
+        self.assertAlmostEqual(self.series.std(), np.std([1., 2., 3.]))
+
+    def test_window(self):
+        values = np.random.normal(100., 5., size=23)
+        for value in values:
+            self.series.append(value)
+        self.assertEqual(len(self.series), 5)
+        self.assertEqual(self.series.next_index, 3)
+        np.testing.assert_array_equal(self.series.values(), values[-5:])
+        self.assertAlmostEqual(self.series.mean(), values[-5:].mean())
+        self.assertAlmostEqual(self.series.std(), values[-5:].std())
+
+
+class GPSTelemetryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.telemetry = gps_telemetry.GPSTelemetry(window=3)
+
+    def test_empty_status(self):
+        status = self.telemetry.get_status()
+        self.assertEqual(status['n_packets'], 0)
+        self.assertIsNone(status['clock_bias'])
+        self.assertTrue(np.isnan(status['clock_bias_mean']))
+        self.assertEqual(status['alarm_counts'], 16 * [0])
+
+    def test_supplemental_timing(self):
+        for clock_bias in 10., 20., 30., 40.:
+            self.telemetry.update(create_supplemental_timing(clock_bias))
+        status = self.telemetry.get_status()
+        self.assertEqual(status['n_packets'], 3)
+        self.assertEqual(status['clock_bias'], 40.)
+        self.assertAlmostEqual(status['clock_bias_mean'], 30.)
+        self.assertAlmostEqual(status['clock_bias_std'],
+                               np.std([20., 30., 40.]))
+        self.assertAlmostEqual(status['temperature_mean'], 30.)
+        self.assertEqual(status['survey_progress'], 100)
+        self.assertEqual(status['receiver_mode'], 7)
+        self.assertEqual(self.telemetry.n_supplemental_timing, 4)
+
+    def test_alarm_counts_are_windowed(self):
+        for alarms in 0b11, 0b01, 0b100, 0:
+            self.telemetry.update(create_supplemental_timing(alarms=alarms))
+        status = self.telemetry.get_status()
+        self.assertEqual(status['alarms'], 0)
+        self.assertEqual(status['alarm_counts'][:3], [1, 0, 1])
+        self.assertEqual(sum(status['alarm_counts']), 2)
+
+    def test_primary_timing(self):
+        self.telemetry.update(create_primary_timing(1234, 1801))
+        self.assertEqual(self.telemetry.get_status()['gps_time'],
+                         (1801, 1234))
+        self.assertEqual(self.telemetry.get_status()['n_packets'], 0)
+
+    def test_other_messages_are_ignored(self):
+        self.telemetry.update(Mock())
+        self.assertEqual(self.telemetry.n_primary_timing, 0)
+        self.assertEqual(self.telemetry.n_supplemental_timing, 0)
+
+    @patch('pysparc.gps_telemetry.time.time')
+    def test_get_time_series(self, mock_time):
+        mock_time.side_effect = [1., 2.]
+        for clock_bias in 10., 20.:
+            self.telemetry.update(create_supplemental_timing(clock_bias))
+        series = self.telemetry.get_time_series()
+        np.testing.assert_array_equal(series['timestamp'], [1., 2.])
+        np.testing.assert_array_equal(series['clock_bias'], [10., 20.])
+        np.testing.assert_array_equal(series['pps_quantization_error'],
+                                      [1.5, 1.5])
+
+
+class GPSReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.gps = Mock()
+        self.gps.read_messages.return_value = []
+        self.telemetry = gps_telemetry.GPSTelemetry()
+        self.reader = gps_telemetry.GPSReader(self.gps, self.telemetry,
+                                              threading.Event())
+
+    def test_is_daemon(self):
+        self.assertTrue(self.reader.daemon)
+
+    def test_read_and_update(self):
+        self.gps.read_messages.return_value = [create_supplemental_timing(),
+                                               create_primary_timing()]
+        self.assertEqual(self.reader.read_and_update(), 2)
+        self.assertEqual(self.telemetry.n_supplemental_timing, 1)
+        self.assertEqual(self.telemetry.n_primary_timing, 1)
+
+    def test_start_and_stop(self):
+        self.reader.start()
+        self.reader.stop()
+        self.assertFalse(self.reader.is_alive())
+
+    @patch('pysparc.gps_telemetry.logger')
+    def test_run_survives_errors(self, mock_logger):
+        def read_messages():
+            self.reader._must_shutdown.set()
+            raise RuntimeError("foo")
+        self.gps.read_messages.side_effect = read_messages
+        self.reader.run()
+        self.assertTrue(mock_logger.exception.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,9 +1,182 @@
+import threading
+import time
 import unittest
 import weakref
 
 from mock import patch, Mock, MagicMock, sentinel, call
 
-from pysparc import hardware, ftdi_chip, messages
+from pysparc import hardware, ftdi_chip, messages, gps_messages
+from pysparc.ring_buffer import RingBuffer
+
+
+class AdaptiveReadPolicyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.policy = hardware.AdaptiveReadPolicy(
+            min_read_size=620, max_read_size=6200, min_latency_timer=2,
+            max_latency_timer=16, interval=1.)
+
+    def test_defaults_until_first_interval(self):
+        self.policy.update(100, t=0.)
+        self.policy.update(100, t=.5)
+        self.assertEqual(self.policy.read_size, 6200)
+        self.assertEqual(self.policy.latency_timer, 16)
+        self.assertIs(self.policy.get_stats()['byte_rate'], None)
+
+    def test_low_rate(self):
+        # 100 reads per second, of which one returns 200 bytes
+        for i in range(101):
+            self.policy.update(200 if i % 100 == 50 else 0, t=i * .01)
+        stats = self.policy.get_stats()
+        self.assertEqual(stats['byte_rate'], 200.)
+        self.assertEqual(stats['reads_per_second'], 101.)
+        self.assertEqual(stats['transfers_per_second'], 1.)
+        self.assertEqual(stats['bytes_per_transfer'], 200.)
+        self.assertEqual(stats['latency_timer'], 16)
+        self.assertEqual(stats['read_size'], 620)
+
+    def test_moderate_rate(self):
+        # 100 reads per second of 300 bytes each
+        for i in range(101):
+            self.policy.update(300, t=i * .01)
+        self.assertEqual(self.policy.latency_timer, 16)
+        # 4 times the number of bytes per read, rounded up to 62 bytes
+        self.assertEqual(self.policy.read_size, 62 * 20)
+
+    def test_high_rate(self):
+        # 100 reads per second of 4000 bytes each
+        for i in range(101):
+            self.policy.update(4000, t=i * .01)
+        self.assertEqual(self.policy.latency_timer, 10)
+        self.assertEqual(self.policy.read_size, 6200)
+
+    def test_low_rate_raises_latency_timer_above_default(self):
+        policy = hardware.AdaptiveReadPolicy()
+        self.assertEqual(policy.latency_timer, ftdi_chip.LATENCY_TIMER)
+        # 100 reads per second, of which one returns 200 bytes
+        for i in range(101):
+            policy.update(200 if i % 100 == 50 else 0, t=i * .01)
+        self.assertEqual(policy.latency_timer, ftdi_chip.MAX_LATENCY_TIMER)
+        # 100 reads per second of 400 bytes each
+        for i in range(101, 202):
+            policy.update(400, t=i * .01)
+        # 4096 bytes per transfer at a smoothed rate of 20100 bytes/s
+        self.assertEqual(policy.latency_timer, 203)
+        self.assertTrue(policy.latency_timer > ftdi_chip.LATENCY_TIMER)
+
+    def test_full_read_sets_maximum_read_size(self):
+        for i in range(101):
+            self.policy.update(0, t=i * .01)
+        self.assertEqual(self.policy.read_size, 620)
+        self.policy.update(620, t=1.01)
+        self.assertEqual(self.policy.read_size, 6200)
+
+    def test_rate_is_smoothed(self):
+        self.policy.update(0, t=0.)
+        self.policy.update(1000, t=1.)
+        self.policy.update(3000, t=2.)
+        self.assertEqual(self.policy.byte_rate, 2000.)
+
+    def test_invalid_bounds(self):
+        self.assertRaises(ValueError, hardware.AdaptiveReadPolicy,
+                          min_read_size=100)
+        self.assertRaises(ValueError, hardware.AdaptiveReadPolicy,
+                          min_read_size=6200, max_read_size=620)
+        self.assertRaises(ValueError, hardware.AdaptiveReadPolicy,
+                          min_latency_timer=0)
+        self.assertRaises(ValueError, hardware.AdaptiveReadPolicy,
+                          min_latency_timer=20, max_latency_timer=16)
+
+
+class DataAvailableTest(unittest.TestCase):
+
+    def setUp(self):
+        self.signal = hardware.DataAvailable()
+
+    def tearDown(self):
+        self.signal.close()
+
+    def test_wait_times_out(self):
+        self.assertFalse(self.signal.is_set())
+        self.assertFalse(self.signal.wait(.01))
+
+    def test_set_and_clear(self):
+        self.signal.set()
+        self.signal.set()
+        self.assertTrue(self.signal.is_set())
+        self.assertTrue(self.signal.wait(0))
+        self.signal.clear()
+        self.assertFalse(self.signal.is_set())
+        self.assertFalse(self.signal.wait(0))
+
+    def test_set_wakes_up_waiting_thread(self):
+        timer = threading.Timer(.01, self.signal.set)
+        timer.start()
+        t0 = time.time()
+        self.assertTrue(self.signal.wait(5))
+        self.assertTrue(time.time() - t0 < 1)
+        timer.join()
+
+
+class DeviceReaderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hardware = Mock()
+        self.hardware.read_from_device.return_value = ''
+        self.reader = hardware.DeviceReader(self.hardware, queue_size=2)
+
+    def test_is_daemon(self):
+        self.assertTrue(self.reader.daemon)
+
+    def test_put_and_get_chunks(self):
+        self.reader.put((0, 'foo'))
+        self.reader.put((0, 'ba'))
+        self.assertEqual(self.reader.get_chunks(), ['foo', 'ba'])
+        self.assertEqual(self.reader.get_chunks(), [])
+        stats = self.reader.get_stats()
+        self.assertEqual(stats['n_chunks'], 2)
+        self.assertEqual(stats['n_bytes'], 5)
+        self.assertEqual(stats['high_water_mark'], 2)
+        self.assertEqual(stats['queue_length'], 0)
+        self.assertEqual(stats['queue_size'], 2)
+
+    def test_put_waits_on_full_queue_until_shutdown(self):
+        self.reader.put((0, 'foo'))
+        self.reader.put((0, 'foo'))
+        self.reader._must_shutdown.set()
+        self.reader.put((0, 'bar'))
+        self.assertEqual(self.reader.n_full, 1)
+        self.assertEqual(self.reader.n_chunks, 2)
+
+    def test_put_sets_data_available(self):
+        data_available = hardware.DataAvailable()
+        reader = hardware.DeviceReader(self.hardware, 2, data_available)
+        reader.put((0, 'foo'))
+        self.assertTrue(data_available.is_set())
+
+    def test_flush_discards_chunks(self):
+        self.reader.put((0, 'foo'))
+        self.reader.flush()
+        self.hardware._device.flush.assert_called_once_with()
+        self.assertEqual(self.reader.get_chunks(), [])
+        # chunks read before the flush, but queued after it
+        self.reader.put((0, 'foo'))
+        self.reader.put((1, 'bar'))
+        self.assertEqual(self.reader.get_chunks(), ['bar'])
+
+    @patch('pysparc.hardware.logger')
+    def test_run_stops_on_error(self, mock_logger):
+        error = ftdi_chip.ReadError('foo')
+        self.hardware.read_from_device.side_effect = ['foo', error]
+        self.reader.run()
+        self.assertEqual(self.reader.get_chunks(), ['foo'])
+        self.assertRaises(ftdi_chip.ReadError, self.reader.get_chunks)
+        self.assertEqual(self.reader.get_chunks(raise_errors=False), [])
+
+    def test_start_and_stop(self):
+        self.reader.start()
+        self.reader.stop()
+        self.assertFalse(self.reader.is_alive())
 
 
 class HiSPARCIIITest(unittest.TestCase):
@@ -66,6 +239,9 @@ class HiSPARCIITest(unittest.TestCase):
         secondary = hardware.HiSPARCII(secondary=True)
         self.assertEqual(secondary.description, "HiSPARC II Slave")
 
+    def test_buffer_type_is_ring_buffer(self):
+        self.assertIs(hardware.HiSPARCII._buffer_type, RingBuffer)
+
     def test_init_calls_super(self):
         # test that super *was* called during setUp()
         self.mock_super.assert_called_once_with()
@@ -129,6 +305,24 @@ class HiSPARCIITest(unittest.TestCase):
         actual = self.hisparc.read_message()
         self.assertIs(actual, mock_config_message)
 
+    @patch('pysparc.hardware.HisparcMessageFactory')
+    def test_extract_message_does_not_read_from_device(self, mock_factory):
+        mock_factory.return_value = sentinel.msg
+        actual = self.hisparc.extract_message()
+        self.assertIs(actual, sentinel.msg)
+        mock_factory.assert_called_once_with(self.hisparc._buffer)
+        self.assertFalse(self.mock_device.read.called)
+
+    @patch.object(hardware.HiSPARCII, 'read_into_buffer')
+    @patch('pysparc.hardware.HisparcMessageFactory')
+    def test_read_messages_sets_config_parameters(self, mock_factory,
+                                                  mock_read_into_buffer):
+        mock_config_message = Mock(spec=messages.ControlParameterList)
+        mock_factory.side_effect = [Mock(), mock_config_message, None]
+        self.hisparc.read_messages()
+        self.mock_config.update_from_config_message.assert_called_once_with(
+            mock_config_message)
+
     @patch.object(hardware.HiSPARCII, 'flush_device')
     @patch.object(hardware.HiSPARCII, 'read_message')
     def test_flush_and_get_measured_data_message_calls_flush(self,
@@ -242,11 +436,127 @@ class BaseHardwareTest(unittest.TestCase):
         self.hisparc.read_into_buffer()
         mock_buffer.extend.assert_called_once_with(read_data)
 
+    def test_capture_is_disabled_by_default(self):
+        self.assertIs(self.hisparc._capture, None)
+
+    def test_read_into_buffer_writes_to_capture(self):
+        self.hisparc._buffer = Mock()
+        mock_capture = Mock()
+        read_data = self.mock_device.read.return_value
+        self.hisparc.start_capture(mock_capture)
+        self.hisparc.read_into_buffer()
+        mock_capture.write.assert_called_once_with(self.hisparc.description,
+                                                   read_data)
+
+    def test_stop_capture(self):
+        self.hisparc._buffer = Mock()
+        mock_capture = Mock()
+        self.hisparc.start_capture(mock_capture)
+        self.hisparc.stop_capture()
+        self.hisparc.read_into_buffer()
+        self.assertFalse(mock_capture.write.called)
+        self.assertIs(self.hisparc._capture, None)
+
+    def test_reader_is_disabled_by_default(self):
+        self.assertIs(self.hisparc._reader, None)
+        self.assertIs(self.hisparc.get_reader_stats(), None)
+
+    def test_reader_thread_reads_into_buffer(self):
+        self.mock_device.read.side_effect = lambda size: 'foo'
+        self.hisparc.start_reader(queue_size=4)
+        self.assertTrue(self.hisparc._reader.is_alive())
+        while not self.hisparc._reader.n_chunks:
+            time.sleep(.001)
+        self.hisparc.stop_reader()
+        self.assertIs(self.hisparc._reader, None)
+        data = str(self.hisparc._buffer)
+        self.assertTrue(len(data) > 0)
+        self.assertEqual(data, 'foo' * (len(data) // 3))
+
+    def test_read_into_buffer_uses_reader_queue(self):
+        mock_reader = Mock()
+        mock_reader.get_chunks.return_value = ['foo', 'bar']
+        self.hisparc._reader = mock_reader
+        self.hisparc.read_into_buffer()
+        self.assertFalse(self.mock_device.read.called)
+        self.assertEqual(str(self.hisparc._buffer), 'foobar')
+
+    def test_flush_device_flushes_reader(self):
+        mock_reader = Mock()
+        mock_reader.get_chunks.return_value = []
+        self.hisparc._reader = mock_reader
+        self.hisparc.flush_device()
+        mock_reader.flush.assert_called_once_with()
+
+    def test_read_policy_is_disabled_by_default(self):
+        self.assertIs(self.hisparc._read_policy, None)
+        self.assertIs(self.hisparc.get_read_policy_stats(), None)
+
+    def test_set_read_policy_sets_latency_timer(self):
+        policy = hardware.AdaptiveReadPolicy(max_latency_timer=10)
+        self.hisparc.set_read_policy(policy)
+        self.mock_device.set_latency_timer.assert_called_once_with(10)
+        self.hisparc.set_read_policy(None)
+        self.mock_device.set_latency_timer.assert_called_with(16)
+
+    def test_read_from_device_uses_read_policy(self):
+        policy = Mock()
+        policy.read_size = 620
+        policy.latency_timer = 4
+        self.mock_device.latency_timer = 16
+        self.mock_device.read.return_value = 'foo'
+        self.hisparc._read_policy = policy
+        self.assertEqual(self.hisparc.read_from_device(), 'foo')
+        self.mock_device.read.assert_called_once_with(620)
+        policy.update.assert_called_once_with(3)
+        self.mock_device.set_latency_timer.assert_called_once_with(4)
+
+    def test_close_stops_reader(self):
+        mock_reader = Mock()
+        mock_reader.get_chunks.return_value = []
+        self.hisparc._reader = mock_reader
+        self.hisparc.close()
+        mock_reader.stop.assert_called_once_with()
+        self.assertIs(self.hisparc._reader, None)
+
     @patch.object(hardware.BaseHardware, 'read_into_buffer')
     def test_read_message(self, mock_read_into_buffer):
         self.assertRaises(NotImplementedError, self.hisparc.read_message)
         mock_read_into_buffer.assert_called_once_with()
 
+    @patch.object(hardware.BaseHardware, 'extract_message')
+    @patch.object(hardware.BaseHardware, 'read_into_buffer')
+    def test_read_messages_reads_once(self, mock_read_into_buffer,
+                                      mock_extract):
+        mock_extract.side_effect = [sentinel.msg1, sentinel.msg2, None]
+        self.hisparc.read_messages()
+        mock_read_into_buffer.assert_called_once_with()
+
+    @patch.object(hardware.BaseHardware, 'extract_message')
+    @patch.object(hardware.BaseHardware, 'read_into_buffer')
+    def test_read_messages_returns_all_messages(self, mock_read_into_buffer,
+                                                mock_extract):
+        mock_extract.side_effect = [sentinel.msg1, sentinel.msg2, None,
+                                    sentinel.msg3]
+        actual = self.hisparc.read_messages()
+        self.assertEqual(actual, [sentinel.msg1, sentinel.msg2])
+
+    @patch.object(hardware.BaseHardware, 'extract_message')
+    @patch.object(hardware.BaseHardware, 'read_into_buffer')
+    def test_read_messages_returns_empty_list(self, mock_read_into_buffer,
+                                              mock_extract):
+        mock_extract.return_value = None
+        self.assertEqual(self.hisparc.read_messages(), [])
+
+    @patch.object(hardware.BaseHardware, 'extract_message')
+    @patch.object(hardware.BaseHardware, 'read_into_buffer')
+    def test_iter_messages_does_not_read(self, mock_read_into_buffer,
+                                         mock_extract):
+        mock_extract.side_effect = [sentinel.msg1, None]
+        actual = list(self.hisparc.iter_messages())
+        self.assertEqual(actual, [sentinel.msg1])
+        self.assertFalse(mock_read_into_buffer.called)
+
 
 class TrimbleGPSTest(unittest.TestCase):
 
@@ -287,6 +597,10 @@ class TrimbleGPSTest(unittest.TestCase):
         self.assertEqual(hardware.TrimbleGPS.description,
                          "FT232R USB UART")
 
+    def test_buffer_type_is_tsip_buffer(self):
+        self.assertIs(hardware.TrimbleGPS._buffer_type,
+                      gps_messages.TSIPBuffer)
+
     def test_read_message(self):
         self.gps.read_message()
         self.mock_read_into_buffer.assert_called_once_with()
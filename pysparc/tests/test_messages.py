@@ -1,8 +1,29 @@
+import datetime
+import struct
 import unittest
 
 from mock import patch, sentinel, MagicMock
+import numpy as np
 
 import pysparc.messages
+from pysparc.ring_buffer import RingBuffer
+
+
+def pack_trace(trace):
+    """Pack a trace of 12-bit values, as sent by the hardware."""
+
+    packed = bytearray()
+    for a1, a2 in zip(trace[::2], trace[1::2]):
+        packed.extend([a1 >> 4, ((a1 & 0xf) << 4) | (a2 >> 8), a2 & 0xff])
+    return str(packed)
+
+
+def create_measured_data_frame(traces):
+    """Create a measured data message with pre, coinc and post times of 1."""
+
+    header = struct.pack(pysparc.messages.MeasuredDataMessage.msg_format,
+                         0x99, 0xa0, 2, 3, 1, 1, 1, 1, 2, 2015, 3, 4, 5, 100)
+    return header + pack_trace(traces[0]) + pack_trace(traces[1]) + '\x66'
 
 
 class BaseMessageTest(unittest.TestCase):
@@ -147,6 +168,187 @@ class HisparcMessageTest(unittest.TestCase):
         self.assertEqual(self.msg.codons['stop'], 0x66)
 
 
+class GPSTimestampTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = patch.dict(pysparc.messages._timestamp_cache, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_gps_timestamp(self):
+        timestamp = pysparc.messages.gps_timestamp(2015, 2, 1, 3, 4, 5)
+        self.assertEqual(timestamp, 1422759845)
+
+    def test_gps_timestamp_is_cached(self):
+        pysparc.messages.gps_timestamp(2015, 2, 1, 3, 4, 5)
+        with patch('pysparc.messages.calendar.timegm') as mock_timegm:
+            timestamp = pysparc.messages.gps_timestamp(2015, 2, 1, 3, 4, 5)
+        self.assertFalse(mock_timegm.called)
+        self.assertEqual(timestamp, 1422759845)
+
+    def test_gps_timestamp_cache_is_bounded(self):
+        size = pysparc.messages.TIMESTAMP_CACHE_SIZE
+        for seconds in range(2 * size):
+            pysparc.messages.gps_timestamp(2015, 2, 1, 3, seconds // 60,
+                                           seconds % 60)
+        self.assertLessEqual(len(pysparc.messages._timestamp_cache), size)
+
+    def test_gps_timestamp_raises_ValueError_for_invalid_date(self):
+        self.assertRaises(ValueError, pysparc.messages.gps_timestamp,
+                          2015, 13, 1, 3, 4, 5)
+
+
+class OneSecondMessageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = struct.pack(
+            pysparc.messages.OneSecondMessage.msg_format, 0x99, 0xa4, 1, 2,
+            2015, 3, 4, 5, 100, 1.5, 1, 2, 3, 4, 61 * '\x00', 0x66)
+
+    def test_parse_message(self):
+        buff = bytearray(self.frame + 'foo')
+        msg = pysparc.messages.OneSecondMessage(buff)
+        self.assertEqual(buff, 'foo')
+        self.assertEqual(msg.timestamp, 1422759845)
+        self.assertEqual(msg.count_ticks_PPS, 100)
+        self.assertEqual(msg.quantization_error, 1.5)
+        self.assertEqual(msg.count_ch1_low, 4)
+
+    def test_datetime_is_lazy(self):
+        msg = pysparc.messages.OneSecondMessage(bytearray(self.frame))
+        self.assertNotIn('datetime', vars(msg))
+        self.assertEqual(msg.datetime, datetime.datetime(2015, 2, 1, 3, 4, 5))
+
+
+class MeasuredDataMessageTest(unittest.TestCase):
+
+    def setUp(self):
+        # pre, coincidence and post times of 1 give 6 samples per channel
+        self.trace_ch1 = [0, 4095, 1, 2048, 200, 201]
+        self.trace_ch2 = [10, 20, 30, 4000, 50, 60]
+        self.frame = create_measured_data_frame([self.trace_ch1,
+                                                 self.trace_ch2])
+
+    def test_parse_message(self):
+        buff = bytearray(self.frame + 'foo')
+        msg = pysparc.messages.MeasuredDataMessage(buff)
+        self.assertEqual(buff, 'foo')
+        self.assertEqual(msg.trigger_pattern, 3)
+        self.assertEqual(msg.trace_length, 9)
+        self.assertEqual(msg.timestamp, 1422759845)
+        self.assertEqual(msg.nanoseconds, 500)
+        self.assertEqual(msg.datetime, datetime.datetime(2015, 2, 1, 3, 4, 5))
+        self.assertEqual(list(msg.trace_ch1), self.trace_ch1)
+        self.assertEqual(list(msg.trace_ch2), self.trace_ch2)
+
+    def test_parse_message_from_ring_buffer(self):
+        buff = RingBuffer()
+        buff.extend(self.frame)
+        msg = pysparc.messages.MeasuredDataMessage(buff)
+        self.assertEqual(len(buff), 0)
+        self.assertEqual(list(msg.trace_ch2), self.trace_ch2)
+
+    def test_raw_traces_is_view_into_frame(self):
+        msg = pysparc.messages.MeasuredDataMessage(bytearray(self.frame))
+        raw_traces = msg.raw_traces
+        self.assertEqual(raw_traces.tostring(), self.frame[22:-1])
+        self.assertFalse(raw_traces.flags.owndata)
+        self.assertFalse(raw_traces.flags.writeable)
+
+    def test_traces_are_views(self):
+        msg = pysparc.messages.MeasuredDataMessage(bytearray(self.frame))
+        self.assertEqual(msg.traces.shape, (2, 6))
+        self.assertIs(msg.trace_ch1.base, msg.traces)
+        self.assertIs(msg.trace_ch2.base, msg.traces)
+
+    def test_parse_message_raises_if_too_short(self):
+        buff = bytearray(self.frame[:-1])
+        self.assertRaises(struct.error,
+                          pysparc.messages.MeasuredDataMessage, buff)
+        self.assertEqual(buff, self.frame[:-1])
+
+    def test_parse_message_raises_if_header_too_short(self):
+        buff = bytearray(self.frame[:10])
+        self.assertRaises(struct.error,
+                          pysparc.messages.MeasuredDataMessage, buff)
+
+    def test_frame_is_copied_once(self):
+        with patch('pysparc.messages.copy_frame',
+                   wraps=pysparc.messages.copy_frame) as copy_frame:
+            pysparc.messages.MeasuredDataMessage(bytearray(self.frame))
+        self.assertEqual(copy_frame.call_count, 1)
+
+    def test_parse_message_raises_if_corrupt(self):
+        buff = bytearray(self.frame[:-1] + '\x00')
+        self.assertRaises(pysparc.messages.CorruptMessageError,
+                          pysparc.messages.MeasuredDataMessage, buff)
+
+
+class UnpackTracesTest(unittest.TestCase):
+
+    def unpack_reference(self, raw_trace):
+        values = np.fromstring(raw_trace, dtype=np.uint8).astype(np.int16)
+        a1 = (values[::3] << 4) + (values[1::3] >> 4)
+        a2 = ((values[1::3] & 0x0f) << 8) + values[2::3]
+        return np.dstack((a1, a2)).ravel()
+
+    def create_message(self, traces):
+        frame = create_measured_data_frame(traces)
+        return pysparc.messages.MeasuredDataMessage(bytearray(frame))
+
+    def test_unpack_raw_traces_equals_reference(self):
+        raw = np.random.randint(0, 256, size=3000).astype(np.uint8)
+        actual = pysparc.messages.unpack_raw_traces(raw)
+        self.assertEqual(actual.dtype, np.int16)
+        np.testing.assert_array_equal(actual,
+                                      self.unpack_reference(raw.tostring()))
+
+    def test_unpack_raw_traces_multidimensional(self):
+        raw = np.random.randint(0, 256, size=(4, 2, 300)).astype(np.uint8)
+        actual = pysparc.messages.unpack_raw_traces(raw)
+        self.assertEqual(actual.shape, (4, 2, 200))
+        np.testing.assert_array_equal(
+            actual[3, 1], self.unpack_reference(raw[3, 1].tostring()))
+
+    def test_unpack_raw_traces_into_out(self):
+        raw = np.random.randint(0, 256, size=(2, 30)).astype(np.uint8)
+        out = np.zeros((2, 20), dtype=np.int16)
+        actual = pysparc.messages.unpack_raw_traces(raw, out=out)
+        self.assertIs(actual, out)
+        self.assertRaises(ValueError, pysparc.messages.unpack_raw_traces,
+                          raw, out=np.zeros((2, 21), dtype=np.int16))
+
+    def test_unpack_traces_of_messages(self):
+        all_traces = np.random.randint(0, 4096, size=(5, 2, 6))
+        msgs = [self.create_message(traces) for traces in all_traces]
+        actual = pysparc.messages.unpack_traces_of_messages(msgs)
+        self.assertEqual(actual.shape, (5, 2, 6))
+        np.testing.assert_array_equal(actual, all_traces)
+        self.assertIs(msgs[2].trace_ch1.base, actual)
+        np.testing.assert_array_equal(msgs[2].trace_ch2, all_traces[2, 1])
+
+    def test_unpack_traces_of_no_messages(self):
+        actual = pysparc.messages.unpack_traces_of_messages([])
+        self.assertEqual(actual.shape, (0, 2, 0))
+
+
+class CopyFrameTest(unittest.TestCase):
+
+    def test_copy_frame_from_bytearray(self):
+        frame = pysparc.messages.copy_frame(bytearray('foobar'), 3)
+        self.assertIs(type(frame), str)
+        self.assertEqual(frame, 'foo')
+
+    def test_copy_frame_from_ring_buffer(self):
+        buff = RingBuffer()
+        buff.extend('foobar')
+        del buff[:1]
+        frame = pysparc.messages.copy_frame(buff, 3)
+        self.assertIs(type(frame), str)
+        self.assertEqual(frame, 'oob')
+        self.assertEqual(pysparc.messages.copy_frame(buff, 100), 'oobar')
+
+
 class SetControlParameterTest(unittest.TestCase):
 
     def setUp(self):
@@ -216,5 +418,76 @@ class ResetMessageTest(unittest.TestCase):
                          pysparc.messages.msg_ids['reset'])
 
 
+class MessageRegistryTest(unittest.TestCase):
+
+    def test_registry_contains_received_messages(self):
+        msg_classes = pysparc.messages.msg_classes
+        msg_ids = pysparc.messages.msg_ids
+        self.assertEqual(msg_classes, {
+            msg_ids['one_second']: pysparc.messages.OneSecondMessage,
+            msg_ids['measured_data']: pysparc.messages.MeasuredDataMessage,
+            msg_ids['all_controls']: pysparc.messages.ControlParameterList})
+
+
+class HisparcMessageFactoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.msg = struct.pack(pysparc.messages.OneSecondMessage.msg_format,
+                               0x99, 0xa4, 1, 2, 2015, 3, 4, 5, 100, 1.5, 1,
+                               2, 3, 4, 61 * '\x00', 0x66)
+
+    def test_returns_none_for_empty_buffer(self):
+        self.assertIs(pysparc.messages.HisparcMessageFactory(bytearray()),
+                      None)
+
+    def test_returns_message(self):
+        buff = bytearray(self.msg)
+        msg = pysparc.messages.HisparcMessageFactory(buff)
+        self.assertIsInstance(msg, pysparc.messages.OneSecondMessage)
+        self.assertEqual(len(buff), 0)
+
+    def test_strips_garbage(self):
+        buff = bytearray('foo\x99\x01bar\x99' + self.msg)
+        msg = pysparc.messages.HisparcMessageFactory(buff)
+        self.assertIsInstance(msg, pysparc.messages.OneSecondMessage)
+        self.assertEqual(len(buff), 0)
+
+    def test_strips_corrupt_message(self):
+        corrupt_msg = self.msg[:-1] + '\x00'
+        buff = bytearray(corrupt_msg + self.msg)
+        msg = pysparc.messages.HisparcMessageFactory(buff)
+        self.assertIsInstance(msg, pysparc.messages.OneSecondMessage)
+        self.assertEqual(len(buff), 0)
+
+    def test_does_not_recurse_on_long_garbage(self):
+        buff = bytearray(100000 * '\x99\x01' + self.msg)
+        msg = pysparc.messages.HisparcMessageFactory(buff)
+        self.assertIsInstance(msg, pysparc.messages.OneSecondMessage)
+
+    def test_keeps_partial_message(self):
+        buff = bytearray(self.msg[:10])
+        self.assertIs(pysparc.messages.HisparcMessageFactory(buff), None)
+        self.assertEqual(buff, self.msg[:10])
+
+
+class ResynchronizeTest(unittest.TestCase):
+
+    def test_returns_number_of_discarded_bytes(self):
+        buff = bytearray('foo\x99\x01bar\x99\xa4baz')
+        discarded = pysparc.messages.resynchronize(buff)
+        self.assertEqual(discarded, 8)
+        self.assertEqual(buff, '\x99\xa4baz')
+
+    def test_discards_everything_if_no_start_codon(self):
+        buff = bytearray('foobar')
+        self.assertEqual(pysparc.messages.resynchronize(buff), 6)
+        self.assertEqual(len(buff), 0)
+
+    def test_keeps_trailing_start_codon(self):
+        buff = bytearray('\x99foo\x99')
+        self.assertEqual(pysparc.messages.resynchronize(buff, offset=1), 4)
+        self.assertEqual(buff, '\x99')
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,156 @@
+import struct
+import unittest
+
+from mock import patch, Mock
+
+from pysparc import replay, messages
+from pysparc.daq import SYSTEM_CONFIGFILE
+
+
+GPS_DESCRIPTION = "FT232R USB UART"
+PRIMARY = "HiSPARC II Master"
+SECONDARY = "HiSPARC II Slave"
+
+
+def create_one_second_frame(seconds):
+    return struct.pack(messages.OneSecondMessage.msg_format, 0x99, 0xa4, 1,
+                       2, 2015, 3, 4, seconds, 200000000, 0., 1, 2, 3, 4,
+                       61 * '\x00', 0x66)
+
+
+def create_measured_data_frame(seconds, count_ticks):
+    header = struct.pack(messages.MeasuredDataMessage.msg_format, 0x99,
+                         0xa0, 2, 3, 1, 1, 1, 1, 2, 2015, 3, 4, seconds,
+                         count_ticks)
+    return header + 2 * (9 * '\x00') + '\x66'
+
+
+def create_records(description, n_seconds=5, offset=0):
+    """Create records with one-second messages and an event each second.
+
+    Each record contains a one-second message and an event message.  The
+    event message of the first record is split over two records.
+
+    """
+    records = []
+    for seconds in range(n_seconds):
+        data = (create_one_second_frame(seconds) +
+                create_measured_data_frame(seconds, 1000 + offset))
+        records.append((1000. + seconds, description, data))
+    timestamp, description, data = records[0]
+    records[0:1] = [(timestamp, description, data[:100]),
+                    (timestamp + .5, description, data[100:])]
+    return records
+
+
+class ReplayTest(unittest.TestCase):
+
+    def setUp(self):
+        self.records = [(1000., PRIMARY, 'foo'),
+                        (1001., GPS_DESCRIPTION, 'gps'),
+                        (1002., SECONDARY, 'bar'),
+                        (1003., PRIMARY, 'baz')]
+        self.replay = replay.Replay(self.records)
+
+    def test_read_demultiplexes_devices(self):
+        self.replay.register(PRIMARY)
+        self.replay.register(SECONDARY)
+        self.assertEqual(self.replay.read(SECONDARY), 'bar')
+        self.assertEqual(self.replay.read(PRIMARY), 'foo')
+        self.assertEqual(self.replay.read(PRIMARY), 'baz')
+        self.assertEqual(self.replay.read(PRIMARY), '')
+        self.assertEqual(self.replay.read(SECONDARY), '')
+        self.assertTrue(self.replay.exhausted)
+        self.assertEqual(self.replay.n_chunks, 3)
+        self.assertEqual(self.replay.n_bytes, 9)
+        self.assertEqual(self.replay.capture_time, 1003.)
+
+    def test_not_exhausted_with_pending_data(self):
+        self.replay.register(PRIMARY)
+        self.replay.register(SECONDARY)
+        self.replay.read(PRIMARY)
+        self.replay.read(PRIMARY)
+        self.replay.read(PRIMARY)
+        self.assertFalse(self.replay.exhausted)
+        self.replay.read(SECONDARY)
+        self.assertTrue(self.replay.exhausted)
+
+    @patch('pysparc.replay.time.time')
+    def test_real_time_replay(self, mock_time):
+        self.replay.register(PRIMARY)
+        self.replay.speed = 2.
+        mock_time.return_value = 10.
+        self.assertEqual(self.replay.read(PRIMARY), 'foo')
+        mock_time.return_value = 11.4
+        self.assertEqual(self.replay.read(PRIMARY), '')
+        mock_time.return_value = 11.5
+        self.assertEqual(self.replay.read(PRIMARY), 'baz')
+
+
+class ReplayHardwareTest(unittest.TestCase):
+
+    def test_hisparc_reads_recorded_messages(self):
+        data = create_one_second_frame(5)
+        device = replay.ReplayHiSPARCII(replay.Replay([(1., PRIMARY, data)]))
+        msgs = device.read_messages()
+        self.assertEqual(len(msgs), 1)
+        self.assertIsInstance(msgs[0], messages.OneSecondMessage)
+        self.assertEqual(device.read_messages(), [])
+
+    def test_hisparc_discards_sent_messages(self):
+        device = replay.ReplayHiSPARCII(replay.Replay([]))
+        device.send_message(messages.GetControlParameterList())
+        device.flush_device()
+
+    def test_gps_reads_recorded_data(self):
+        r = replay.Replay([(1., GPS_DESCRIPTION, 'foo')])
+        device = replay.ReplayTrimbleGPS(r)
+        device.read_into_buffer()
+        self.assertEqual(str(device._buffer), 'foo')
+
+
+class ReplayDataAcquisitionTest(unittest.TestCase):
+
+    def create_daq(self, records, cls=None, **kwargs):
+        if cls is None:
+            cls = replay.ReplayDataAcquisition
+        daq = cls(replay.Replay(records, speed=kwargs.pop('speed', None)),
+                  config_files=[SYSTEM_CONFIGFILE], **kwargs)
+        self.addCleanup(daq.close)
+        return daq
+
+    def test_primary_only(self):
+        storage_manager = Mock()
+        daq = self.create_daq(create_records(PRIMARY),
+                              storage_manager=storage_manager)
+        daq.run()
+        self.assertTrue(daq.replay.exhausted)
+        self.assertEqual(daq.n_messages, 10)
+        # events need the one-second messages of the next two seconds
+        self.assertEqual(daq.n_events, 3)
+        self.assertEqual(storage_manager.store_event.call_count, 3)
+
+    def test_primary_secondary(self):
+        records = sorted(create_records(PRIMARY) +
+                         create_records(SECONDARY, offset=10))
+        daq = self.create_daq(
+            records, replay.ReplayPrimarySecondaryDataAcquisition,
+            primary=PRIMARY, secondary=SECONDARY)
+        daq.run()
+        self.assertEqual(daq.n_messages, 20)
+        self.assertEqual(daq.n_events, 3)
+
+    def test_replay_is_deterministic(self):
+        results = []
+        for speed in None, 1000.:
+            storage_manager = Mock()
+            daq = self.create_daq(create_records(PRIMARY), speed=speed,
+                                  storage_manager=storage_manager)
+            daq.run()
+            results.append([call[0][0].ext_timestamp for call in
+                            storage_manager.store_event.call_args_list])
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import struct
+import unittest
+
+from pysparc import ring_buffer, messages
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def setUp(self):
+        self.buff = ring_buffer.RingBuffer(capacity=8, compact_threshold=4)
+
+    def test_empty_buffer(self):
+        self.assertEqual(len(self.buff), 0)
+        self.assertEqual(str(self.buff), '')
+
+    def test_extend(self):
+        self.buff.extend('foo')
+        self.buff.extend(bytearray('bar'))
+        self.assertEqual(len(self.buff), 6)
+        self.assertEqual(str(self.buff), 'foobar')
+
+    def test_getitem(self):
+        self.buff.extend('foobar')
+        del self.buff[:2]
+        self.assertEqual(self.buff[0], ord('o'))
+        self.assertEqual(self.buff[-1], ord('r'))
+        self.assertEqual(self.buff[1:3], bytearray('ba'))
+        self.assertEqual(self.buff[:100], bytearray('obar'))
+        self.assertRaises(IndexError, self.buff.__getitem__, 4)
+
+    def test_delete_front_moves_read_cursor(self):
+        self.buff.extend('foobar')
+        data = self.buff._data
+        del self.buff[:3]
+        del self.buff[0]
+        self.assertEqual(str(self.buff), 'ar')
+        # no data was shifted
+        self.assertIs(self.buff._data, data)
+        self.assertEqual(self.buff._read, 4)
+
+    def test_delete_all(self):
+        self.buff.extend('foobar')
+        del self.buff[:]
+        self.assertEqual(len(self.buff), 0)
+        self.assertEqual(self.buff._read, 0)
+        self.assertEqual(self.buff._write, 0)
+
+    def test_delete_only_from_front(self):
+        self.buff.extend('foobar')
+        self.assertRaises(ValueError, self.buff.__delitem__, slice(1, 3))
+        self.assertRaises(ValueError, self.buff.__delitem__, 2)
+
+    def test_index_and_find(self):
+        self.buff.extend('foobar')
+        del self.buff[:2]
+        self.assertEqual(self.buff.index('b'), 1)
+        self.assertEqual(self.buff.find('f'), -1)
+        self.assertRaises(ValueError, self.buff.index, 'f')
+        self.assertTrue(self.buff.startswith('ob'))
+        self.assertFalse(self.buff.startswith('fo'))
+
+    def test_grows_if_below_compact_threshold(self):
+        self.buff.extend('foobar')
+        del self.buff[:2]
+        self.buff.extend('bazbaz')
+        self.assertEqual(str(self.buff), 'obarbazbaz')
+        self.assertEqual(self.buff.n_compactions, 0)
+        self.assertEqual(self.buff.capacity, 16)
+
+    def test_compacts_if_over_compact_threshold(self):
+        self.buff.extend('foobar')
+        del self.buff[:4]
+        self.buff.extend('bazba')
+        self.assertEqual(str(self.buff), 'arbazba')
+        self.assertEqual(self.buff.n_compactions, 1)
+        self.assertEqual(self.buff.capacity, 8)
+        self.assertEqual(self.buff._read, 0)
+
+
+class RingBufferFactoryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.msg = struct.pack(messages.OneSecondMessage.msg_format, 0x99,
+                               0xa4, 1, 2, 2015, 3, 4, 5, 100, 1.5, 1, 2, 3,
+                               4, 61 * '\x00', 0x66)
+
+    def test_factory_consumes_messages(self):
+        buff = ring_buffer.RingBuffer()
+        buff.extend('\x01\x02' + self.msg + self.msg + self.msg[:10])
+
+        msg = messages.HisparcMessageFactory(buff)
+        self.assertIsInstance(msg, messages.OneSecondMessage)
+        self.assertEqual(msg.gps_year, 2015)
+        msg = messages.HisparcMessageFactory(buff)
+        self.assertIsInstance(msg, messages.OneSecondMessage)
+        # partial message
+        self.assertIs(messages.HisparcMessageFactory(buff), None)
+        self.assertEqual(len(buff), 10)
+
+        buff.extend(self.msg[10:])
+        msg = messages.HisparcMessageFactory(buff)
+        self.assertIsInstance(msg, messages.OneSecondMessage)
+        self.assertEqual(len(buff), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
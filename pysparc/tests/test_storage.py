@@ -1,3 +1,6 @@
+import os
+import shutil
+import tempfile
 import unittest
 import cPickle as pickle
 import hashlib
@@ -6,8 +9,10 @@ import threading
 from mock import Mock, patch, sentinel, call
 
 import redis
+import tables
 
-from pysparc import storage
+from pysparc import events, storage
+from pysparc.tests.test_events import cook, generate_messages
 
 
 class StorageManagerTest(unittest.TestCase):
@@ -395,5 +400,35 @@ class StorageWorkerThreadingTest(unittest.TestCase):
             yield None
 
 
+class TablesDataStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.path = os.path.join(self.tmpdir, 'data.h5')
+        cooked = cook(events.Stew(), generate_messages())
+        mixed = [events.FourChannelEvent(primary, secondary)
+                 for primary, secondary in zip(cooked[:5], cooked[5:10])]
+        self.events = cooked[10:] + mixed
+
+    def test_store_batch_is_identical_to_store_event(self):
+        datastore = storage.TablesDataStore(self.path, 'event')
+        for event in self.events:
+            datastore.store_event(event)
+        datastore.close()
+
+        datastore = storage.TablesDataStore(self.path, 'batch')
+        datastore.store_batch(events.EventBatch.from_events(self.events))
+        datastore.close()
+
+        with tables.open_file(self.path) as data:
+            expected = data.root.event.events.read()
+            actual = data.root.batch.events.read()
+            self.assertEqual(len(actual), len(self.events))
+            self.assertEqual(actual.tolist(), expected.tolist())
+            self.assertEqual(data.root.batch.blobs.read(),
+                             data.root.event.blobs.read())
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,184 @@
+import unittest
+
+import numpy as np
+
+from pysparc import stream_generator, messages, events
+from pysparc.ring_buffer import RingBuffer
+
+
+def parse_all(data):
+    buff = RingBuffer()
+    buff.extend(data)
+    msgs = []
+    while True:
+        msg = messages.HisparcMessageFactory(buff)
+        if msg is None:
+            return msgs
+        msgs.append(msg)
+
+
+class PackTracesTest(unittest.TestCase):
+
+    def test_pack_is_inverse_of_unpack(self):
+        traces = np.random.randint(0, 4096, size=(3, 2, 10))
+        packed = stream_generator.pack_traces(traces)
+        self.assertEqual(packed.shape, (3, 2, 15))
+        self.assertEqual(packed.dtype, np.uint8)
+        np.testing.assert_array_equal(messages.unpack_raw_traces(packed),
+                                      traces)
+
+    def test_pack_known_values(self):
+        packed = stream_generator.pack_traces([0xabc, 0x123])
+        self.assertEqual(packed.tostring(), '\xab\xc1\x23')
+
+    def test_pack_raises_on_invalid_traces(self):
+        self.assertRaises(ValueError, stream_generator.pack_traces, [1, 2, 3])
+        self.assertRaises(ValueError, stream_generator.pack_traces, [1, 4096])
+        self.assertRaises(ValueError, stream_generator.pack_traces, [-1, 2])
+
+
+class PulseTemplateTest(unittest.TestCase):
+
+    def test_pulse_template(self):
+        pulse = stream_generator.pulse_template(rise_time=2., decay_time=20.)
+        self.assertEqual(pulse.max(), 1.)
+        self.assertEqual(pulse[0], 0.)
+        self.assertTrue(pulse[-1] < .01)
+
+    def test_invalid_time_constants(self):
+        self.assertRaises(ValueError, stream_generator.pulse_template,
+                          rise_time=20., decay_time=2.)
+
+
+class EncodeMessagesTest(unittest.TestCase):
+
+    def test_one_second_message(self):
+        data = stream_generator.encode_one_second_message(
+            1422759845, 200000123, 1.5, (1, 2, 3, 4), 'foo',
+            synchronization_error=True)
+        msg, = parse_all(data)
+        self.assertIsInstance(msg, messages.OneSecondMessage)
+        self.assertEqual(msg.timestamp, 1422759845)
+        self.assertEqual(msg.count_ticks_PPS, 200000123 | (1 << 31))
+        self.assertEqual(msg.quantization_error, 1.5)
+        self.assertEqual((msg.count_ch1_low, msg.count_ch1_high,
+                          msg.count_ch2_low, msg.count_ch2_high),
+                         (1, 2, 3, 4))
+        self.assertEqual(msg.satellite_info, 'foo' + 58 * '\x00')
+
+    def test_measured_data_message(self):
+        traces = np.random.randint(0, 4096, size=(2, 6))
+        data = stream_generator.encode_measured_data_message(
+            1422759845, 100, stream_generator.pack_traces(traces), 1, 1, 1,
+            trigger_pattern=5)
+        msg, = parse_all(data)
+        self.assertIsInstance(msg, messages.MeasuredDataMessage)
+        self.assertEqual(msg.timestamp, 1422759845)
+        self.assertEqual(msg.nanoseconds, 500)
+        self.assertEqual(msg.trigger_pattern, 5)
+        np.testing.assert_array_equal(msg.traces, traces)
+
+    def test_measured_data_message_checks_traces(self):
+        packed = stream_generator.pack_traces(np.zeros((2, 6), dtype=int))
+        self.assertRaises(ValueError,
+                          stream_generator.encode_measured_data_message,
+                          1422759845, 100, packed, 1, 1, 2)
+
+    def test_control_parameter_list(self):
+        data = stream_generator.encode_control_parameter_list(
+            1422759845, ch1_voltage=200, ch2_threshold_high=400,
+            gps_latitude=52., firmware_version=21, serial_number=512)
+        msg, = parse_all(data)
+        self.assertIsInstance(msg, messages.ControlParameterList)
+        self.assertEqual(msg.ch1_voltage, 200)
+        self.assertEqual(msg.ch2_threshold_high, 400)
+        self.assertEqual(msg.ch1_threshold_low, 250)
+        self.assertAlmostEqual(msg.gps_latitude, 52.)
+        self.assertEqual(msg.gps_seconds, 5)
+        self.assertEqual(msg.firmware_version, 21)
+        self.assertEqual(msg.serial_number, 512)
+
+    def test_control_parameter_list_unknown_parameter(self):
+        self.assertRaises(TypeError,
+                          stream_generator.encode_control_parameter_list,
+                          1422759845, foo=1)
+
+
+class StreamGeneratorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.generator = stream_generator.StreamGenerator(
+            trigger_rate=20, pre_coincidence_time=10, coincidence_time=20,
+            post_coincidence_time=20, seed=1)
+
+    def test_generate(self):
+        msgs = parse_all(self.generator.generate(3))
+        one_second = [msg for msg in msgs
+                      if isinstance(msg, messages.OneSecondMessage)]
+        self.assertEqual([msg.timestamp for msg in one_second],
+                         [1422759845, 1422759846, 1422759847])
+        self.assertEqual(len(msgs), 3 + self.generator.n_events)
+        self.assertEqual(self.generator.n_one_second_messages, 3)
+
+    def test_traces_have_pulses(self):
+        msgs = parse_all(self.generator.encode_second([1000.]))
+        event = msgs[1]
+        self.assertEqual(event.traces.shape, (2, 100))
+        trigger = 2 * 10
+        for trace in event.traces:
+            self.assertTrue(abs(trace[:trigger].mean() - 200) < 5)
+            self.assertTrue(trace[trigger:].max() > trace[:trigger].max())
+
+    def test_stew_reconstructs_trigger_times(self):
+        generator = stream_generator.StreamGenerator(
+            trigger_rate=20, pre_coincidence_time=10, coincidence_time=20,
+            post_coincidence_time=20, clock_drift=1e-5,
+            synchronization_error_rate=.5, seed=2)
+        stew = events.Stew()
+        expected = []
+        for i in range(5):
+            data = generator.encode_second()
+            expected.extend((generator.timestamp - 1) * int(1e9) + t
+                            for t in generator.last_trigger_times)
+            for msg in parse_all(data):
+                if isinstance(msg, messages.OneSecondMessage):
+                    stew.add_one_second_message(msg)
+                else:
+                    stew.add_event_message(msg)
+        stew.stir()
+        cooked = sorted(event.ext_timestamp for event in stew.serve_events())
+        # events of the last two seconds can not be cooked yet
+        n_events = len(cooked)
+        self.assertTrue(n_events > 0)
+        # the stew adds one second, and the clock has 5 ns resolution
+        actual = np.array(cooked) - int(1e9)
+        np.testing.assert_allclose(actual, expected[:n_events], atol=5)
+
+    def test_corruption_is_recovered(self):
+        generator = stream_generator.StreamGenerator(
+            trigger_rate=100, pre_coincidence_time=10, coincidence_time=20,
+            post_coincidence_time=20, corruption_rate=.1, seed=3)
+        data = generator.generate(5)
+        self.assertTrue(generator.n_corrupted > 0)
+        # a corrupted window length can make the parser wait for a very
+        # long message, so follow up with plenty of clean data
+        generator.corruption_rate = 0.
+        n_messages = generator.n_events + generator.n_one_second_messages
+        data += generator.generate(20)
+        n_clean = (generator.n_events + generator.n_one_second_messages -
+                   n_messages)
+        msgs = parse_all(data)
+        self.assertTrue(n_clean < len(msgs) <
+                        generator.n_events + generator.n_one_second_messages)
+        self.assertEqual(msgs[-1].timestamp, generator.timestamp - 1)
+
+    def test_deterministic_with_seed(self):
+        kwargs = dict(trigger_rate=20, pre_coincidence_time=10,
+                      coincidence_time=20, post_coincidence_time=20, seed=4)
+        data1 = stream_generator.StreamGenerator(**kwargs).generate(2)
+        data2 = stream_generator.StreamGenerator(**kwargs).generate(2)
+        self.assertEqual(data1, data2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,92 @@
+"""Benchmark the analysis of events in a pool of worker processes
+
+Analyze events with long traces (2 + 5 + 10 us coincidence window) in
+the main process, and in an EventAnalysisPool with an increasing number
+of worker processes, and report the throughput in events per second.
+The CPU time used by the main process is reported as well, since with a
+pool the main process only sends the raw traces to the workers and
+creates the events.  The throughput can only scale with the number of
+workers on a machine with several CPU cores.
+
+Usage: python benchmark_event_pool.py [number of events]
+
+"""
+
+from __future__ import division
+
+import multiprocessing
+import sys
+import time
+
+from pysparc.events import Event, EventAnalysisPool
+from pysparc.messages import HisparcMessageFactory, MeasuredDataMessage
+from pysparc.ring_buffer import RingBuffer
+from pysparc.stream_generator import StreamGenerator
+
+
+N_EVENTS = 200
+# coincidence window in units of 5 ns
+PRE_COINCIDENCE_TIME = 400
+COINCIDENCE_TIME = 1000
+POST_COINCIDENCE_TIME = 2000
+
+
+def generate_messages(n_events):
+    generator = StreamGenerator(
+        trigger_rate=n_events, pre_coincidence_time=PRE_COINCIDENCE_TIME,
+        coincidence_time=COINCIDENCE_TIME,
+        post_coincidence_time=POST_COINCIDENCE_TIME, seed=1)
+    buff = RingBuffer()
+    buff.extend(generator.encode_second())
+    msgs = []
+    while True:
+        msg = HisparcMessageFactory(buff)
+        if msg is None:
+            return msgs
+        if isinstance(msg, MeasuredDataMessage):
+            msgs.append(msg)
+
+
+def benchmark_serial(msgs):
+    t0 = time.time()
+    c0 = time.clock()
+    for msg in msgs:
+        Event(msg)
+    return len(msgs) / (time.time() - t0), len(msgs) / (time.clock() - c0)
+
+
+def benchmark_pool(msgs, processes):
+    pool = EventAnalysisPool(processes)
+    try:
+        # start up the workers
+        pool.analyze(msgs[:processes])
+        t0 = time.time()
+        c0 = time.clock()
+        analyses = pool.analyze(msgs)
+        for msg, analysis in zip(msgs, analyses):
+            Event(msg, analysis=analysis)
+        return len(msgs) / (time.time() - t0), len(msgs) / (time.clock() - c0)
+    finally:
+        pool.close()
+
+
+def main():
+    if len(sys.argv) > 1:
+        n_events = int(sys.argv[1])
+    else:
+        n_events = N_EVENTS
+    msgs = generate_messages(n_events)
+    print "%d events, %d samples per trace, %d CPU cores" % (
+        len(msgs), len(msgs[0].trace_ch1), multiprocessing.cpu_count())
+
+    # new messages for each run, since the messages cache their traces
+    print "main process: %6.1f events/s  (main process CPU: %7.1f " \
+          "events/s)" % benchmark_serial(generate_messages(n_events))
+    for processes in range(1, multiprocessing.cpu_count() + 1):
+        rates = benchmark_pool(generate_messages(n_events), processes)
+        print "%d workers:    %6.1f events/s  (main process CPU: %7.1f " \
+              "events/s)" % ((processes,) + rates)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Benchmark extraction of TSIP packets from the GPS read buffer
+
+The Trimble GPS sends its packets at 9600 baud.  Compare extracting the
+packets from a plain bytearray, which is rescanned from the start on
+every call and shifted after every packet, with a TSIPBuffer, which scans
+incrementally and consumes packets by moving a read cursor.  Two cases are
+measured: extracting a backlog of packets which accumulated while nobody
+read the GPS, and extracting packets while the data trickles in.
+
+"""
+
+from __future__ import division
+
+import struct
+import time
+
+from pysparc.gps_messages import GPSMessage, SupplementalTimingPacket, \
+    TSIPBuffer
+
+
+N_PACKETS = 20000
+# bytes per read while the data trickles in
+TRICKLE_SIZE = 16
+
+
+def create_packet():
+    msg = struct.pack(SupplementalTimingPacket.msg_format, 0x8fac, 7, 0,
+                      100, 0, 0, 0, 0, 0, 0, 0, 16., 3., 0, 0, 40.,
+                      0.9139, 0.0864, 56., 16., '')
+    return '\x10' + msg.replace('\x10', '\x10\x10') + '\x10\x03'
+
+
+def extract_all(buff):
+    n_packets = 0
+    while GPSMessage.extract_message_from_buffer(buff) is not None:
+        n_packets += 1
+    return n_packets
+
+
+def main():
+    data = N_PACKETS * create_packet()
+    print "%d packets, %d bytes" % (N_PACKETS, len(data))
+
+    for buffer_type in bytearray, TSIPBuffer:
+        buff = buffer_type()
+        buff.extend(data)
+        t0 = time.time()
+        n_packets = extract_all(buff)
+        t = time.time() - t0
+        print "%-10s backlog: %d packets in %.3f s (%.1f us/packet)" % (
+            buffer_type.__name__, n_packets, t, 1e6 * t / n_packets)
+
+        buff = buffer_type()
+        n_packets = 0
+        t0 = time.time()
+        for idx in range(0, len(data), TRICKLE_SIZE):
+            buff.extend(data[idx:idx + TRICKLE_SIZE])
+            n_packets += extract_all(buff)
+        t = time.time() - t0
+        print "%-10s trickle: %d packets in %.3f s (%.1f us/packet)" % (
+            buffer_type.__name__, n_packets, t, 1e6 * t / n_packets)
+
+
+if __name__ == '__main__':
+    main()
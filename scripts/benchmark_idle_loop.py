@@ -0,0 +1,154 @@
+"""Benchmark the CPU usage and latency of the data acquisition main loop
+
+A fake HiSPARC device delivers synthetic messages in real time, at a low
+trigger rate.  Like the FTDI chip, a read returns all data that arrived
+since the previous read, or an empty string.  Three variants of the main
+loop of pysparc_daq are compared:
+
+busy
+    read the device continuously, without ever sleeping (the old loop).
+sleep
+    sleep briefly after a read which returned no messages.
+reader
+    read the device in a reader thread, and block until data is
+    available.
+
+For each variant, the CPU usage of the process (including all threads) and
+the latency between the arrival of a message at the device and its
+processing by the main loop are reported.
+
+Usage: python benchmark_idle_loop.py [seconds per variant]
+
+"""
+
+from __future__ import division
+
+import collections
+import resource
+import sys
+import time
+
+import numpy as np
+
+from pysparc.hardware import HiSPARCII, DataAvailable
+from pysparc.stream_generator import (StreamGenerator,
+                                      encode_one_second_message)
+
+
+TRIGGER_RATE = 2
+N_SECONDS = 10
+# as in bin/pysparc_daq
+MAX_IDLE_WAIT = 1.
+IDLE_SLEEP = .005
+
+
+class FakeChip(object):
+
+    """Stand-in for a FtdiChip, delivering generated messages in real time.
+
+    Each message is delivered at its trigger time.  The arrival times of
+    all delivered messages are kept, to measure the latency.
+
+    """
+
+    closed = False
+    latency_timer = None
+
+    def __init__(self, trigger_rate, seed=1):
+        self.generator = StreamGenerator(trigger_rate, seed=seed)
+        # create the noise table in advance
+        self.generator.create_traces(1)
+        self.one_second_size = len(encode_one_second_message(0))
+        self.t_start = time.time()
+        self.n_seconds = 0
+        self.pending = collections.deque()
+        self.arrival_times = collections.deque()
+
+    def read(self, read_size=None):
+        now = time.time()
+        while now - self.t_start >= self.n_seconds:
+            self._generate_second()
+        chunks = []
+        while self.pending and self.pending[0][0] <= now:
+            t, frame = self.pending.popleft()
+            self.arrival_times.append(t)
+            chunks.append(frame)
+        return ''.join(chunks)
+
+    def _generate_second(self):
+        trigger_times = np.sort(self.generator.trigger_times())
+        data = self.generator.encode_second(trigger_times)
+        t_pps = self.t_start + self.n_seconds
+        self.pending.append((t_pps, data[:self.one_second_size]))
+        events = data[self.one_second_size:]
+        if len(trigger_times):
+            size = len(events) // len(trigger_times)
+            for idx, t in enumerate(trigger_times):
+                self.pending.append((t_pps + t * 1e-9,
+                                     events[idx * size:(idx + 1) * size]))
+        self.n_seconds += 1
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def set_latency_timer(self, latency):
+        self.latency_timer = latency
+
+    def close(self):
+        self.closed = True
+
+
+class FakeHiSPARCII(HiSPARCII):
+
+    def open(self):
+        self._device = FakeChip(TRIGGER_RATE)
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_loop(variant, duration):
+    device = FakeHiSPARCII()
+    chip = device._device
+    data_available = DataAvailable()
+    if variant == 'reader':
+        device.start_reader(data_available=data_available)
+
+    latencies = []
+    t0, cpu0 = time.time(), cpu_time()
+    while time.time() - t0 < duration:
+        msgs = device.read_messages()
+        now = time.time()
+        for msg in msgs:
+            latencies.append(now - chip.arrival_times.popleft())
+        if not msgs:
+            if variant == 'sleep':
+                time.sleep(IDLE_SLEEP)
+            elif variant == 'reader':
+                data_available.wait(MAX_IDLE_WAIT)
+                data_available.clear()
+    t, cpu = time.time() - t0, cpu_time() - cpu0
+    device.close()
+
+    latencies = 1e3 * np.array(latencies)
+    print "%-6s  CPU: %5.1f %%  latency: mean %5.2f ms, max %5.2f ms " \
+          "(%d messages)" % (variant, 100 * cpu / t, latencies.mean(),
+                             latencies.max(), len(latencies))
+
+
+def main():
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    else:
+        duration = N_SECONDS
+    for variant in 'busy', 'sleep', 'reader':
+        run_loop(variant, duration)
+
+
+if __name__ == '__main__':
+    main()
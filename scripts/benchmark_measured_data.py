@@ -0,0 +1,133 @@
+"""Benchmark parsing of measured data messages
+
+Compare the zero-copy MeasuredDataMessage with the previous
+implementation, which copied the message header and traces into several
+intermediate strings.  A synthetic stream of one second of events at a
+trigger rate of 10 kHz is parsed, and the traces are unpacked.  Each
+implementation runs in a separate process, so the growth of the maximum
+resident set size can be compared.
+
+"""
+
+from __future__ import division
+
+import calendar
+import datetime
+import multiprocessing
+import resource
+import struct
+import time
+
+import numpy as np
+
+from pysparc import messages
+from pysparc.ring_buffer import RingBuffer
+
+
+TRIGGER_RATE = 10000
+# pre, coincidence and post times in units of 5 ns (1 us, 2 us and 2 us)
+PRE, COINCIDENCE, POST = 200, 400, 400
+
+
+class LegacyMeasuredDataMessage(messages.MeasuredDataMessage):
+
+    """Previous implementation, copying the traces several times."""
+
+    def parse_message(self, buff):
+        msg_length = struct.calcsize(self.msg_format)
+        str_buff = str(buff[:msg_length])
+
+        (header, identifier, self.trigger_condition, self.trigger_pattern,
+         self.pre_coincidence_time, self.coincidence_time,
+         self.post_coincidence_time, self.gps_day, self.gps_month,
+         self.gps_year, self.gps_hours, self.gps_minutes,
+         self.gps_seconds, self.count_ticks_PPS) = \
+            struct.unpack_from(self.msg_format, str_buff)
+
+        event_length = (self.pre_coincidence_time + self.coincidence_time +
+                        self.post_coincidence_time)
+        trace_length = 3 * event_length
+        msg_tail_format = '>%dsB' % (2 * trace_length)
+        msg_tail_length = struct.calcsize(msg_tail_format)
+        total_length = msg_length + msg_tail_length
+        str_buff = str(buff[msg_length:total_length])
+
+        self._raw_traces, end = struct.unpack_from(msg_tail_format, str_buff)
+
+        self.validate_codons_and_id(header, identifier, end)
+
+        self.trace_length = trace_length
+        self.datetime = datetime.datetime(self.gps_year, self.gps_month,
+                                          self.gps_day, self.gps_hours,
+                                          self.gps_minutes,
+                                          self.gps_seconds)
+        self.timestamp = calendar.timegm(self.datetime.utctimetuple())
+        self.nanoseconds = self.count_ticks_PPS * 5
+
+        del buff[:total_length]
+
+    @property
+    def raw_traces(self):
+        return self._raw_traces
+
+    def _unpack_raw_trace(self, raw_trace):
+        byte_values = np.fromstring(raw_trace, dtype=np.uint8)
+        values = byte_values.astype(np.int16)
+        a1 = (values[::3] << 4) + (values[1::3] >> 4)
+        a2 = ((values[1::3] & 0x0f) << 8) + values[2::3]
+        return np.dstack((a1, a2)).ravel()
+
+
+def pack_trace(trace):
+    a1, a2 = trace[::2], trace[1::2]
+    packed = np.vstack([a1 >> 4, ((a1 & 0xf) << 4) | (a2 >> 8), a2 & 0xff])
+    return packed.T.astype(np.uint8).tostring()
+
+
+def create_stream():
+    n_samples = 2 * (PRE + COINCIDENCE + POST)
+    stream = bytearray()
+    for i in range(TRIGGER_RATE):
+        header = struct.pack(messages.MeasuredDataMessage.msg_format, 0x99,
+                             0xa0, 2, 3, PRE, COINCIDENCE, POST, 1, 2, 2015,
+                             3, 4, 5, i * 20000)
+        traces = np.random.randint(190, 4096, size=(2, n_samples))
+        stream.extend(header + pack_trace(traces[0]) +
+                      pack_trace(traces[1]) + '\x66')
+    return stream
+
+
+def parse_stream(cls, stream, results):
+    buff = RingBuffer()
+    buff.extend(stream)
+    del stream
+
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t0 = time.time()
+    msgs = []
+    while len(buff):
+        msg = cls(buff)
+        msg.trace_ch1, msg.trace_ch2
+        msgs.append(msg)
+    t = time.time() - t0
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - maxrss
+    results.put((len(msgs), t, maxrss))
+
+
+def main():
+    stream = create_stream()
+    print "Stream of %d events, %d bytes" % (TRIGGER_RATE, len(stream))
+
+    for cls in LegacyMeasuredDataMessage, messages.MeasuredDataMessage:
+        results = multiprocessing.Queue()
+        process = multiprocessing.Process(target=parse_stream,
+                                          args=(cls, stream, results))
+        process.start()
+        n_msgs, t, maxrss = results.get()
+        process.join()
+        print "%-25s %.3f s (%.0f events/s), max RSS growth: %d kB" % (
+            cls.__name__, t, n_msgs / t, maxrss)
+
+
+if __name__ == '__main__':
+    main()
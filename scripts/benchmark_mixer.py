@@ -0,0 +1,124 @@
+"""Benchmark mixing primary and secondary events
+
+Events are generated for a primary and secondary board at a high trigger
+rate.  Most showers trigger both boards, with realistic clock jitter
+between the boards; the other events trigger only one board.  Each
+second, the events of that second are added to a mixer and mixed, like
+in pysparc_daq.  The matching by comparing each secondary event with all
+primary events, which was used before, is compared with the sorted
+matching of pysparc.events.Mixer.  Both must mix the same events.
+
+Usage: python benchmark_mixer.py [trigger rate] [seconds]
+
+"""
+
+from __future__ import division
+
+import sys
+import time
+
+import numpy as np
+
+from pysparc.events import Mixer, FourChannelEvent, MAX_FOUR_CHANNEL_DELAY
+from pysparc.stream_generator import FakeEvent
+
+
+TRIGGER_RATE = 200
+N_SECONDS = 20
+# fraction of the events which trigger both boards
+COINCIDENCE_FRACTION = .9
+# standard deviation of the clock jitter between the boards, in ns
+CLOCK_JITTER = 20.
+
+
+class BruteForceMixer(Mixer):
+
+    """Mixer which compares each secondary with all primary events.
+
+    The events are visited in trigger order, so that the result is
+    deterministic and can be compared with the sorted matching.
+
+    """
+
+    def mix(self):
+        primary_timestamps = sorted(self._primary_events)
+        if primary_timestamps:
+            for timestamp in sorted(self._secondary_events):
+                secondary_event = self._secondary_events[timestamp]
+                delta_t = [abs(u - timestamp) for u in primary_timestamps]
+                min_delta_t = min(delta_t)
+
+                if min_delta_t < MAX_FOUR_CHANNEL_DELAY:
+                    primary_idx = delta_t.index(min_delta_t)
+                    nearest_timestamp = primary_timestamps[primary_idx]
+                    primary_event = self._primary_events[nearest_timestamp]
+
+                    mixed_event = FourChannelEvent(primary_event,
+                                                   secondary_event)
+                    self._mixed_events.append(mixed_event)
+
+                    del self._secondary_events[timestamp]
+                    del self._primary_events[nearest_timestamp]
+                    del primary_timestamps[primary_idx]
+
+
+def generate_events(trigger_rate, n_seconds, seed=1):
+    """Generate the primary and secondary events of each second."""
+
+    random = np.random.RandomState(seed)
+    t0 = 1400000000 * int(1e9)
+    seconds = []
+    for second in range(n_seconds):
+        start = t0 + second * int(1e9)
+        n_events = random.poisson(trigger_rate)
+        times = start + np.sort(random.randint(0, int(1e9), n_events))
+        both = random.uniform(size=n_events) < COINCIDENCE_FRACTION
+        primary = random.uniform(size=n_events) < .5
+        jitter = random.normal(0, CLOCK_JITTER, n_events).astype(int)
+        primary_events = [FakeEvent(int(t))
+                          for t in times[both | primary]]
+        secondary_events = [FakeEvent(int(t))
+                            for t in (times + jitter)[both | ~primary]]
+        seconds.append((primary_events, secondary_events))
+    return seconds
+
+
+def benchmark(mixer, seconds):
+    mixed = []
+    t0 = time.time()
+    for primary_events, secondary_events in seconds:
+        mixer.add_primary_events(primary_events)
+        mixer.add_secondary_events(secondary_events)
+        mixer.mix()
+        mixed.extend(mixer.serve_events())
+    t = time.time() - t0
+    pairs = sorted((event.ext_timestamp, event.trace_ch3[0])
+                   for event in mixed)
+    return pairs, len(mixed) / t
+
+
+def main():
+    trigger_rate = TRIGGER_RATE
+    n_seconds = N_SECONDS
+    if len(sys.argv) > 1:
+        trigger_rate = int(sys.argv[1])
+    if len(sys.argv) > 2:
+        n_seconds = int(sys.argv[2])
+
+    seconds = generate_events(trigger_rate, n_seconds)
+    n_primary = sum(len(primary) for primary, _ in seconds)
+    n_secondary = sum(len(secondary) for _, secondary in seconds)
+    print "%d primary and %d secondary events in %d seconds" % (
+        n_primary, n_secondary, n_seconds)
+
+    expected, rate = benchmark(BruteForceMixer(), seconds)
+    print "brute force: %9.1f mixed events/s (%d mixed)" % (
+        rate, len(expected))
+    pairs, rate = benchmark(Mixer(), seconds)
+    print "sorted:      %9.1f mixed events/s (%d mixed)" % (
+        rate, len(pairs))
+    assert pairs == expected
+
+
+if __name__ == '__main__':
+    main()
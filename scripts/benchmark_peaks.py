@@ -0,0 +1,96 @@
+"""Benchmark counting the peaks in traces
+
+Count the peaks in traces with a long coincidence window (2 + 5 + 10 us)
+with the per-sample loop which was used before, and with the block-wise
+implementation in pysparc.events.  Both must return the same number of
+peaks.
+
+Usage: python benchmark_peaks.py [number of events]
+
+"""
+
+from __future__ import division
+
+import sys
+import time
+
+import numpy as np
+
+from pysparc import events
+from pysparc.messages import HisparcMessageFactory, MeasuredDataMessage
+from pysparc.ring_buffer import RingBuffer
+from pysparc.stream_generator import StreamGenerator
+
+
+N_EVENTS = 100
+# coincidence window in units of 5 ns
+PRE_COINCIDENCE_TIME = 400
+COINCIDENCE_TIME = 1000
+POST_COINCIDENCE_TIME = 2000
+
+
+def generate_traces(n_events):
+    generator = StreamGenerator(
+        trigger_rate=n_events, pre_coincidence_time=PRE_COINCIDENCE_TIME,
+        coincidence_time=COINCIDENCE_TIME,
+        post_coincidence_time=POST_COINCIDENCE_TIME, seed=1)
+    buff = RingBuffer()
+    buff.extend(generator.encode_second())
+    traces = []
+    while True:
+        msg = HisparcMessageFactory(buff)
+        if msg is None:
+            return traces
+        if isinstance(msg, MeasuredDataMessage):
+            traces.extend([msg.trace_ch1, msg.trace_ch2])
+
+
+def count_peaks_loop(traces, baselines):
+    n_peaks = []
+    for trace, baseline in zip(traces, baselines):
+        n_peak = 0
+        in_peak = False
+        local_minimum = 0
+        peak_threshold = events.PEAK_THRESHOLD + baseline
+        for value in trace:
+            if not in_peak:
+                if value < local_minimum:
+                    local_minimum = value if value > 0 else 0
+                elif value - local_minimum > peak_threshold:
+                    in_peak = True
+                    local_maximum = value
+                    n_peak += 1
+            else:
+                if value > local_maximum:
+                    local_maximum = value
+                elif local_maximum - value > peak_threshold:
+                    in_peak = False
+                    local_minimum = value if value > 0 else 0
+        n_peaks.append(n_peak)
+    return n_peaks
+
+
+def benchmark(func, traces, baselines):
+    t0 = time.time()
+    n_peaks = func(traces, baselines)
+    return n_peaks, len(traces) / (time.time() - t0)
+
+
+def main():
+    if len(sys.argv) > 1:
+        n_events = int(sys.argv[1])
+    else:
+        n_events = N_EVENTS
+    traces = generate_traces(n_events)
+    baselines = [int(np.round(trace[:100].mean())) for trace in traces]
+    print "%d traces, %d samples per trace" % (len(traces), len(traces[0]))
+
+    expected, rate = benchmark(count_peaks_loop, traces, baselines)
+    print "per-sample loop: %8.1f traces/s" % rate
+    n_peaks, rate = benchmark(events._calculate_n_peaks, traces, baselines)
+    print "block-wise:      %8.1f traces/s" % rate
+    assert n_peaks == expected
+
+
+if __name__ == '__main__':
+    main()
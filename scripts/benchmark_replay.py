@@ -0,0 +1,99 @@
+"""Benchmark the full data acquisition pipeline by replaying a capture
+
+Replay a capture log of a primary (and secondary, if present) device as
+fast as possible through the data acquisition of pysparc_daq, and report
+the throughput in events per second and the CPU time per event.  If no
+capture is given, a synthetic capture of a primary and secondary device
+is created in a temporary directory.
+
+Usage: python benchmark_replay.py [capture prefix]
+
+"""
+
+from __future__ import division
+
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from pysparc.capture import CaptureWriter, CaptureReader
+from pysparc.hardware import READ_SIZE
+from pysparc.daq import SYSTEM_CONFIGFILE
+from pysparc.replay import (Replay, ReplayDataAcquisition,
+                            ReplayPrimarySecondaryDataAcquisition)
+from pysparc.stream_generator import StreamGenerator
+
+
+PRIMARY = "HiSPARC II Master"
+SECONDARY = "HiSPARC II Slave"
+
+N_SECONDS = 10
+TRIGGER_RATE = 200
+# delay of the secondary triggers, in ns
+SECONDARY_DELAY = 10
+
+
+def create_capture(prefix):
+    writer = CaptureWriter(prefix)
+    primary = StreamGenerator(TRIGGER_RATE, seed=1)
+    secondary = StreamGenerator(TRIGGER_RATE, seed=2)
+    for seconds in range(N_SECONDS):
+        trigger_times = primary.trigger_times()
+        for description, data in [
+                (PRIMARY, primary.encode_second(trigger_times)),
+                (SECONDARY, secondary.encode_second(trigger_times +
+                                                    SECONDARY_DELAY))]:
+            for idx in range(0, len(data), READ_SIZE):
+                writer.write(description, data[idx:idx + READ_SIZE],
+                             1000. + seconds)
+    writer.close()
+
+
+def cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def replay_capture(prefix):
+    reader = CaptureReader(prefix)
+    descriptions = set(description for t, description, data in reader)
+    replay = Replay(reader)
+    if SECONDARY in descriptions:
+        daq = ReplayPrimarySecondaryDataAcquisition(
+            replay, PRIMARY, SECONDARY, config_files=[SYSTEM_CONFIGFILE])
+    else:
+        daq = ReplayDataAcquisition(replay, PRIMARY,
+                                    config_files=[SYSTEM_CONFIGFILE])
+
+    try:
+        t0, cpu0 = time.time(), cpu_time()
+        daq.run()
+        t, cpu = time.time() - t0, cpu_time() - cpu0
+    finally:
+        daq.close()
+
+    print "Replayed %d bytes, %d messages, %d events" % (
+        replay.n_bytes, daq.n_messages, daq.n_events)
+    print "Wall time: %.2f s (%.0f events/s)" % (t, daq.n_events / t)
+    print "CPU time: %.2f s (%.1f us/event)" % (
+        cpu, 1e6 * cpu / daq.n_events)
+
+
+def main():
+    if len(sys.argv) > 1:
+        replay_capture(sys.argv[1])
+    else:
+        tmpdir = tempfile.mkdtemp()
+        try:
+            prefix = os.path.join(tmpdir, 'capture')
+            create_capture(prefix)
+            replay_capture(prefix)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Benchmark message framing using a RingBuffer versus a bytearray
+
+Fill a buffer with a backlog of one-second messages and extract all
+messages using the HisparcMessageFactory.  With a plain bytearray, every
+extracted message shifts the remaining contents of the buffer, so the time
+per message grows with the size of the backlog.  With a RingBuffer, the
+time per message is constant.
+
+"""
+
+import struct
+import time
+
+from pysparc import messages
+from pysparc.hardware import READ_SIZE
+from pysparc.ring_buffer import RingBuffer
+
+
+BACKLOG_SIZES = [READ_SIZE, 16 * READ_SIZE, 64 * READ_SIZE]
+
+
+def create_message():
+    return struct.pack(messages.OneSecondMessage.msg_format, 0x99, 0xa4, 1,
+                       2, 2015, 3, 4, 5, 100, 1.5, 1, 2, 3, 4, 61 * '\x00',
+                       0x66)
+
+
+def extract_all_messages(buff):
+    n_msgs = 0
+    t0 = time.time()
+    while messages.HisparcMessageFactory(buff) is not None:
+        n_msgs += 1
+    return n_msgs, time.time() - t0
+
+
+def main():
+    msg = create_message()
+    for size in BACKLOG_SIZES:
+        data = msg * (size // len(msg))
+        for buff in bytearray(), RingBuffer():
+            buff.extend(data)
+            n_msgs, t = extract_all_messages(buff)
+            print "%-10s backlog: %7d bytes, %5d messages in %.3f s " \
+                  "(%.1f us/message)" % (type(buff).__name__, len(data),
+                                         n_msgs, t, 1e6 * t / n_msgs)
+
+
+if __name__ == '__main__':
+    main()
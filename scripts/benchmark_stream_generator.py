@@ -0,0 +1,46 @@
+"""Benchmark the synthetic HiSPARC stream generator
+
+Generate a synthetic stream at several trigger rates and report how many
+events per second can be generated, and how many events per second the
+message factory parses from the generated stream.
+
+"""
+
+from __future__ import division
+
+import time
+
+from pysparc import messages
+from pysparc.ring_buffer import RingBuffer
+from pysparc.stream_generator import StreamGenerator
+
+
+TRIGGER_RATES = [100, 1000, 5000]
+N_SECONDS = 2
+
+
+def main():
+    for trigger_rate in TRIGGER_RATES:
+        generator = StreamGenerator(trigger_rate, seed=1)
+        t0 = time.time()
+        data = generator.generate(N_SECONDS)
+        t_generate = time.time() - t0
+
+        buff = RingBuffer()
+        buff.extend(data)
+        t0 = time.time()
+        n_msgs = 0
+        while messages.HisparcMessageFactory(buff) is not None:
+            n_msgs += 1
+        t_parse = time.time() - t0
+
+        n_events = generator.n_events
+        print "%5d Hz: %6d events, %5.1f MB, generated %7.0f events/s, " \
+              "parsed %7.0f events/s" % (trigger_rate, n_events,
+                                         len(data) / 1e6,
+                                         n_events / t_generate,
+                                         n_events / t_parse)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Benchmark encoding the traces of events
+
+Serialize the traces of 2-channel and 4-channel events to comma-separated
+text, and compress them, like the zlib_trace_chN attributes of events.
+The per-sample conversion which was used before is compared with the
+table lookup in pysparc.events.  Both must produce identical results.
+
+Usage: python benchmark_trace_encoding.py [number of events]
+
+"""
+
+from __future__ import division
+
+import sys
+import time
+import zlib
+
+from pysparc import events
+from pysparc.messages import HisparcMessageFactory, MeasuredDataMessage
+from pysparc.ring_buffer import RingBuffer
+from pysparc.stream_generator import StreamGenerator
+
+
+N_EVENTS = 100
+
+
+def generate_traces(n_events):
+    generator = StreamGenerator(trigger_rate=n_events, seed=1)
+    buff = RingBuffer()
+    buff.extend(generator.encode_second())
+    traces = []
+    while True:
+        msg = HisparcMessageFactory(buff)
+        if msg is None:
+            return traces
+        if isinstance(msg, MeasuredDataMessage):
+            traces.extend([msg.trace_ch1, msg.trace_ch2])
+
+
+def serialize_loop(trace):
+    return ','.join([str(int(u)) for u in trace])
+
+
+def compress_loop(trace):
+    return zlib.compress(serialize_loop(trace))
+
+
+def benchmark(func, traces, n_channels):
+    t0 = time.time()
+    results = [func(trace) for trace in traces]
+    return results, len(traces) / n_channels / (time.time() - t0)
+
+
+def main():
+    if len(sys.argv) > 1:
+        n_events = int(sys.argv[1])
+    else:
+        n_events = N_EVENTS
+    traces = generate_traces(n_events)
+    print "%d traces, %d samples per trace" % (len(traces), len(traces[0]))
+
+    for n_channels in 2, 4:
+        for name, old, new in [
+                ('serialize', serialize_loop, events.serialize_trace),
+                ('compress', compress_loop, events.compress_trace)]:
+            expected, old_rate = benchmark(old, traces, n_channels)
+            results, new_rate = benchmark(new, traces, n_channels)
+            assert results == expected
+            print "%d-channel %-9s  per-sample: %7.1f events/s  " \
+                  "table: %7.1f events/s  (%.1fx)" % (
+                      n_channels, name, old_rate, new_rate,
+                      new_rate / old_rate)
+
+
+if __name__ == '__main__':
+    main()